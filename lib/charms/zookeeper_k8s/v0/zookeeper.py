@@ -48,13 +48,47 @@ class ZookeeperDummyClientK8SCharm(CharmBase):
         self.zookeeper = ZookeeperRequires(self, self._stored)
         self.framework.observe(self.on.zookeeper_relation_updated,
                                self._on_zookeeper_config_changed)
+
+    def _on_zookeeper_config_changed(self, event):
+        # e.g. '10.1.0.42:2181,10.1.0.43:2181/clients/my-app':
+        connection_string = self.zookeeper.connection_string
+        # Servers which appeared or disappeared, e.g. ['10.1.0.44:2181']:
+        logging.info('Added {}, removed {}'.format(event.added_servers,
+                                                   event.removed_servers))
 ```
 
+Each related application gets its own chroot, which the connection string
+includes: the application sees it as its root znode. The provider may also
+set quotas on it, which it shares as `znode-quota` and `byte-quota`.
+
+The provider also shares the Kubernetes zone of each server, and the
+connection string lists the servers in the requirer unit's zone first. Pass
+`zone=` to ZookeeperRequires to override the zone looked up from the
+Kubernetes API. Clients shuffle the servers of a connection string by
+default, so disable it to benefit from this, e.g.
+`KazooClient(hosts=connection_string, randomize_hosts=False)`.
+
+The provider also tells which optional features its servers have enabled,
+for requirers to opt in:
+
+- `local_sessions_enabled`: new sessions are local to the server they are
+  created on, which is cheaper than a quorum write but they can't move to
+  another server: they expire if the client reconnects elsewhere. If
+  `local_sessions_upgrading_enabled`, a local session becomes global when it
+  creates an ephemeral znode, which it can't otherwise.
+- `read_only_enabled`: servers cut off from the quorum keep serving reads to
+  clients connecting in read-only mode, e.g.
+  `KazooClient(hosts=connection_string, read_only=True)`.
+
 You can file bugs
 [here](https://github.com/openstack-charmers/charm-zookeeper-k8s/issues)!
 """
 
+import json
 import logging
+import os
+import ssl
+import urllib.request
 
 from ops.charm import CharmEvents, RelationChangedEvent
 from ops.framework import EventBase, EventSource, Object
@@ -67,46 +101,257 @@ LIBAPI = 0
 
 # Increment this PATCH version before using `charmcraft publish-lib` or reset
 # to 0 if you are raising the major API version
-LIBPATCH = 12
+LIBPATCH = 16
 
 INGRESS_ADDR_CLIENT_REL_DATA_KEY = 'ingress-addresses'
 INGRESS_ADDR_CLIENT_REL_DATA_SEPARATOR = ','
 PORT_CLIENT_REL_DATA_KEY = 'client-port'
+CHROOT_CLIENT_REL_DATA_KEY = 'chroot'
+ZNODE_QUOTA_CLIENT_REL_DATA_KEY = 'znode-quota'
+BYTE_QUOTA_CLIENT_REL_DATA_KEY = 'byte-quota'
+ZONE_ADDRESSES_CLIENT_REL_DATA_KEY = 'zone-addresses'
+# `true` or `false`:
+LOCAL_SESSIONS_CLIENT_REL_DATA_KEY = 'local-sessions'
+LOCAL_SESSIONS_UPGRADING_CLIENT_REL_DATA_KEY = 'local-sessions-upgrading'
+READ_ONLY_CLIENT_REL_DATA_KEY = 'read-only'
+
+K8S_SERVICE_ACCOUNT_DIR_PATH = '/var/run/secrets/kubernetes.io/serviceaccount'
+# Node labels telling a node's zone, by order of preference. The node's name
+# is used if none is set:
+K8S_ZONE_LABELS = ('topology.kubernetes.io/zone',
+                   'failure-domain.beta.kubernetes.io/zone')
 
 logger = logging.getLogger(__name__)
 
 
+def get_k8s_zone(namespace, pod_name, timeout=5):
+    """Get the zone of the Kubernetes node a pod runs on.
+
+    Queries the Kubernetes API with the pod's service account, which must be
+    allowed to get nodes, e.g. with `juju trust`.
+
+    :param namespace: e.g. the Juju model's name
+    :type namespace: str
+    :param pod_name: e.g. `zookeeper-k8s-0` for unit `zookeeper-k8s/0`
+    :type pod_name: str
+    :returns: the node's zone label, or its name if it has none, or None if
+              it can't be found out.
+    :rtype: Optional[str]
+    """
+    host = os.environ.get('KUBERNETES_SERVICE_HOST')
+    port = os.environ.get('KUBERNETES_SERVICE_PORT', '443')
+    if not host:
+        logging.debug('Not running in Kubernetes, no zone')
+        return None
+
+    def _get(path):
+        request = urllib.request.Request(
+            f'https://{host}:{port}{path}',
+            headers={'Authorization': f'Bearer {token}'})
+        with urllib.request.urlopen(request, timeout=timeout,
+                                    context=context) as response:
+            return json.load(response)
+
+    try:
+        with open(os.path.join(K8S_SERVICE_ACCOUNT_DIR_PATH, 'token')) as f:
+            token = f.read().strip()
+        context = ssl.create_default_context(cafile=os.path.join(
+            K8S_SERVICE_ACCOUNT_DIR_PATH, 'ca.crt'))
+        node_name = _get(f'/api/v1/namespaces/{namespace}/pods/{pod_name}')[
+            'spec']['nodeName']
+        labels = _get(f'/api/v1/nodes/{node_name}')['metadata'].get(
+            'labels', {})
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning('Cannot get the zone of pod {}: {}'.format(pod_name,
+                                                                   e))
+        return None
+    for label in K8S_ZONE_LABELS:
+        if labels.get(label):
+            return labels[label]
+    return node_name
+
+
+def get_unit_zone(model, stored):
+    """Get the zone of the current unit, looking it up once per pod.
+
+    A failed lookup is retried on the next call, e.g. once the application
+    is trusted.
+
+    :type model: ops.model.Model
+    :param stored: the charm's stored state, where the zone is cached in
+                   `unit_zone`. It is lost if the pod is recreated, possibly
+                   on another node.
+    :type stored: ops.framework.StoredState
+    :rtype: Optional[str]
+    """
+    stored.set_default(unit_zone=None)
+    if stored.unit_zone is None:
+        stored.unit_zone = get_k8s_zone(
+            model.name, model.unit.name.replace('/', '-'))
+    return stored.unit_zone
+
+
+def sort_addresses_by_zone(addresses, zone_addresses, zone):
+    """Put the addresses in a given zone first, keeping their order
+    otherwise.
+
+    :type addresses: List[str]
+    :param zone_addresses: the addresses by zone
+    :type zone_addresses: Dict[str, List[str]]
+    :type zone: Optional[str]
+    :rtype: List[str]
+    """
+    same_zone_addresses = zone_addresses.get(zone, []) if zone else []
+    return sorted(addresses,
+                  key=lambda address: address not in same_zone_addresses)
+
+
 class ZookeeperRequires(Object):
-    def __init__(self, charm, stored):
+    def __init__(self, charm, stored, zone=None):
         super().__init__(charm, None)
         self.framework.observe(charm.on.zookeeper_relation_changed,
                                self._on_relation_changed)
         self.charm = charm
         self._stored = stored
-        self._stored.set_default(zookeeper_addresses='', zookeeper_port='')
+        self._stored.set_default(zookeeper_addresses='', zookeeper_port='',
+                                 zookeeper_chroot='',
+                                 zookeeper_zone_addresses='{}',
+                                 zookeeper_local_sessions='',
+                                 zookeeper_local_sessions_upgrading='',
+                                 zookeeper_read_only='')
+        self.__zone = zone
+
+    @property
+    def zone(self):
+        """The zone of this unit, servers of which are listed first in the
+        connection string.
+
+        :rtype: Optional[str]
+        """
+        if self.__zone is None:
+            self.__zone = get_unit_zone(self.model, self._stored)
+        return self.__zone
+
+    @property
+    def connection_string(self):
+        """The connection string to pass to ZooKeeper clients, e.g.
+        `10.1.0.42:2181,10.1.0.43:2181/clients/foo`, or None if ZooKeeper
+        didn't share its addresses yet.
+
+        :rtype: Optional[str]
+        """
+        zone_addresses = json.loads(self._stored.zookeeper_zone_addresses)
+        addresses = self._stored.zookeeper_addresses
+        if addresses and len(zone_addresses):
+            addresses = sort_addresses_by_zone(addresses, zone_addresses,
+                                               self.zone)
+        servers = self._get_servers(addresses, self._stored.zookeeper_port)
+        if not len(servers):
+            return None
+        return ','.join(servers) + (self._stored.zookeeper_chroot or '')
+
+    @property
+    def local_sessions_enabled(self):
+        """Whether new sessions are local to the server they connect to.
+
+        :rtype: bool
+        """
+        return self._stored.zookeeper_local_sessions == 'true'
+
+    @property
+    def local_sessions_upgrading_enabled(self):
+        """Whether local sessions become global when creating an ephemeral
+        znode.
+
+        :rtype: bool
+        """
+        return self._stored.zookeeper_local_sessions_upgrading == 'true'
+
+    @property
+    def read_only_enabled(self):
+        """Whether servers cut off from the quorum serve read-only clients.
+
+        :rtype: bool
+        """
+        return self._stored.zookeeper_read_only == 'true'
 
     def _on_relation_changed(self, event: RelationChangedEvent):
         logging.debug('Handling Juju relation change...')
 
-        if not self.model.unit.is_leader():
-            logging.debug('Not leader, nothing to be done')
+        # Get values passed on the relation:
+        data = event.relation.data[event.app]
+        zookeeper_addresses = data.get(INGRESS_ADDR_CLIENT_REL_DATA_KEY)
+        zookeeper_port = data.get(PORT_CLIENT_REL_DATA_KEY)
+        if not zookeeper_addresses or not zookeeper_port:
+            logging.debug('ZooKeeper addresses not shared yet')
             return
+        zookeeper_addresses = zookeeper_addresses.split(
+            INGRESS_ADDR_CLIENT_REL_DATA_SEPARATOR)
+        # Other values stored as-is, by stored state attribute:
+        zookeeper_values = {
+            'zookeeper_chroot': data.get(CHROOT_CLIENT_REL_DATA_KEY, ''),
+            'zookeeper_zone_addresses': data.get(
+                ZONE_ADDRESSES_CLIENT_REL_DATA_KEY, '{}'),
+            'zookeeper_local_sessions': data.get(
+                LOCAL_SESSIONS_CLIENT_REL_DATA_KEY, ''),
+            'zookeeper_local_sessions_upgrading': data.get(
+                LOCAL_SESSIONS_UPGRADING_CLIENT_REL_DATA_KEY, ''),
+            'zookeeper_read_only': data.get(READ_ONLY_CLIENT_REL_DATA_KEY,
+                                            ''),
+        }
 
-        # Get values passed on the relation:
-        zookeeper_addresses = event.relation.data[event.app].get(
-            INGRESS_ADDR_CLIENT_REL_DATA_KEY).split(
-                INGRESS_ADDR_CLIENT_REL_DATA_SEPARATOR)
-        zookeeper_port = event.relation.data[event.app].get(
-            PORT_CLIENT_REL_DATA_KEY)
+        old_servers = self._get_servers(self._stored.zookeeper_addresses,
+                                        self._stored.zookeeper_port)
+        new_servers = self._get_servers(zookeeper_addresses, zookeeper_port)
+        if new_servers == old_servers and all(
+                getattr(self._stored, name) == value
+                for name, value in zookeeper_values.items()):
+            logging.debug('ZooKeeper addresses unchanged')
+            return
 
         # Store them in the local charm's state and emit an event:
         self._stored.zookeeper_addresses = zookeeper_addresses
         self._stored.zookeeper_port = zookeeper_port
-        self.charm.on.zookeeper_relation_updated.emit()
+        for name, value in zookeeper_values.items():
+            setattr(self._stored, name, value)
+        self.charm.on.zookeeper_relation_updated.emit(
+            added_servers=[server for server in new_servers
+                           if server not in old_servers],
+            removed_servers=[server for server in old_servers
+                             if server not in new_servers])
+
+    @staticmethod
+    def _get_servers(addresses, port):
+        """Get the `address:port` of each server.
+
+        :type addresses: Optional[Iterable[str]]
+        :type port: Optional[str]
+        :rtype: List[str]
+        """
+        if not addresses or not port:
+            return []
+        return [f'{address}:{port}' for address in addresses]
 
 
 class ZookeeperRelationCharmEvents(CharmEvents):
     class ZookeeperRelationUpdatedEvent(EventBase):
-        pass
+        """ZooKeeper's addresses, port, chroot or features changed.
+
+        `added_servers` and `removed_servers` are the `address:port` of the
+        servers which appeared and disappeared, so that clients supporting
+        it can update their connection string without losing their session.
+        """
+        def __init__(self, handle, added_servers=None, removed_servers=None):
+            super().__init__(handle)
+            self.added_servers = added_servers or []
+            self.removed_servers = removed_servers or []
+
+        def snapshot(self):
+            return {'added_servers': self.added_servers,
+                    'removed_servers': self.removed_servers}
+
+        def restore(self, snapshot):
+            self.added_servers = snapshot['added_servers']
+            self.removed_servers = snapshot['removed_servers']
 
     zookeeper_relation_updated = EventSource(ZookeeperRelationUpdatedEvent)
@@ -23,20 +23,40 @@ develop a new k8s charm using the Operator Framework:
     https://discourse.charmhub.io/t/4208
 """
 
+import hashlib
+import json
 import logging
-import os
+import secrets
 import textwrap
+import time
 
 from charms.zookeeper_k8s.v0.zookeeper import (
+    BYTE_QUOTA_CLIENT_REL_DATA_KEY, CHROOT_CLIENT_REL_DATA_KEY,
     INGRESS_ADDR_CLIENT_REL_DATA_KEY, INGRESS_ADDR_CLIENT_REL_DATA_SEPARATOR,
-    PORT_CLIENT_REL_DATA_KEY)
+    LOCAL_SESSIONS_CLIENT_REL_DATA_KEY,
+    LOCAL_SESSIONS_UPGRADING_CLIENT_REL_DATA_KEY, PORT_CLIENT_REL_DATA_KEY,
+    READ_ONLY_CLIENT_REL_DATA_KEY, ZNODE_QUOTA_CLIENT_REL_DATA_KEY,
+    ZONE_ADDRESSES_CLIENT_REL_DATA_KEY, get_unit_zone)
 
 from contextlib import contextmanager
 
-from kazoo.client import KazooClient
-from ops.charm import CharmBase
+from kazoo.exceptions import KazooException
+from ops.charm import CharmBase, RelationEvent
+from ops.framework import StoredState
 from ops.main import main
-from ops.model import ActiveStatus
+from ops.model import ActiveStatus, BlockedStatus, WaitingStatus
+from ops import pebble
+
+import hook_timing
+import zk_admin
+import zk_backup
+import zk_clients
+import zk_config
+import zk_dump
+import zk_jvm
+import zk_metrics
+import zk_stats
+import zk_tree
 
 logger = logging.getLogger(__name__)
 
@@ -44,17 +64,59 @@ logger = logging.getLogger(__name__)
 class ZookeeperK8SCharm(CharmBase):
     """Charm the service."""
 
+    _stored = StoredState()
+
     __PEBBLE_SERVICE_NAME = 'zookeeper'
     __INGRESS_ADDR_PEER_REL_DATA_KEY = 'ingress-address'
+    __ZONE_PEER_REL_DATA_KEY = 'zone'
+    __ZONE_CONFIG_KEY = 'zone'
     __CLIENT_PORT_CONFIG_KEY = 'client-port'
+    __RESTART_REQUEST_PEER_REL_DATA_KEY = 'restart-request'
+    __RESTART_DONE_PEER_REL_DATA_KEY = 'restart-done'
+    __RESTART_TOKEN_PEER_REL_DATA_KEY = 'restart-token'
+    __RESTART_TIMEOUT_SECONDS = 120
+    __SERVER_IDS_PEER_REL_DATA_KEY = 'server-ids'
+    __SUPER_PASSWORD_PEER_REL_DATA_KEY = 'super-password'
+    __SUPER_USER = 'super'
+    __DYNAMIC_RECONFIG_CONFIG_KEY = 'dynamic-reconfig'
+    __MAIN_CONFIG_FILE_PATH = '/conf/zoo.cfg'
+    __ID_CONFIG_FILE_PATH = '/data/myid'
+    __DYNAMIC_CONFIG_FILE_PATH = '/conf/zoo.cfg.dynamic'
+    __NEXT_SERVER_ID_PEER_REL_DATA_KEY = 'next-server-id'
+    __MEMBERS_PEER_REL_DATA_KEY = 'members'
+    __MEMBERS_GENERATION_PEER_REL_DATA_KEY = 'members-generation'
+    __SNAPSHOT_DIR_PATH = '/data/version-2'
+    __TXN_LOG_DIR_PATH = '/datalog/version-2'
+    # Mount point of the backups storage, see metadata.yaml:
+    __DEFAULT_BACKUP_DIR_PATH = '/backups'
+    # Not a backup, as it has no manifest:
+    __DEFAULT_DUMP_FILE_PATH = '/backups/dumps/dump.jsonl.gz'
+    __JVM_FLAGS_CONFIG_KEY = 'jvm-flags'
+    # Mounted at dataDir and dataLogDir, see metadata.yaml:
+    __STORAGE_NAMES = ('data', 'datalog')
+    __METRICS_RELATION_NAME = 'metrics-endpoint'
+    __METRICS_PORT_CONFIG_KEY = 'metrics-port'
+    __READY_CHECK_NAME = 'zookeeper-ready'
+    __HOOK_TIMING_CONFIG_KEY = 'hook-timing'
 
     def __init__(self, *args):
         super().__init__(*args)
+        self._stored.set_default(zookeeper_config_hash=None,
+                                 members_generation=None)
+        # The container's resource limits, which can't change while a hook
+        # runs:
+        self.__resources = None
+        self.__hook_timer = None
+        # Set by __is_config_valid(), reported in the unit's status:
+        self.__config_warnings = []
+
         self.framework.observe(self.on.zookeeper_pebble_ready,
                                self._on_zookeeper_pebble_ready)
 
         self.framework.observe(self.on.config_changed,
                                self._on_config_or_peer_changed)
+        self.framework.observe(self.on.leader_elected,
+                               self._on_config_or_peer_changed)
         self.framework.observe(self.on.replicas_relation_joined,
                                self._on_config_or_peer_changed)
         self.framework.observe(self.on.replicas_relation_departed,
@@ -62,13 +124,52 @@ class ZookeeperK8SCharm(CharmBase):
         self.framework.observe(self.on.replicas_relation_changed,
                                self._on_config_or_peer_changed)
 
+        self.framework.observe(self.on.update_status, self._on_update_status)
+
         self.framework.observe(self.on.client_relation_joined,
                                self._on_client_joined)
+        self.framework.observe(self.on.metrics_endpoint_relation_joined,
+                               self._on_metrics_endpoint_joined)
 
         self.framework.observe(self.on.dump_data_action,
                                self._on_dump_data_action)
         self.framework.observe(self.on.seed_data_action,
                                self._on_seed_data_action)
+        self.framework.observe(self.on.restore_data_action,
+                               self._on_restore_data_action)
+        self.framework.observe(self.on.create_backup_action,
+                               self._on_create_backup_action)
+        self.framework.observe(self.on.restore_backup_action,
+                               self._on_restore_backup_action)
+        self.framework.observe(self.on.subtree_stats_action,
+                               self._on_subtree_stats_action)
+        self.framework.observe(self.on.purge_action, self._on_purge_action)
+
+        if self.config[self.__HOOK_TIMING_CONFIG_KEY]:
+            self.__instrument(hook_timing.HookTimer(
+                hook_timing.get_hook_name()))
+
+    def __instrument(self, hook_timer):
+        """Time each event handler, Juju hook tool and Pebble call, and log
+        a summary once the hook is done.
+
+        :type hook_timer: hook_timing.HookTimer
+        """
+        # The model backend is what runs the Juju hook tools:
+        hook_timer.instrument(self.model._backend, hook_timing.JUJU_TOOL)
+        hook_timer.instrument(self.unit.get_container('zookeeper').pebble,
+                              hook_timing.PEBBLE)
+        # The framework looks event handlers up by name when emitting events:
+        for name in dir(type(self)):
+            if name.startswith('_on_'):
+                setattr(self, name, hook_timer.wrap(
+                    getattr(self, name), hook_timing.HANDLER, name))
+        self.__hook_timer = hook_timer
+        self.framework.observe(self.framework.on.commit,
+                               self._log_hook_timing)
+
+    def _log_hook_timing(self, _):
+        self.__hook_timer.log_summary()
 
     def _on_zookeeper_pebble_ready(self, event):
         """Define and start a workload using the Pebble API.
@@ -77,75 +178,287 @@ class ZookeeperK8SCharm(CharmBase):
         """
         container = event.workload
 
+        # ZooKeeper would otherwise write to the container's ephemeral
+        # filesystem:
+        missing_storages = [name for name in self.__STORAGE_NAMES
+                            if not len(self.model.storages[name])]
+        if len(missing_storages):
+            self.unit.status = WaitingStatus('Waiting for storage: {}'.format(
+                ', '.join(missing_storages)))
+            event.defer()
+            return
+
         relation = self.model.get_relation('replicas')
         my_ingress_address = self._get_my_ingress_address(relation)
-        all_unit_ingress_addresses = self._get_all_unit_ingress_addresses(
-            relation)
-        self.__push_zookeeper_config(container, my_ingress_address,
-                                     all_unit_ingress_addresses)
+        my_server_id, servers = self._get_servers(relation, my_ingress_address)
+        if my_server_id is None:
+            self.unit.status = WaitingStatus(
+                'Waiting for the leader to allocate a server ID')
+            event.defer()
+            return
+        if not self.__is_config_valid(container):
+            # Will be started once the config is fixed:
+            event.defer()
+            return
+        # The container may have been recreated, with our config files lost:
+        self.__push_zookeeper_config(container, my_server_id, servers,
+                                     force=True)
 
-        pebble_layer = {
-            "summary": "zookeeper layer",
-            "description": "pebble config layer for zookeeper",
-            "services": {
-                self.__PEBBLE_SERVICE_NAME: {
-                    "override": "replace",
-                    "summary": "zookeeper",
-                    "command": "/docker-entrypoint.sh zkServer.sh start-foreground",
-                    "startup": "enabled",
-                }
-            },
-        }
-        container.add_layer("zookeeper", pebble_layer, combine=True)
+        layer = self._get_pebble_layer(container)
+        logging.info('Starting ZooKeeper with SERVER_JVMFLAGS={}'.format(
+            layer['services'][self.__PEBBLE_SERVICE_NAME]['environment'][
+                'SERVER_JVMFLAGS']))
+        container.add_layer("zookeeper", layer, combine=True)
 
         # Autostart any services that were defined with startup: enabled
         container.autostart()
 
         # Learn more about statuses in the SDK docs:
         # https://juju.is/docs/sdk/constructs#heading--statuses
-        self.unit.status = ActiveStatus()
+        self.unit.status = ActiveStatus('; '.join(self.__config_warnings))
+
+    def _get_pebble_layer(self, workload_container):
+        """Get the Pebble layer running ZooKeeper.
+
+        Learn more about Pebble layers at https://github.com/canonical/pebble
+
+        :param workload_container: the container in which ZooKeeper is running
+        :type workload_container: ops.model.Container
+        :rtype: Dict[str, Any]
+        """
+        service = {
+            "override": "replace",
+            "summary": "zookeeper",
+            "command": "/docker-entrypoint.sh zkServer.sh start-foreground",
+            "startup": "enabled",
+        }
+
+        jvm_flags = ['-Djute.maxbuffer={}'.format(
+            self.config[zk_config.JUTE_MAX_BUFFER_OPTION])]
+        if self.__resources is None:
+            self.__resources = zk_jvm.get_resources(
+                lambda path: self.__read_file(workload_container, path))
+        jvm_flags += zk_jvm.get_jvm_flags(
+            self.__resources, self.config[zk_config.HEAP_SIZE_OPTION])
+        logging.debug('Sized JVM for {}: {}'.format(self.__resources,
+                                                    jvm_flags))
+        if self.config[zk_config.READ_ONLY_MODE_OPTION]:
+            jvm_flags.append('-Dreadonlymode.enabled=true')
+        super_password = self.__get_super_password()
+        if super_password is not None:
+            super_digest = zk_config.get_digest(self.__SUPER_USER,
+                                                super_password)
+            jvm_flags.append('-Dzookeeper.DigestAuthenticationProvider.'
+                             f'superDigest={super_digest}')
+        # Last so that they take precedence:
+        jvm_flags += self.config[self.__JVM_FLAGS_CONFIG_KEY].split()
+        service["environment"] = {"SERVER_JVMFLAGS": ' '.join(jvm_flags)}
+
+        # `srvr` is the only four letter word command allowed by default. It
+        # answers with a `Mode:` line only once the server is in a quorum and
+        # synced with the leader, so that servers which aren't are taken out
+        # of client routing.
+        client_port = self.config[self.__CLIENT_PORT_CONFIG_KEY]
+        ready_check = {
+            "override": "replace",
+            "level": "ready",
+            "period": "10s",
+            "timeout": "3s",
+            "threshold": 3,
+            "exec": {
+                "command": "bash -c 'exec 3<>/dev/tcp/127.0.0.1/{} && "
+                           "echo srvr >&3 && grep -q ^Mode: <&3'".format(
+                               client_port),
+            },
+        }
+
+        return {
+            "summary": "zookeeper layer",
+            "description": "pebble config layer for zookeeper",
+            "services": {self.__PEBBLE_SERVICE_NAME: service},
+            "checks": {self.__READY_CHECK_NAME: ready_check},
+        }
+
+    def __update_pebble_layer(self, workload_container):
+        """Replace the Pebble layer if it changed, without restarting
+        ZooKeeper.
+
+        :param workload_container: the container in which ZooKeeper is running
+        :type workload_container: ops.model.Container
+        :returns: whether the layer changed.
+        :rtype: bool
+        """
+        plan = workload_container.get_plan().to_dict()
+        services = plan.get('services', {})
+        if self.__PEBBLE_SERVICE_NAME not in services:
+            # Too early, the layer will be added once Pebble is ready:
+            return False
+        layer = self._get_pebble_layer(workload_container)
+        service = layer['services'][self.__PEBBLE_SERVICE_NAME]
+        if services[self.__PEBBLE_SERVICE_NAME] == service and (
+                plan.get('checks', {}) == layer['checks']):
+            return False
+        logging.info('Updating Pebble layer, SERVER_JVMFLAGS={}'.format(
+            service['environment']['SERVER_JVMFLAGS']))
+        workload_container.add_layer("zookeeper", layer, combine=True)
+        return True
 
-    def _on_config_or_peer_changed(self, _):
+    def _on_config_or_peer_changed(self, event):
         """Adapt ZooKeeper's config to Juju changes and inform client charm."""
         logging.debug('Handling Juju config or peer change...')
 
         peer_relation = self.model.get_relation('replicas')
         my_ingress_address = self._get_my_ingress_address(peer_relation)
         self._share_address_with_peers(my_ingress_address, peer_relation)
-        all_unit_ingress_addresses = self._get_all_unit_ingress_addresses(
-            peer_relation)
+        self._allocate_server_ids(peer_relation, my_ingress_address)
+        self._ensure_super_password(peer_relation)
+        self._publish_members(peer_relation, my_ingress_address)
+        my_server_id, servers = self._get_servers(peer_relation,
+                                                  my_ingress_address)
+        members_generation = self.__get_members_generation(peer_relation)
+
+        # Most peer relation events on non-leader units are about other units
+        # sharing their address with the leader:
+        is_membership_unchanged = isinstance(event, RelationEvent) and (
+            not self.unit.is_leader()) and (
+                members_generation == self._stored.members_generation)
 
         container = self.unit.get_container('zookeeper')
-        self.__push_zookeeper_config(container, my_ingress_address,
-                                     all_unit_ingress_addresses)
-        self.__restart_zookeeper(container)
+        if my_server_id is None:
+            logging.debug('No server ID allocated yet, not configuring '
+                          'ZooKeeper')
+        elif is_membership_unchanged:
+            logging.debug('Ensemble membership unchanged (generation {}), not '
+                          'configuring ZooKeeper'.format(members_generation))
+        elif not self.__is_config_valid(container):
+            logging.debug('Invalid charm config, not configuring ZooKeeper')
+        else:
+            is_layer_changed = self.__update_pebble_layer(container)
+            is_config_changed = self.__push_zookeeper_config(
+                container, my_server_id, servers)
+            if is_layer_changed or is_config_changed:
+                self.__request_restart(container, peer_relation)
+            else:
+                logging.debug('ZooKeeper config unchanged, not restarting')
+            self._stored.members_generation = members_generation
+        self.__process_rolling_restart(container, peer_relation)
 
-        self._share_addresses_and_port_with_client(all_unit_ingress_addresses)
+        if self.config[self.__DYNAMIC_RECONFIG_CONFIG_KEY] and (
+                self.unit.is_leader()):
+            self.__reconfigure_ensemble(event, servers)
+
+        self._share_addresses_and_port_with_client(
+            [address for _, address in sorted(servers.items())])
+        self._provision_clients()
+        self._share_scrape_config(my_ingress_address)
+
+    def _on_update_status(self, _):
+        """Report how well the local server is serving in the unit status."""
+        container = self.unit.get_container('zookeeper')
+        if not container.can_connect():
+            return
+        services = container.get_plan().to_dict().get('services', {})
+        if self.__PEBBLE_SERVICE_NAME not in services:
+            # Not started yet, the status tells why:
+            return
+        if not self.__is_config_valid(container):
+            return
+        if not container.get_service(self.__PEBBLE_SERVICE_NAME).is_running():
+            self.unit.status = BlockedStatus('ZooKeeper is not running')
+            return
+
+        stats = zk_admin.get_server_stats()
+        if stats is None:
+            self.unit.status = WaitingStatus('ZooKeeper is not responding')
+            return
+        state = stats.get('server_state')
+        if state not in zk_admin.SERVING_STATES:
+            self.unit.status = WaitingStatus(
+                f'ZooKeeper is not serving ({state})')
+            return
+
+        lag = 0
+        if state in ('follower', 'observer'):
+            leader_stats = None
+            leader_address = zk_admin.get_leader_address()
+            if leader_address is not None:
+                leader_stats = zk_admin.get_server_stats(leader_address)
+            if leader_stats is None:
+                lag = None
+            else:
+                lag = zk_admin.get_zxid_lag(
+                    stats['last_processed_zxid'],
+                    leader_stats['last_processed_zxid'])
+        # Catch up with membership changes and client applications related
+        # while ZooKeeper wasn't serving:
+        peer_relation = self.model.get_relation('replicas')
+        if self.config[self.__DYNAMIC_RECONFIG_CONFIG_KEY] and (
+                self.unit.is_leader()) and peer_relation is not None:
+            self.__reconfigure_ensemble(None,
+                                        self.__get_members(peer_relation))
+        self._provision_clients()
 
-    def _on_client_joined(self, _):
+        usage = self.__get_storage_usage(container)
+        self.unit.status = ActiveStatus(
+            '{}, zxid lag {}, latency avg/max {}/{} ms, {} connections, '
+            'data {:.1f} MiB, datalog {:.1f} MiB{}'.format(
+                state, 'unknown' if lag is None else lag,
+                stats['avg_latency'], stats['max_latency'],
+                stats['num_alive_client_connections'],
+                usage[self.__SNAPSHOT_DIR_PATH][1] / (1024 * 1024),
+                usage[self.__TXN_LOG_DIR_PATH][1] / (1024 * 1024),
+                ''.join('; ' + warning
+                        for warning in self.__config_warnings)))
+
+    def _on_client_joined(self, event):
         """Inform client charm on how to connect to ZooKeeper."""
         peer_relation = self.model.get_relation('replicas')
         all_unit_ingress_addresses = self._get_all_unit_ingress_addresses(
             peer_relation)
         self._share_addresses_and_port_with_client(all_unit_ingress_addresses)
+        if not self._provision_clients():
+            event.defer()
+
+    def _on_metrics_endpoint_joined(self, _):
+        """Inform Prometheus on how to scrape ZooKeeper."""
+        peer_relation = self.model.get_relation('replicas')
+        self._share_scrape_config(self._get_my_ingress_address(peer_relation))
 
     def _on_dump_data_action(self, event):
         """Action that prints ZooKeeper's content on a given unit.
 
         Learn more about actions at https://juju.is/docs/sdk/actions
         """
-        def _get_tree(path, zk):
-            """Recursive function returning the tree as a dict.
-            """
-            children = zk.get_children(path)
-            if not len(children):
-                value = zk.get(path)[0]
-                return value
-            return {child: _get_tree(os.path.join(path, child), zk)
-                    for child in children}
+        path = event.params.get('path', '/')
+        max_depth = event.params.get('max-depth')
+        include_stat = event.params.get('include-stat', False)
+        max_in_flight = event.params.get('max-in-flight',
+                                         zk_tree.DEFAULT_MAX_IN_FLIGHT)
+
+        if event.params.get('output', 'results') == 'file':
+            output_path = event.params.get('output-path',
+                                           self.__DEFAULT_DUMP_FILE_PATH)
+            container = self.unit.get_container('zookeeper')
+            with self.__zookeeper_client() as zk:
+                # Depth-first keeps memory use independent of the tree's
+                # width:
+                dump = zk_dump.DumpStream(zk_tree.walk_tree(
+                    zk, path, max_depth=max_depth,
+                    max_in_flight=max_in_flight, depth_first=True))
+                container.push(output_path, dump, make_dirs=True)
+            event.set_results({
+                'path': output_path,
+                'node-count': dump.node_count,
+                'bytes': dump.byte_count,
+                'sha256': dump.sha256,
+            })
+            return
 
         with self.__zookeeper_client() as zk:
-            content = _get_tree('/', zk)
+            content = zk_tree.nodes_to_dict(
+                zk_tree.walk_tree(zk, path, max_depth=max_depth,
+                                  max_in_flight=max_in_flight),
+                include_stat=include_stat)
         event.set_results({'content': content})
 
     def _on_seed_data_action(self, event):
@@ -159,14 +472,413 @@ class ZookeeperK8SCharm(CharmBase):
             zk.create('/test-seed/my-second-key', b'my second value')
         event.set_results({})
 
+    def _on_restore_data_action(self, event):
+        """Action that loads a file produced by the dump-data action.
+
+        Learn more about actions at https://juju.is/docs/sdk/actions
+        """
+        input_path = event.params.get('input-path',
+                                      self.__DEFAULT_DUMP_FILE_PATH)
+        dry_run = event.params.get('dry-run', False)
+        batch_size = event.params.get('batch-size',
+                                      zk_dump.DEFAULT_BATCH_SIZE)
+        max_in_flight = event.params.get(
+            'max-in-flight', zk_dump.DEFAULT_MAX_BATCHES_IN_FLIGHT)
+
+        container = self.unit.get_container('zookeeper')
+        start = time.monotonic()
+        with container.pull(input_path, encoding=None) as dump_file:
+            records = zk_dump.read_records(dump_file)
+            if dry_run:
+                restorable = 0
+                ignored = 0
+                for record in records:
+                    if zk_dump.is_restorable(record):
+                        restorable += 1
+                    else:
+                        ignored += 1
+                report = zk_dump.LoadReport(created=0, existing=0,
+                                            ignored=ignored)
+            else:
+                with self.__zookeeper_client() as zk:
+                    report = zk_dump.load_records(
+                        zk, records, batch_size=batch_size,
+                        max_in_flight=max_in_flight)
+                restorable = report.created + report.existing
+        elapsed = time.monotonic() - start
+
+        logging.info('Restored {} znodes from {} in {:.1f}s'.format(
+            report.created, input_path, elapsed))
+        event.set_results({
+            'dry-run': dry_run,
+            'restorable': restorable,
+            'created': report.created,
+            'existing': report.existing,
+            'ignored': report.ignored,
+            'seconds': round(elapsed, 3),
+            'znodes-per-second': round(restorable / elapsed if elapsed else 0),
+        })
+
+    def _on_create_backup_action(self, event):
+        """Action that copies ZooKeeper's latest snapshot and transaction
+        logs to a backup directory.
+
+        Learn more about actions at https://juju.is/docs/sdk/actions
+        """
+        backup_dir_path = event.params.get('backup-dir',
+                                           self.__DEFAULT_BACKUP_DIR_PATH)
+        incremental = event.params.get('incremental', False)
+
+        container = self.unit.get_container('zookeeper')
+        start = time.monotonic()
+        manifests = self.__get_backup_manifests(container, backup_dir_path)
+        base_id = max(manifests) if incremental and len(manifests) else None
+        since_zxid = None
+        if base_id is not None:
+            since_zxid = manifests[base_id]['last-log-zxid']
+
+        snapshot_names = self.__list_file_names(
+            container, self.__SNAPSHOT_DIR_PATH,
+            zk_backup.SNAPSHOT_PREFIX + '*')
+        all_log_names = self.__list_file_names(
+            container, self.__TXN_LOG_DIR_PATH, zk_backup.LOG_PREFIX + '*')
+        try:
+            snapshot_name, log_names = zk_backup.select_files(
+                snapshot_names, all_log_names, since_zxid=since_zxid)
+        except ValueError as e:
+            logging.warning('Making a full backup instead of one based on '
+                            '{}: {}'.format(base_id, e))
+            base_id = since_zxid = None
+            snapshot_name, log_names = zk_backup.select_files(
+                snapshot_names, all_log_names)
+        if base_id is None and snapshot_name is None and not len(log_names):
+            event.fail('No data to back up yet')
+            return
+
+        paths = []
+        if snapshot_name is not None:
+            paths.append(f'{self.__SNAPSHOT_DIR_PATH}/{snapshot_name}')
+        for name in zk_backup.EPOCH_FILE_NAMES:
+            path = f'{self.__SNAPSHOT_DIR_PATH}/{name}'
+            if container.exists(path):
+                paths.append(path)
+        paths += [f'{self.__TXN_LOG_DIR_PATH}/{name}' for name in log_names]
+
+        backup_id = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+        backup_path = f'{backup_dir_path}/{backup_id}'
+        if container.exists(backup_path):
+            # Overwriting it would corrupt it, and any backup based on it:
+            event.fail(f'Backup {backup_id} already exists, try again in a '
+                       f'second')
+            return
+        files = []
+        for path in paths:
+            with container.pull(path, encoding=None) as source:
+                stream = zk_backup.CompressingStream(source)
+                container.push(self.__get_backup_file_path(
+                    backup_dir_path, backup_id, path), stream,
+                    make_dirs=True)
+            files.append({
+                'path': path,
+                'size': stream.raw_byte_count,
+                'compressed-size': stream.byte_count,
+                'sha256': stream.sha256,
+            })
+
+        if len(log_names):
+            last_log_zxid = zk_backup.get_zxid(log_names[-1])
+        elif snapshot_name is not None:
+            last_log_zxid = zk_backup.get_zxid(snapshot_name)
+        else:
+            last_log_zxid = since_zxid
+        manifest = {
+            'id': backup_id,
+            'base': base_id,
+            'snapshot-zxid': snapshot_name and zk_backup.get_zxid(
+                snapshot_name),
+            'last-log-zxid': last_log_zxid,
+            'files': files,
+        }
+        # Written last, so that incomplete backups are ignored:
+        container.push(f'{backup_path}/{zk_backup.MANIFEST_FILE_NAME}',
+                       json.dumps(manifest, indent=2))
+        elapsed = time.monotonic() - start
+
+        size = sum(f['size'] for f in files)
+        logging.info('Backed up {} bytes to {} in {:.1f}s'.format(
+            size, backup_path, elapsed))
+        event.set_results({
+            'backup-id': backup_id,
+            'path': backup_path,
+            'base': base_id or '',
+            'files': len(files),
+            'bytes': size,
+            'compressed-bytes': sum(f['compressed-size'] for f in files),
+            'seconds': round(elapsed, 3),
+        })
+
+    def _on_restore_backup_action(self, event):
+        """Action that replaces ZooKeeper's data by a backup made by the
+        create-backup action.
+
+        Learn more about actions at https://juju.is/docs/sdk/actions
+        """
+        backup_dir_path = event.params.get('backup-dir',
+                                           self.__DEFAULT_BACKUP_DIR_PATH)
+
+        container = self.unit.get_container('zookeeper')
+        services = container.get_plan().to_dict().get('services', {})
+        if self.__PEBBLE_SERVICE_NAME not in services:
+            event.fail('ZooKeeper not set up yet')
+            return
+        manifests = self.__get_backup_manifests(container, backup_dir_path)
+        if not len(manifests):
+            event.fail(f'No backup found in {backup_dir_path}')
+            return
+        backup_id = event.params.get('backup-id') or max(manifests)
+        try:
+            chain = zk_backup.get_restore_chain(manifests, backup_id)
+        except ValueError as e:
+            event.fail(str(e))
+            return
+
+        # Incremental backups hold newer copies of the transaction logs of
+        # their base:
+        files = {}
+        for chain_backup_id in chain:
+            for file_info in manifests[chain_backup_id]['files']:
+                files[file_info['path']] = (chain_backup_id, file_info)
+
+        start = time.monotonic()
+        # Checked before touching ZooKeeper's data, which is left as is if
+        # the backup is corrupted:
+        for path, (chain_backup_id, file_info) in sorted(files.items()):
+            with container.pull(self.__get_backup_file_path(
+                    backup_dir_path, chain_backup_id, path),
+                    encoding=None) as source:
+                sha256 = zk_backup.get_sha256(source)
+            if sha256 != file_info['sha256']:
+                event.fail('{} of backup {} is corrupted: sha256 {} instead '
+                           'of {}'.format(path, chain_backup_id, sha256,
+                                          file_info['sha256']))
+                return
+        logging.info('Stopping ZooKeeper to restore backup {}'.format(
+            backup_id))
+        if container.get_service(self.__PEBBLE_SERVICE_NAME).is_running():
+            container.stop(self.__PEBBLE_SERVICE_NAME)
+        for dir_path in (self.__SNAPSHOT_DIR_PATH, self.__TXN_LOG_DIR_PATH):
+            if container.exists(dir_path):
+                container.remove_path(dir_path, recursive=True)
+
+        size = 0
+        for path, (chain_backup_id, file_info) in sorted(files.items()):
+            with container.pull(self.__get_backup_file_path(
+                    backup_dir_path, chain_backup_id, path),
+                    encoding=None) as source:
+                stream = zk_backup.DecompressingStream(source)
+                container.push(path, stream, make_dirs=True)
+            if stream.byte_count != file_info['size']:
+                # Leave ZooKeeper stopped rather than serving corrupted data:
+                event.fail('{} restored from backup {} is {} bytes instead '
+                           'of {}'.format(path, chain_backup_id,
+                                          stream.byte_count,
+                                          file_info['size']))
+                return
+            size += stream.byte_count
+
+        container.start(self.__PEBBLE_SERVICE_NAME)
+        elapsed = time.monotonic() - start
+        logging.info('Restored backup {} in {:.1f}s'.format(backup_id,
+                                                            elapsed))
+        event.set_results({
+            'backup-id': backup_id,
+            'restored-backups': ','.join(chain),
+            'files': len(files),
+            'bytes': size,
+            'seconds': round(elapsed, 3),
+        })
+
+    def _on_subtree_stats_action(self, event):
+        """Action that reports the subtrees with the largest values.
+
+        Learn more about actions at https://juju.is/docs/sdk/actions
+        """
+        path = event.params.get('path', '/')
+        group_depth = event.params.get('depth', zk_stats.DEFAULT_GROUP_DEPTH)
+        top_count = event.params.get('top', zk_stats.DEFAULT_TOP_COUNT)
+        max_in_flight = event.params.get('max-in-flight',
+                                         zk_tree.DEFAULT_MAX_IN_FLIGHT)
+
+        def _to_results(stats):
+            return {
+                'znodes': stats.znode_count,
+                'bytes': stats.data_length,
+                'max-children': stats.max_children,
+                'ephemerals': stats.ephemeral_count,
+            }
+
+        start = time.monotonic()
+        with self.__zookeeper_client() as zk:
+            # Depth-first so that subtrees are done with one after another:
+            total, top, histogram = zk_stats.compute_stats(
+                zk_tree.walk_tree(zk, path, max_in_flight=max_in_flight,
+                                  depth_first=True),
+                top_count=top_count, group_depth=group_depth)
+        elapsed = time.monotonic() - start
+
+        results = _to_results(total)
+        results['top'] = {str(rank): dict(_to_results(stats), path=stats.path)
+                          for rank, stats in enumerate(top, 1)}
+        results['value-sizes'] = {str(bucket): count
+                                  for bucket, count in sorted(histogram.items())}
+        results['seconds'] = round(elapsed, 3)
+        event.set_results(results)
+
+    def _on_purge_action(self, event):
+        """Action that deletes old snapshots and transaction logs.
+
+        Learn more about actions at https://juju.is/docs/sdk/actions
+        """
+        retain_count = event.params.get('retain-count',
+                                        self.config['snap-retain-count'])
+
+        container = self.unit.get_container('zookeeper')
+        before = self.__get_storage_usage(container)
+        # zkCleanup.sh finds dataDir and dataLogDir in zoo.cfg:
+        command = ['zkCleanup.sh', '-n', str(retain_count)]
+        try:
+            output, _ = container.exec(command).wait_output()
+        except (pebble.ChangeError, pebble.ExecError) as e:
+            logging.warning('{} failed: {}'.format(' '.join(command), e))
+            event.fail('Purge failed: {}'.format(getattr(e, 'stderr', None) or e))
+            return
+        logging.debug('{}: {}'.format(' '.join(command), output))
+        after = self.__get_storage_usage(container)
+
+        removed_files = sum(before[path][0] - after[path][0] for path in before)
+        removed_bytes = sum(before[path][1] - after[path][1] for path in before)
+        logging.info('Purged {} files, {} bytes'.format(removed_files,
+                                                        removed_bytes))
+        event.set_results({
+            'removed-files': removed_files,
+            'removed-bytes': removed_bytes,
+            'data-bytes': after[self.__SNAPSHOT_DIR_PATH][1],
+            'datalog-bytes': after[self.__TXN_LOG_DIR_PATH][1],
+        })
+
+    def __get_storage_usage(self, workload_container):
+        """Get how many snapshots and transaction logs there are and how
+        much space they take.
+
+        :param workload_container: the container in which ZooKeeper is running
+        :type workload_container: ops.model.Container
+        :returns: the number of files and bytes, by directory path.
+        :rtype: Dict[str, Tuple[int, int]]
+        """
+        usage = {}
+        for dir_path, prefix in [
+                (self.__SNAPSHOT_DIR_PATH, zk_backup.SNAPSHOT_PREFIX),
+                (self.__TXN_LOG_DIR_PATH, zk_backup.LOG_PREFIX)]:
+            files = []
+            if workload_container.exists(dir_path):
+                files = workload_container.list_files(dir_path,
+                                                      pattern=prefix + '*')
+            usage[dir_path] = (len(files),
+                               sum(file_info.size or 0 for file_info in files))
+        return usage
+
+    def __get_backup_manifests(self, workload_container, backup_dir_path):
+        """Get the manifest of each complete backup.
+
+        :param workload_container: the container in which ZooKeeper is running
+        :type workload_container: ops.model.Container
+        :param backup_dir_path: the directory holding the backups
+        :type backup_dir_path: str
+        :returns: manifests by backup ID.
+        :rtype: Dict[str, Dict[str, Any]]
+        """
+        if not workload_container.exists(backup_dir_path):
+            return {}
+        manifests = {}
+        for file_info in workload_container.list_files(backup_dir_path):
+            manifest_path = '{}/{}'.format(file_info.path,
+                                           zk_backup.MANIFEST_FILE_NAME)
+            if workload_container.exists(manifest_path):
+                manifests[file_info.name] = json.loads(
+                    workload_container.pull(manifest_path).read())
+        return manifests
+
+    @staticmethod
+    def __get_backup_file_path(backup_dir_path, backup_id, path):
+        """Get the path of the compressed copy of a file in a backup.
+
+        :param path: the path of the backed up file
+        :type path: str
+        :rtype: str
+        """
+        return '{}/{}/{}.gz'.format(backup_dir_path, backup_id,
+                                    path.rsplit('/', 1)[1])
+
+    def __list_file_names(self, workload_container, dir_path, pattern):
+        """List the names of the files matching a pattern in a directory.
+
+        :param workload_container: the container in which ZooKeeper is running
+        :type workload_container: ops.model.Container
+        :returns: an empty list if the directory doesn't exist.
+        :rtype: List[str]
+        """
+        if not workload_container.exists(dir_path):
+            return []
+        return [file_info.name for file_info in workload_container.list_files(
+            dir_path, pattern=pattern)]
+
     def _share_address_with_peers(self, my_ingress_address, relation):
-        """Share this unit's ingress address with peer units.
+        """Share this unit's ingress address and zone with peer units.
+
+        :param relation: the peer relation
+        :type relation: ops.model.Relation
+        """
+        my_data = relation.data[self.unit]
+        if my_data.get(self.__INGRESS_ADDR_PEER_REL_DATA_KEY) != (
+                my_ingress_address):
+            my_data[self.__INGRESS_ADDR_PEER_REL_DATA_KEY] = (
+                my_ingress_address)
+        my_zone = self._get_my_zone() or ''
+        if my_data.get(self.__ZONE_PEER_REL_DATA_KEY, '') != my_zone:
+            my_data[self.__ZONE_PEER_REL_DATA_KEY] = my_zone
+
+    def _get_my_zone(self):
+        """Get the zone this unit runs in, as configured or else as looked up
+        from the Kubernetes API.
+
+        :rtype: Optional[str]
+        """
+        return self.config[self.__ZONE_CONFIG_KEY] or get_unit_zone(
+            self.model, self._stored)
+
+    def __get_zone_addresses(self, relation, all_unit_ingress_addresses):
+        """Group the ingress addresses of the units by zone, as shared by
+        the units.
 
         :param relation: the peer relation
         :type relation: ops.model.Relation
+        :param all_unit_ingress_addresses: Each unit's (first) ingress address.
+        :type all_unit_ingress_addresses: List[str]
+        :returns: the addresses by zone, without the units of unknown zone.
+        :rtype: Dict[str, List[str]]
         """
-        relation.data[self.unit][self.__INGRESS_ADDR_PEER_REL_DATA_KEY] = (
-            my_ingress_address)
+        zone_addresses = {}
+        if relation is None:
+            return zone_addresses
+        for unit in [self.unit] + list(relation.units):
+            data = relation.data[unit]
+            address = data.get(self.__INGRESS_ADDR_PEER_REL_DATA_KEY)
+            zone = data.get(self.__ZONE_PEER_REL_DATA_KEY)
+            if zone and address in all_unit_ingress_addresses:
+                zone_addresses.setdefault(zone, []).append(address)
+        for addresses in zone_addresses.values():
+            addresses.sort(key=all_unit_ingress_addresses.index)
+        return zone_addresses
 
     def _share_addresses_and_port_with_client(self, all_unit_ingress_addresses):
         """Share ingress addresses and port with the related client charm if
@@ -179,50 +891,328 @@ class ZookeeperK8SCharm(CharmBase):
         if not self.model.unit.is_leader():
             return
 
-        relation = self.model.get_relation('client')
         port = self.config[self.__CLIENT_PORT_CONFIG_KEY]
-        if relation is None or port is None or len(
-                all_unit_ingress_addresses) < 1:
+        if port is None or len(all_unit_ingress_addresses) < 1:
             # Too early. Nothing can be done now. Will be
             # done later.
             return
 
-        relation.data[self.model.app][INGRESS_ADDR_CLIENT_REL_DATA_KEY] = (
-            INGRESS_ADDR_CLIENT_REL_DATA_SEPARATOR.join(
-                all_unit_ingress_addresses))
-        relation.data[self.model.app][PORT_CLIENT_REL_DATA_KEY] = str(port)
+        # Lets clients connect to servers in their own zone first:
+        zone_addresses = self.__get_zone_addresses(
+            self.model.get_relation('replicas'), all_unit_ingress_addresses)
+        # Features clients may opt in to:
+        features = {
+            LOCAL_SESSIONS_CLIENT_REL_DATA_KEY: self.config[
+                zk_config.LOCAL_SESSIONS_OPTION],
+            LOCAL_SESSIONS_UPGRADING_CLIENT_REL_DATA_KEY: self.config[
+                zk_config.LOCAL_SESSIONS_UPGRADING_OPTION],
+            READ_ONLY_CLIENT_REL_DATA_KEY: self.config[
+                zk_config.READ_ONLY_MODE_OPTION],
+        }
+        for relation in self.model.relations['client']:
+            relation.data[self.model.app][INGRESS_ADDR_CLIENT_REL_DATA_KEY] = (
+                INGRESS_ADDR_CLIENT_REL_DATA_SEPARATOR.join(
+                    all_unit_ingress_addresses))
+            relation.data[self.model.app][PORT_CLIENT_REL_DATA_KEY] = str(port)
+            relation.data[self.model.app][
+                ZONE_ADDRESSES_CLIENT_REL_DATA_KEY] = json.dumps(
+                    zone_addresses, sort_keys=True)
+            for key, is_enabled in features.items():
+                relation.data[self.model.app][key] = str(is_enabled).lower()
+
+    def _provision_clients(self):
+        """Create the chroot of each client application, set its quotas and
+        share it with the application.
+
+        Only client applications whose chroot or quotas aren't shared yet
+        are provisioned, so this is cheap when there is nothing to do.
+
+        :returns: whether all client applications are provisioned.
+        :rtype: bool
+        """
+        if not self.model.unit.is_leader():
+            return True
+
+        quotas = {
+            ZNODE_QUOTA_CLIENT_REL_DATA_KEY: max(
+                0, self.config[zk_config.CLIENT_ZNODE_QUOTA_OPTION]),
+            BYTE_QUOTA_CLIENT_REL_DATA_KEY: max(
+                0, self.config[zk_config.CLIENT_BYTE_QUOTA_OPTION]),
+        }
+        wanted_data_by_relation = {}
+        for relation in self.model.relations['client']:
+            if relation.app is None:
+                continue
+            wanted_data = {key: str(value) for key, value in quotas.items()}
+            wanted_data[CHROOT_CLIENT_REL_DATA_KEY] = zk_clients.get_chroot(
+                relation.app.name)
+            data = relation.data[self.model.app]
+            if any(data.get(key) != value
+                   for key, value in wanted_data.items()):
+                wanted_data_by_relation[relation] = wanted_data
+        if not len(wanted_data_by_relation):
+            return True
+
+        if not zk_admin.is_serving():
+            logging.debug('ZooKeeper not serving, not provisioning clients '
+                          'yet')
+            return False
+        try:
+            with self.__zookeeper_client() as zk:
+                for relation, wanted_data in wanted_data_by_relation.items():
+                    chroot = wanted_data[CHROOT_CLIENT_REL_DATA_KEY]
+                    zk.ensure_path(chroot)
+                    zk_clients.set_quota(
+                        zk, chroot,
+                        znode_count=quotas[ZNODE_QUOTA_CLIENT_REL_DATA_KEY],
+                        byte_count=quotas[BYTE_QUOTA_CLIENT_REL_DATA_KEY])
+                    logging.info('Provisioned {} for {}: {}'.format(
+                        chroot, relation.app.name, quotas))
+                    relation.data[self.model.app].update(wanted_data)
+        except KazooException as e:
+            logging.warning('Provisioning clients failed, will retry: '
+                            '{}'.format(e))
+            return False
+        return True
+
+    def _share_scrape_config(self, my_ingress_address):
+        """Share scrape jobs, alert rules and this unit's address with the
+        related Prometheus charms.
+
+        See https://charmhub.io/prometheus-k8s/libraries/prometheus_scrape
+
+        :param my_ingress_address: this unit's ingress address
+        :type my_ingress_address: str
+        """
+        relations = self.model.relations[self.__METRICS_RELATION_NAME]
+        if not len(relations):
+            return
+
+        for relation in relations:
+            relation.data[self.unit]['prometheus_scrape_unit_address'] = (
+                my_ingress_address)
+            relation.data[self.unit]['prometheus_scrape_unit_name'] = (
+                self.unit.name)
+        if not self.unit.is_leader():
+            return
+
+        topology = {
+            'model': self.model.name,
+            'model_uuid': self.model.uuid,
+            'application': self.app.name,
+        }
+        scrape_metadata = json.dumps(
+            dict(topology, charm_name=self.meta.name))
+        scrape_jobs = json.dumps(zk_metrics.get_scrape_jobs(
+            self.config[self.__METRICS_PORT_CONFIG_KEY]))
+        alert_rules = json.dumps(zk_metrics.load_alert_rules(topology))
+        for relation in relations:
+            app_data = relation.data[self.app]
+            app_data['scrape_metadata'] = scrape_metadata
+            app_data['scrape_jobs'] = scrape_jobs
+            app_data['alert_rules'] = alert_rules
 
     def _get_all_unit_ingress_addresses(self, relation):
-        """Get all ingress addresses shared by all peers over the relation.
+        """Get the ingress addresses of all members of the ensemble, as
+        published by the leader unit.
 
         Including the current unit.
 
         :param relation: the peer relation
         :type relation: ops.model.Relation
-        :returns: Each unit's (first) ingress address.
+        :returns: Each unit's (first) ingress address, by server ID.
         :rtype: List[str]
         """
-        result = set()
-
-        my_ingress_address = self._get_my_ingress_address(relation)
-        if my_ingress_address is not None:
-            result.add(my_ingress_address)
-
-        for unit in relation.units:
-            try:
-                unit_ingress_address = relation.data[unit][
-                    self.__INGRESS_ADDR_PEER_REL_DATA_KEY]
-            except KeyError:
-                # This unit hasn't shared its address yet. It's OK as there will
-                # be other hook executions later calling this again:
-                continue
-            if unit_ingress_address is not None:
-                result.add(unit_ingress_address)
+        if relation is None:
+            return []
+        result = [address for _, address in sorted(
+            self.__get_members(relation).items())]
 
         logging.debug('All unit ingress addresses: {}'.format(
             ', '.join(result)))
 
-        return list(result)
+        return result
+
+    def _publish_members(self, relation, my_ingress_address):
+        """Publish the ensemble's members in the peer application databag.
+
+        Only the leader unit reads the databag of every unit. The other units
+        read the members from this single key, and reconfigure ZooKeeper
+        only if its generation changed, which keeps the cost of a peer
+        relation event independent of the number of units.
+
+        :param relation: the peer relation
+        :type relation: ops.model.Relation
+        :param my_ingress_address: this unit's ingress address
+        :type my_ingress_address: str
+        """
+        if relation is None or not self.unit.is_leader():
+            return
+
+        server_ids = self._get_server_ids(relation)
+        members = {}
+        for unit in [self.unit] + list(relation.units):
+            server_id = server_ids.get(unit.name)
+            if unit == self.unit:
+                address = my_ingress_address
+            else:
+                address = relation.data[unit].get(
+                    self.__INGRESS_ADDR_PEER_REL_DATA_KEY)
+            if server_id is not None and address is not None:
+                members[server_id] = address
+
+        if members == self.__get_members(relation):
+            return
+        app_data = relation.data[self.app]
+        generation = int(app_data.get(
+            self.__MEMBERS_GENERATION_PEER_REL_DATA_KEY, '0')) + 1
+        logging.info('Publishing ensemble members, generation {}: {}'.format(
+            generation, members))
+        app_data[self.__MEMBERS_PEER_REL_DATA_KEY] = json.dumps(
+            members, sort_keys=True)
+        app_data[self.__MEMBERS_GENERATION_PEER_REL_DATA_KEY] = str(
+            generation)
+
+    def __get_members(self, relation):
+        """Get the ensemble's members published by the leader unit.
+
+        :param relation: the peer relation
+        :type relation: ops.model.Relation
+        :returns: the address of each member by server ID.
+        :rtype: Dict[int, str]
+        """
+        members = json.loads(relation.data[self.app].get(
+            self.__MEMBERS_PEER_REL_DATA_KEY, '{}'))
+        return {int(server_id): address
+                for server_id, address in members.items()}
+
+    def __get_members_generation(self, relation):
+        """Get the generation of the members published by the leader unit.
+
+        :param relation: the peer relation
+        :type relation: ops.model.Relation
+        :rtype: Optional[str]
+        """
+        if relation is None:
+            return None
+        return relation.data[self.app].get(
+            self.__MEMBERS_GENERATION_PEER_REL_DATA_KEY)
+
+    def _allocate_server_ids(self, relation, my_ingress_address):
+        """Allocate a ZooKeeper server ID to the units which have none yet.
+
+        Server IDs are recorded in the peer application databag. A unit keeps
+        its ID for its whole life, even if its address changes, and IDs of
+        departed units are never reused, so that adding or removing units
+        doesn't change the identity of the other servers.
+
+        :param relation: the peer relation
+        :type relation: ops.model.Relation
+        :param my_ingress_address: this unit's ingress address
+        :type my_ingress_address: str
+        """
+        if relation is None or not self.unit.is_leader():
+            return
+
+        server_ids = self._get_server_ids(relation)
+        app_data = relation.data[self.app]
+        next_server_id = int(app_data.get(
+            self.__NEXT_SERVER_ID_PEER_REL_DATA_KEY,
+            max(server_ids.values(), default=0) + 1))
+
+        units = [self.unit] + list(relation.units)
+        unit_names = {unit.name for unit in units}
+        new_server_ids = {unit_name: server_id
+                          for unit_name, server_id in server_ids.items()
+                          if unit_name in unit_names}
+
+        # Allocating in address order gives units deployed by former versions
+        # of this charm the ID they already have:
+        def _address_order(unit):
+            if unit == self.unit:
+                address = my_ingress_address
+            else:
+                address = relation.data[unit].get(
+                    self.__INGRESS_ADDR_PEER_REL_DATA_KEY)
+            return (address is None, address or '', unit.name)
+
+        for unit in sorted(units, key=_address_order):
+            if unit.name not in new_server_ids:
+                new_server_ids[unit.name] = next_server_id
+                logging.info('Allocated server ID {} to {}'.format(
+                    next_server_id, unit.name))
+                next_server_id += 1
+
+        if new_server_ids != server_ids:
+            app_data[self.__SERVER_IDS_PEER_REL_DATA_KEY] = json.dumps(
+                new_server_ids, sort_keys=True)
+        app_data[self.__NEXT_SERVER_ID_PEER_REL_DATA_KEY] = str(
+            next_server_id)
+
+    def _ensure_super_password(self, relation):
+        """Generate the password of ZooKeeper's super user if not done yet.
+
+        The charm authenticates as super user for privileged operations like
+        reconfig. The password is shared with peers in the peer application
+        databag.
+
+        :param relation: the peer relation
+        :type relation: ops.model.Relation
+        """
+        if relation is None or not self.unit.is_leader():
+            return
+        app_data = relation.data[self.app]
+        if not app_data.get(self.__SUPER_PASSWORD_PEER_REL_DATA_KEY):
+            app_data[self.__SUPER_PASSWORD_PEER_REL_DATA_KEY] = (
+                secrets.token_urlsafe(24))
+
+    def __get_super_password(self):
+        """Get the password of ZooKeeper's super user, if generated yet.
+
+        :rtype: Optional[str]
+        """
+        relation = self.model.get_relation('replicas')
+        if relation is None:
+            return None
+        return relation.data[self.app].get(
+            self.__SUPER_PASSWORD_PEER_REL_DATA_KEY)
+
+    def _get_server_ids(self, relation):
+        """Get the server ID allocated to each unit.
+
+        :param relation: the peer relation
+        :type relation: ops.model.Relation
+        :returns: server IDs by unit name.
+        :rtype: Dict[str, int]
+        """
+        return json.loads(relation.data[self.app].get(
+            self.__SERVER_IDS_PEER_REL_DATA_KEY, '{}'))
+
+    def _get_servers(self, relation, my_ingress_address):
+        """Get this unit's server ID and the address of all servers.
+
+        Servers are the members published by the leader unit, see
+        _publish_members(). Units without an allocated server ID or shared
+        address yet are left out.
+
+        :param relation: the peer relation
+        :type relation: ops.model.Relation
+        :param my_ingress_address: this unit's ingress address
+        :type my_ingress_address: str
+        :returns: this unit's server ID, or None if not allocated yet, and the
+                  address of each server by server ID.
+        :rtype: Tuple[Optional[int], Dict[int, str]]
+        """
+        if relation is None:
+            # Too early to know about peers, this unit is alone so far:
+            return 1, {1: my_ingress_address}
+
+        my_server_id = self._get_server_ids(relation).get(self.unit.name)
+        servers = self.__get_members(relation)
+        if my_server_id is not None:
+            # The leader may not know about our latest address yet:
+            servers[my_server_id] = my_ingress_address
+        return my_server_id, servers
 
     def _get_my_ingress_address(self, relation):
         """Returns this unit's address on which it wishes to be contacted.
@@ -238,83 +1228,422 @@ class ZookeeperK8SCharm(CharmBase):
         # https://bugs.launchpad.net/juju/+bug/1922133
         return str(network.ingress_address or network.bind_address)
 
-    def __push_zookeeper_config(self, workload_container, my_ingress_address,
-                                all_unit_ingress_addresses):
-        """Write ZooKeeper's config files to disk.
+    def __is_config_valid(self, workload_container):
+        """Check the charm config, setting the unit's status accordingly.
 
-        See https://zookeeper.apache.org/doc/current/zookeeperStarted.html
+        ZooKeeper fails to start or misbehaves with some combinations of
+        settings, so the config is then not applied at all.
 
         :param workload_container: the container in which ZooKeeper is running
         :type workload_container: ops.model.Container
-        :param all_unit_ingress_addresses: Each unit's (first) ingress address.
-        :type all_unit_ingress_addresses: List[str]
+        :rtype: bool
+        """
+        errors = zk_config.validate(self.config)
+        if len(errors):
+            logging.warning('Invalid config: {}'.format('; '.join(errors)))
+            self.unit.status = BlockedStatus('; '.join(errors))
+            return False
+        self.__config_warnings = zk_config.get_warnings(
+            self.config, self.__get_snapshot_size(workload_container))
+        if len(self.__config_warnings):
+            logging.warning('Config may cause trouble: {}'.format(
+                '; '.join(self.__config_warnings)))
+        # Also clear warnings about a previous config:
+        if isinstance(self.unit.status, (ActiveStatus, BlockedStatus)):
+            self.unit.status = ActiveStatus('; '.join(self.__config_warnings))
+        return True
+
+    def __get_snapshot_size(self, workload_container):
+        """Get the size of ZooKeeper's latest snapshot.
+
+        :param workload_container: the container in which ZooKeeper is running
+        :type workload_container: ops.model.Container
+        :returns: the size in bytes, 0 if there is no snapshot yet.
+        :rtype: int
+        """
+        try:
+            snapshots = workload_container.list_files(
+                self.__SNAPSHOT_DIR_PATH, pattern='snapshot.*')
+        except (pebble.APIError, pebble.ConnectionError) as e:
+            logging.debug('Cannot list snapshots: {}'.format(e))
+            return 0
+        if not len(snapshots):
+            return 0
+        # Snapshots are named after the last zxid they include:
+        latest = max(snapshots, key=lambda f: int(f.name.split('.')[1], 16))
+        return latest.size or 0
+
+    def __read_file(self, workload_container, path):
+        """Read a text file from the workload container.
+
+        :param workload_container: the container in which ZooKeeper is running
+        :type workload_container: ops.model.Container
+        :returns: the file's content, or None if it can't be read.
+        :rtype: Optional[str]
         """
-        MAIN_CONFIG_FILE_PATH = '/conf/zoo.cfg'
-        ID_CONFIG_FILE_PATH = '/data/myid'
+        try:
+            if not workload_container.exists(path):
+                return None
+            return workload_container.pull(path).read()
+        except (pebble.PathError, pebble.APIError,
+                pebble.ConnectionError) as e:
+            logging.debug('Cannot read {}: {}'.format(path, e))
+            return None
+
+    def __push_zookeeper_config(self, workload_container, my_server_id,
+                                servers, force=False):
+        """Write ZooKeeper's config files to disk, unless they are the same
+        as the ones written last time.
 
+        See https://zookeeper.apache.org/doc/current/zookeeperStarted.html
+
+        :param workload_container: the container in which ZooKeeper is running
+        :type workload_container: ops.model.Container
+        :param my_server_id: this unit's server ID
+        :type my_server_id: int
+        :param servers: the address of each server by server ID
+        :type servers: Dict[int, str]
+        :param force: write the files even if unchanged.
+        :type force: bool
+        :returns: whether the files were written.
+        :rtype: bool
+        """
         client_port = self.config[self.__CLIENT_PORT_CONFIG_KEY]
         server_port = self.config['server-port']
         leader_election_port = self.config['leader-election-port']
+        is_dynamic = self.config[self.__DYNAMIC_RECONFIG_CONFIG_KEY]
 
-        # NOTE(lourot): All server IDs have to match in the config file of all
-        # units. Thus we sort the list in the same way on all units.
-        server_addresses = sorted(all_unit_ingress_addresses)
+        roles = zk_config.get_server_roles(
+            servers, self.config[zk_config.VOTERS_OPTION])
         server_config_part = ''
-        for i in range(len(server_addresses)):
-            server_id = i + 1
-            server_address = server_addresses[i]
-            if server_address == my_ingress_address:
-                my_id = server_id
-
-            server_config_part += (
-                f'server.{server_id}={server_address}:'
-                f'{server_port}:{leader_election_port}\n'
-            )
+        for server_id, server_address in sorted(servers.items()):
+            if is_dynamic:
+                server_spec = zk_config.render_server_spec(
+                    server_address, server_port, leader_election_port,
+                    role=roles[server_id], client_port=client_port)
+            else:
+                # Participant is the default role:
+                role = roles[server_id]
+                server_spec = zk_config.render_server_spec(
+                    server_address, server_port, leader_election_port,
+                    role=None if role == zk_config.PARTICIPANT else role)
+            server_config_part += f'server.{server_id}={server_spec}\n'
 
         main_config_file_content = textwrap.dedent(f'''\
         # Generated by the Charmed Operator
         dataDir=/data
         clientPort={client_port}
         dataLogDir=/datalog
-        tickTime=2000
-        initLimit=5
-        syncLimit=2
-        autopurge.snapRetainCount=3
-        autopurge.purgeInterval=0
-        maxClientCnxns=60
         admin.enableServer=true
-        ''') + server_config_part
+        metricsProvider.className={zk_metrics.PROMETHEUS_METRICS_PROVIDER}
+        metricsProvider.exportJvmInfo=true
+        ''')
+        main_config_file_content += zk_config.render_tunables(self.config)
+        if is_dynamic:
+            # Membership goes to the dynamic config file, which ZooKeeper
+            # maintains itself once started. It is thus left out of the hash
+            # so that membership changes don't lead to restarts.
+            main_config_file_content += textwrap.dedent('''\
+            reconfigEnabled=true
+            standaloneEnabled=false
+            ''')
+        else:
+            if roles.get(my_server_id) == zk_config.OBSERVER:
+                main_config_file_content += 'peerType=observer\n'
+            main_config_file_content += server_config_part
+
+        id_config_file_content = f'{my_server_id}\n'
+
+        config_files = [
+            (self.__MAIN_CONFIG_FILE_PATH, main_config_file_content),
+            (self.__ID_CONFIG_FILE_PATH, id_config_file_content),
+        ]
+        config_hash = hashlib.sha256()
+        for path, content in config_files:
+            config_hash.update(f'{path}\0{content}\0'.encode())
+        config_hash = config_hash.hexdigest()
+        if not force and config_hash == self._stored.zookeeper_config_hash:
+            logging.debug('ZooKeeper config unchanged (sha256 {}), not '
+                          'writing it'.format(config_hash))
+            return False
 
-        id_config_file_content = f'{my_id}\n'
+        if is_dynamic:
+            dynamic_config_file_path = self.__get_dynamic_config_file_path(
+                workload_container)
+            main_config_file_content += (
+                f'dynamicConfigFile={dynamic_config_file_path}\n')
+            config_files[0] = (self.__MAIN_CONFIG_FILE_PATH,
+                               main_config_file_content)
+            if not workload_container.exists(dynamic_config_file_path):
+                config_files.append(
+                    (dynamic_config_file_path, server_config_part))
 
-        for path, content in (
-                (MAIN_CONFIG_FILE_PATH, main_config_file_content),
-                (ID_CONFIG_FILE_PATH, id_config_file_content)
-        ):
+        for path, content in config_files:
             logging.debug('Writing config to {}:\n{}'.format(path, content))
             workload_container.push(path=path, source=content)
+        self._stored.zookeeper_config_hash = config_hash
+        return True
+
+    def __get_dynamic_config_file_path(self, workload_container):
+        """Get the path of the dynamic config file currently in use.
+
+        On each reconfiguration ZooKeeper writes a new dynamic config file
+        and points zoo.cfg to it.
+
+        :param workload_container: the container in which ZooKeeper is running
+        :type workload_container: ops.model.Container
+        :rtype: str
+        """
+        if workload_container.exists(self.__MAIN_CONFIG_FILE_PATH):
+            content = workload_container.pull(
+                self.__MAIN_CONFIG_FILE_PATH).read()
+            for line in content.splitlines():
+                key, _, value = line.strip().partition('=')
+                if key == 'dynamicConfigFile' and value:
+                    return value
+        return self.__DYNAMIC_CONFIG_FILE_PATH
+
+    def __reconfigure_ensemble(self, event, servers):
+        """Add and remove servers to and from the running ensemble, without
+        restarting any server.
+
+        See https://zookeeper.apache.org/doc/current/zookeeperReconfig.html
+
+        :param event: the event being handled, deferred if reconfiguring
+                      fails or can't be done yet. None on update-status,
+                      which retries anyway.
+        :type event: Optional[ops.framework.EventBase]
+        :param servers: the address of each wanted server by server ID
+        :type servers: Dict[int, str]
+        """
+        if not len(servers):
+            # Nothing to reconfigure yet:
+            return
+        if not zk_admin.is_serving():
+            # Either the ensemble isn't up yet, and starts with the right
+            # members, or it lost its quorum, and a departing server must
+            # still be removed once it is back:
+            logging.debug('ZooKeeper not serving, not reconfiguring the '
+                          'ensemble yet')
+            if event is not None:
+                event.defer()
+            return
+
+        client_port = self.config[self.__CLIENT_PORT_CONFIG_KEY]
+        # Promoting an observer or demoting a participant is done by
+        # re-adding it with its new role:
+        roles = zk_config.get_server_roles(
+            servers, self.config[zk_config.VOTERS_OPTION])
+        wanted_servers = {
+            server_id: zk_config.render_server_spec(
+                server_address, self.config['server-port'],
+                self.config['leader-election-port'],
+                role=roles[server_id], client_port=client_port)
+            for server_id, server_address in servers.items()
+        }
+        try:
+            with self.__zookeeper_client() as zk:
+                current_servers, version = zk_config.parse_dynamic_config(
+                    zk.get('/zookeeper/config')[0].decode())
+                joining, leaving = zk_config.get_membership_changes(
+                    current_servers, wanted_servers)
+                if not len(joining) and not len(leaving):
+                    return
+                logging.info('Reconfiguring ensemble version {}: joining {}, '
+                             'leaving {}'.format(version, joining, leaving))
+                zk.reconfig(joining=','.join(joining) or None,
+                            leaving=','.join(leaving) or None,
+                            new_members=None)
+        except KazooException as e:
+            logging.warning('Reconfiguring ensemble failed, will retry: '
+                            '{}'.format(e))
+            if event is not None:
+                event.defer()
+
+    def __request_restart(self, workload_container, relation):
+        """Get ZooKeeper restarted, without the ensemble losing its quorum.
+
+        Restarts are serialized over the peer relation: a unit publishes a
+        restart request and restarts only once the leader unit granted it
+        the restart token, see __process_rolling_restart(). If there is no
+        quorum to protect, ZooKeeper is restarted straight away instead.
+
+        :param workload_container: the container in which ZooKeeper is running
+        :type workload_container: ops.model.Container
+        :param relation: the peer relation
+        :type relation: ops.model.Relation
+        """
+        if relation is None or not len(relation.units) or (
+                not zk_admin.is_serving()):
+            logging.debug('No quorum to protect, restarting right away')
+            self.__restart_zookeeper(workload_container)
+            return
+
+        my_data = relation.data[self.unit]
+        request = my_data.get(self.__RESTART_REQUEST_PEER_REL_DATA_KEY, '0')
+        done = my_data.get(self.__RESTART_DONE_PEER_REL_DATA_KEY, '0')
+        if request != done:
+            # A restart is already pending and will pick up the new config:
+            return
+        request = str(int(request) + 1)
+        logging.debug('Requesting rolling restart #{}'.format(request))
+        my_data[self.__RESTART_REQUEST_PEER_REL_DATA_KEY] = request
+
+    def __process_rolling_restart(self, workload_container, relation):
+        """Restart if the restart token is ours and pass the token on.
+
+        The leader unit grants the token to one requesting unit at a time,
+        the unit running the ZooKeeper leader last so that the ensemble
+        elects a new leader only once. The token is passed on once the
+        restarted server is serving again, i.e. synced with the leader.
+
+        :param workload_container: the container in which ZooKeeper is running
+        :type workload_container: ops.model.Container
+        :param relation: the peer relation
+        :type relation: ops.model.Relation
+        """
+        if relation is None:
+            return
+
+        token = relation.data[self.app].get(
+            self.__RESTART_TOKEN_PEER_REL_DATA_KEY)
+        my_request = self.__get_restart_request(self.unit, relation)
+        if my_request is not None and token == my_request:
+            self.__restart_zookeeper_and_wait(workload_container, relation)
+
+        if not self.unit.is_leader():
+            return
+
+        while True:
+            token = relation.data[self.app].get(
+                self.__RESTART_TOKEN_PEER_REL_DATA_KEY)
+            if token:
+                holder = self.__get_restart_token_holder(token, relation)
+                is_holder_restarting = holder is not None and (
+                    self.__get_restart_request(holder, relation) == token)
+                if is_holder_restarting:
+                    # Still restarting, will be released on a later
+                    # relation-changed:
+                    return
+                logging.debug('Restart token {} released'.format(token))
+                relation.data[self.app][
+                    self.__RESTART_TOKEN_PEER_REL_DATA_KEY] = ''
+
+            next_unit = self.__get_next_unit_to_restart(relation)
+            if next_unit is None:
+                return
+            token = self.__get_restart_request(next_unit, relation)
+            logging.info('Granting restart token {}'.format(token))
+            relation.data[self.app][
+                self.__RESTART_TOKEN_PEER_REL_DATA_KEY] = token
+            if next_unit != self.unit:
+                return
+            self.__restart_zookeeper_and_wait(workload_container, relation)
+
+    def __get_restart_request(self, unit, relation):
+        """Get the unit's pending restart request, if any.
+
+        :returns: the restart token the unit is waiting for, e.g.
+                  `zookeeper-k8s/1:3`, or None.
+        :rtype: Optional[str]
+        """
+        unit_data = relation.data[unit]
+        request = unit_data.get(self.__RESTART_REQUEST_PEER_REL_DATA_KEY)
+        if request is None or request == unit_data.get(
+                self.__RESTART_DONE_PEER_REL_DATA_KEY):
+            return None
+        return '{}:{}'.format(unit.name, request)
+
+    def __get_restart_token_holder(self, token, relation):
+        """Get the unit holding the restart token, unless it departed.
+
+        :rtype: Optional[ops.model.Unit]
+        """
+        unit_name = token.rsplit(':', 1)[0]
+        for unit in [self.unit] + list(relation.units):
+            if unit.name == unit_name:
+                return unit
+        return None
+
+    def __get_next_unit_to_restart(self, relation):
+        """Pick the next unit to grant the restart token to.
+
+        :rtype: Optional[ops.model.Unit]
+        """
+        requesting_units = sorted(
+            (unit for unit in [self.unit] + list(relation.units)
+             if self.__get_restart_request(unit, relation) is not None),
+            key=lambda unit: unit.name)
+        if not len(requesting_units):
+            return None
+
+        leader_address = zk_admin.get_leader_address()
+        for unit in requesting_units:
+            if relation.data[unit].get(
+                    self.__INGRESS_ADDR_PEER_REL_DATA_KEY) != leader_address:
+                return unit
+        return requesting_units[0]
+
+    def __restart_zookeeper_and_wait(self, workload_container, relation):
+        """Restart ZooKeeper and mark this unit's restart request as done
+        once it is serving again.
+
+        :param workload_container: the container in which ZooKeeper is running
+        :type workload_container: ops.model.Container
+        :param relation: the peer relation
+        :type relation: ops.model.Relation
+        """
+        if self.__restart_zookeeper(workload_container) and (
+                not zk_admin.wait_until_serving(
+                    self.__RESTART_TIMEOUT_SECONDS)):
+            # Don't block the other units forever:
+            logging.warning('ZooKeeper not serving {}s after restart, passing '
+                            'the restart token on anyway'.format(
+                                self.__RESTART_TIMEOUT_SECONDS))
+
+        my_data = relation.data[self.unit]
+        my_data[self.__RESTART_DONE_PEER_REL_DATA_KEY] = my_data[
+            self.__RESTART_REQUEST_PEER_REL_DATA_KEY]
 
     def __restart_zookeeper(self, workload_container):
         """Restart ZooKeeper by restarting the Pebble services.
 
         :param workload_container: the container in which ZooKeeper is running
         :type workload_container: ops.model.Container
+        :returns: whether ZooKeeper was restarted.
+        :rtype: bool
         """
         services = workload_container.get_plan().to_dict().get('services', {})
         if not len(services):
             # No Pebble service defined yet, too early:
-            return
+            return False
 
         logging.info('Restarting ZooKeeper...')
         workload_container.stop(self.__PEBBLE_SERVICE_NAME)
         # Autostart any services that were defined with startup: enabled :
         workload_container.autostart()
+        return True
 
     @contextmanager
     def __zookeeper_client(self):
         client_port = self.config[self.__CLIENT_PORT_CONFIG_KEY]
-        zk = KazooClient(hosts='127.0.0.1:{}'.format(client_port))
-        zk.start()
+        kwargs = {}
+        super_password = self.__get_super_password()
+        if super_password is not None:
+            # Needed for privileged operations like reconfig:
+            kwargs['auth_data'] = [
+                ('digest', '{}:{}'.format(self.__SUPER_USER, super_password))]
+        # Imported here as most hooks don't talk to ZooKeeper, and importing
+        # kazoo.client takes a significant share of a hook's run time:
+        from kazoo.client import KazooClient
+        zk = KazooClient(hosts='127.0.0.1:{}'.format(client_port), **kwargs)
+        try:
+            zk.start()
+        except zk.handler.timeout_exception as e:
+            # Not a KazooException, which is what callers expect ZooKeeper
+            # not being reachable to raise:
+            raise KazooException(
+                'Connecting to ZooKeeper failed: {}'.format(e)) from e
         try:
             yield zk
         finally:
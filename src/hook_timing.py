@@ -0,0 +1,131 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Timing what a hook spends its time on.
+
+Each timed call is logged as a JSON record, e.g.
+
+    {"hook": "config-changed", "kind": "juju-tool", "name": "relation_get",
+     "seconds": 0.012}
+
+and `HookTimer.log_summary()` logs the number of calls and total time per
+kind and name, e.g. to find out which Juju tools or Pebble calls a slow hook
+makes the most.
+"""
+
+import collections
+import functools
+import json
+import logging
+import os
+import time
+
+HANDLER = 'handler'
+JUJU_TOOL = 'juju-tool'
+PEBBLE = 'pebble'
+
+logger = logging.getLogger(__name__)
+
+
+def get_hook_name():
+    """Get the name of the running hook or action, e.g. `config-changed`.
+
+    :rtype: str
+    """
+    dispatch_path = os.environ.get('JUJU_DISPATCH_PATH', '')
+    return os.path.basename(dispatch_path) or 'unknown'
+
+
+class HookTimer:
+    """Times calls and aggregates their durations.
+
+    :param hook_name: the name of the running hook or action
+    :type hook_name: str
+    """
+    def __init__(self, hook_name):
+        self.hook_name = hook_name
+        self.__start = time.monotonic()
+        # Call count and total seconds by (kind, name):
+        self.totals = collections.defaultdict(lambda: [0, 0.0])
+
+    def wrap(self, func, kind, name):
+        """Get a version of a function timing each of its calls.
+
+        :type func: Callable
+        :param kind: what the function is, e.g. `juju-tool`
+        :type kind: str
+        :type name: str
+        :rtype: Callable
+        """
+        @functools.wraps(func)
+        def _timed(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(kind, name, time.monotonic() - start)
+        return _timed
+
+    def instrument(self, obj, kind, names=None):
+        """Time the calls to the public methods of an object.
+
+        :param obj: e.g. the model backend or a Pebble client
+        :param kind: what the methods are, e.g. `pebble`
+        :type kind: str
+        :param names: the methods to time, all public ones if None
+        :type names: Optional[Iterable[str]]
+        """
+        if names is None:
+            names = [name for name in dir(obj) if not name.startswith('_')]
+        for name in names:
+            method = getattr(obj, name, None)
+            if callable(method) and not isinstance(method, type):
+                setattr(obj, name, self.wrap(method, kind, name))
+
+    def record(self, kind, name, seconds):
+        """Record and log the duration of a call.
+
+        :type kind: str
+        :type name: str
+        :type seconds: float
+        """
+        total = self.totals[(kind, name)]
+        total[0] += 1
+        total[1] += seconds
+        logger.debug(json.dumps({
+            'hook': self.hook_name,
+            'kind': kind,
+            'name': name,
+            'seconds': round(seconds, 6),
+        }))
+
+    def get_summary(self):
+        """Get the number of calls and total time per kind and name.
+
+        :returns: with `hook`, `seconds` since the timer was created, and
+                  `calls`, one dict per kind and name, longest first.
+        :rtype: Dict[str, Any]
+        """
+        calls = [{'kind': kind, 'name': name, 'count': count,
+                  'seconds': round(seconds, 6)}
+                 for (kind, name), (count, seconds) in self.totals.items()]
+        calls.sort(key=lambda call: call['seconds'], reverse=True)
+        return {
+            'hook': self.hook_name,
+            'seconds': round(time.monotonic() - self.__start, 6),
+            'calls': calls,
+        }
+
+    def log_summary(self):
+        logger.info(json.dumps(self.get_summary()))
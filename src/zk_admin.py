@@ -0,0 +1,118 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Querying ZooKeeper's AdminServer.
+
+See https://zookeeper.apache.org/doc/current/zookeeperAdmin.html#sc_adminserver
+"""
+
+import json
+import logging
+import time
+import urllib.error
+import urllib.request
+
+DEFAULT_PORT = 8080
+
+# Values of `server_state` in which a server serves client requests. A
+# follower or observer only gets there once synced with the leader.
+SERVING_STATES = ('leader', 'follower', 'observer', 'standalone')
+
+logger = logging.getLogger(__name__)
+
+
+def run_command(command, host='127.0.0.1', port=DEFAULT_PORT, timeout=5):
+    """Run an AdminServer command, e.g. `monitor` (a.k.a. `mntr`).
+
+    :returns: the command's output, or None if the server couldn't be
+              reached or the command failed.
+    :rtype: Optional[Dict[str, Any]]
+    """
+    url = 'http://{}:{}/commands/{}'.format(host, port, command)
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            result = json.load(response)
+    except (OSError, ValueError) as e:
+        logger.debug('{} failed: {}'.format(url, e))
+        return None
+    if result.get('error'):
+        logger.debug('{} failed: {}'.format(url, result['error']))
+        return None
+    return result
+
+
+def is_serving(host='127.0.0.1', port=DEFAULT_PORT):
+    """Whether the server is up, part of a quorum and serving clients.
+
+    :rtype: bool
+    """
+    monitor = run_command('monitor', host, port)
+    if monitor is None:
+        return False
+    return monitor.get('server_state') in SERVING_STATES
+
+
+def wait_until_serving(timeout, host='127.0.0.1', port=DEFAULT_PORT,
+                       interval=2):
+    """Poll the server until it is serving or `timeout` seconds elapsed.
+
+    :returns: whether the server is serving.
+    :rtype: bool
+    """
+    deadline = time.monotonic() + timeout
+    while not is_serving(host, port):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+def get_leader_address(host='127.0.0.1', port=DEFAULT_PORT):
+    """Get the address of the ensemble's current leader, as seen by a server.
+
+    :rtype: Optional[str]
+    """
+    leader = run_command('leader', host, port)
+    if leader is None:
+        return None
+    return leader.get('leader_ip')
+
+
+def get_server_stats(host='127.0.0.1', port=DEFAULT_PORT):
+    """Get a server's state, latency, connection count, last zxid, etc.
+
+    :returns: the `server_stats` of the `srvr` command, or None if the server
+              couldn't be reached.
+    :rtype: Optional[Dict[str, Any]]
+    """
+    result = run_command('srvr', host, port)
+    if result is None:
+        return None
+    return result.get('server_stats')
+
+
+def get_zxid_lag(zxid, leader_zxid):
+    """Compute how many transactions a server is behind the leader.
+
+    The high 32 bits of a zxid are the epoch, i.e. the election which the
+    transaction was proposed after, and the low 32 bits a counter reset on
+    each epoch.
+
+    :returns: the number of transactions, or None if the server is still
+              on a former epoch.
+    :rtype: Optional[int]
+    """
+    if zxid >> 32 != leader_zxid >> 32:
+        return None
+    return max(0, leader_zxid - zxid)
@@ -0,0 +1,214 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Physical backups: copies of ZooKeeper's snapshot and transaction log files.
+
+A backup is a directory holding each copied file gzip-compressed, and a
+`manifest.json` describing them. A full backup holds the latest snapshot and
+the transaction logs needed to replay the transactions that followed it. An
+incremental backup only holds the transaction logs written since its base
+backup, and is restored on top of it.
+
+See https://zookeeper.apache.org/doc/current/zookeeperAdmin.html#sc_dataFileManagement
+"""
+
+import hashlib
+import zlib
+
+from zk_dump import GZIP_WBITS
+
+MANIFEST_FILE_NAME = 'manifest.json'
+SNAPSHOT_PREFIX = 'snapshot.'
+LOG_PREFIX = 'log.'
+# Written on elections, a server refuses to start if they are missing but a
+# snapshot isn't:
+EPOCH_FILE_NAMES = ('acceptedEpoch', 'currentEpoch')
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_zxid(file_name):
+    """Get the zxid in the name of a snapshot or transaction log file.
+
+    A snapshot is named after the last transaction it includes, and a
+    transaction log after the first transaction it holds.
+
+    :type file_name: str
+    :rtype: int
+    """
+    return int(file_name.rsplit('.', 1)[1], 16)
+
+
+def select_files(snapshot_names, log_names, since_zxid=None):
+    """Select the files to back up.
+
+    :param snapshot_names: names of the snapshot files
+    :type snapshot_names: Iterable[str]
+    :param log_names: names of the transaction log files
+    :type log_names: Iterable[str]
+    :param since_zxid: for an incremental backup, the zxid of the latest
+                       transaction log of the base backup, which is copied
+                       again as it may have grown since.
+    :type since_zxid: Optional[int]
+    :returns: the name of the snapshot file to back up, if any, and of the
+              transaction log files, oldest first.
+    :rtype: Tuple[Optional[str], List[str]]
+    :raises ValueError: if the transaction logs following the base backup
+                        were purged, so that an incremental backup would
+                        miss transactions.
+    """
+    log_names = sorted(log_names, key=get_zxid)
+    if since_zxid is not None:
+        first_log_index = _get_log_index(log_names, since_zxid)
+        if first_log_index is None:
+            raise ValueError('The transaction logs following zxid {:#x} '
+                             'were purged'.format(since_zxid))
+        return None, log_names[first_log_index:]
+
+    snapshot_names = sorted(snapshot_names, key=get_zxid)
+    if not len(snapshot_names):
+        return None, log_names
+    snapshot_name = snapshot_names[-1]
+    # Like ZooKeeper, also keep the log holding the first transaction after
+    # the snapshot, which may have started before it:
+    first_log_index = _get_log_index(log_names, get_zxid(snapshot_name)) or 0
+    return snapshot_name, log_names[first_log_index:]
+
+
+def _get_log_index(log_names, zxid):
+    """Get the index of the transaction log holding the transaction
+    following a zxid, i.e. the latest one starting at or before it.
+
+    :param log_names: names of the transaction log files, oldest first
+    :type log_names: List[str]
+    :type zxid: int
+    :rtype: Optional[int]
+    """
+    index = None
+    for i, name in enumerate(log_names):
+        if get_zxid(name) <= zxid:
+            index = i
+    return index
+
+
+class _ChunkedStream:
+    """Read-only file-like object transforming another one chunk by chunk.
+
+    Meant to be passed as `source` to `ops.model.Container.push()`. Once
+    fully read, `raw_byte_count` and `byte_count` are the number of bytes
+    read from `fileobj` and produced, and `sha256` the checksum of the
+    produced bytes.
+
+    :param fileobj: binary file-like object to transform
+    """
+    def __init__(self, fileobj):
+        self.__fileobj = fileobj
+        self.__buffer = bytearray()
+        self.__eof = False
+        self.__sha256 = hashlib.sha256()
+        self.raw_byte_count = 0
+        self.byte_count = 0
+
+    @property
+    def sha256(self):
+        return self.__sha256.hexdigest()
+
+    def read(self, size=-1):
+        while not self.__eof and (size < 0 or len(self.__buffer) < size):
+            chunk = self.__fileobj.read(CHUNK_SIZE)
+            if chunk:
+                self.raw_byte_count += len(chunk)
+                self.__buffer += self._transform(chunk)
+            else:
+                self.__buffer += self._flush()
+                self.__eof = True
+
+        if size < 0:
+            size = len(self.__buffer)
+        chunk = bytes(self.__buffer[:size])
+        del self.__buffer[:size]
+
+        self.__sha256.update(chunk)
+        self.byte_count += len(chunk)
+        return chunk
+
+    def _transform(self, chunk):
+        raise NotImplementedError()
+
+    def _flush(self):
+        raise NotImplementedError()
+
+
+class CompressingStream(_ChunkedStream):
+    """Gzip-compresses a binary file-like object on the fly."""
+    def __init__(self, fileobj):
+        super().__init__(fileobj)
+        self.__compressor = zlib.compressobj(wbits=GZIP_WBITS)
+
+    def _transform(self, chunk):
+        return self.__compressor.compress(chunk)
+
+    def _flush(self):
+        return self.__compressor.flush()
+
+
+class DecompressingStream(_ChunkedStream):
+    """Decompresses a gzip-compressed binary file-like object on the fly."""
+    def __init__(self, fileobj):
+        super().__init__(fileobj)
+        self.__decompressor = zlib.decompressobj(wbits=GZIP_WBITS)
+
+    def _transform(self, chunk):
+        return self.__decompressor.decompress(chunk)
+
+    def _flush(self):
+        return self.__decompressor.flush()
+
+
+def get_sha256(fileobj):
+    """Get the checksum of the content of a binary file-like object, reading
+    it chunk by chunk.
+
+    :rtype: str
+    """
+    sha256 = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_restore_chain(manifests, backup_id):
+    """Get the backups to restore, in order, to restore a given backup.
+
+    :param manifests: the manifest of each backup by backup ID
+    :type manifests: Dict[str, Dict[str, Any]]
+    :param backup_id: the backup to restore
+    :type backup_id: str
+    :returns: the IDs of the full backup the given one is based on and of
+              the following incremental backups, ending with the given one.
+    :rtype: List[str]
+    :raises ValueError: if a backup of the chain is missing, or if the
+                        chain loops.
+    """
+    chain = [backup_id]
+    while True:
+        if chain[0] not in manifests:
+            raise ValueError(f'Backup {chain[0]} not found')
+        base = manifests[chain[0]].get('base')
+        if base is None:
+            return chain
+        if base in chain:
+            raise ValueError(f'Backup {chain[0]} is based on {base}, which '
+                             f'is based on it')
+        chain.insert(0, base)
@@ -0,0 +1,88 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Giving each client application its own chroot, optionally with quotas.
+
+A client connecting with a chroot, e.g. `10.1.0.42:2181/clients/foo`, sees
+`/clients/foo` as its root. Quotas are set the way `zkCli.sh setquota` does,
+see https://zookeeper.apache.org/doc/current/zookeeperQuotas.html
+"""
+
+import posixpath
+
+from kazoo.exceptions import NoNodeError
+
+CHROOTS_PATH = '/clients'
+QUOTA_ROOT_PATH = '/zookeeper/quota'
+QUOTA_LIMITS_NODE_NAME = 'zookeeper_limits'
+QUOTA_STATS_NODE_NAME = 'zookeeper_stats'
+
+
+def get_chroot(app_name):
+    """Get the chroot of a client application.
+
+    :type app_name: str
+    :rtype: str
+    """
+    return posixpath.join(CHROOTS_PATH, app_name)
+
+
+def render_quota(znode_count, byte_count):
+    """Render a quota the way ZooKeeper's StatsTrack does, -1 meaning
+    unlimited.
+
+    :type znode_count: int
+    :type byte_count: int
+    :rtype: bytes
+    """
+    return f'count={znode_count},bytes={byte_count}'.encode()
+
+
+def set_quota(zk, path, znode_count=0, byte_count=0):
+    """Set or remove the quota of a subtree.
+
+    ZooKeeper logs a warning and counts a quota violation in its metrics
+    whenever the subtree exceeds its quota.
+
+    :param zk: a started client
+    :type zk: kazoo.client.KazooClient
+    :param path: the root of the subtree
+    :type path: str
+    :param znode_count: maximum number of znodes, including `path`. 0 means
+                        unlimited.
+    :type znode_count: int
+    :param byte_count: maximum total size of the values, in bytes. 0 means
+                       unlimited.
+    :type byte_count: int
+    """
+    quota_path = QUOTA_ROOT_PATH + path
+    limits_path = posixpath.join(quota_path, QUOTA_LIMITS_NODE_NAME)
+    stats_path = posixpath.join(quota_path, QUOTA_STATS_NODE_NAME)
+
+    if not znode_count and not byte_count:
+        for node_path in (limits_path, stats_path):
+            try:
+                zk.delete(node_path)
+            except NoNodeError:
+                pass
+        return
+
+    limits = render_quota(znode_count or -1, byte_count or -1)
+    if zk.exists(limits_path) is None:
+        zk.create(limits_path, limits, makepath=True)
+    else:
+        zk.set(limits_path, limits)
+    if zk.exists(stats_path) is None:
+        # ZooKeeper keeps it up to date from then on:
+        zk.create(stats_path, render_quota(0, 0))
@@ -0,0 +1,284 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rendering and parsing ZooKeeper's configuration.
+
+See https://zookeeper.apache.org/doc/current/zookeeperAdmin.html#sc_configuration
+and https://zookeeper.apache.org/doc/current/zookeeperReconfig.html
+"""
+
+import base64
+import collections
+import hashlib
+import re
+
+PARTICIPANT = 'participant'
+OBSERVER = 'observer'
+
+# Charm config option limiting the number of voting servers:
+VOTERS_OPTION = 'voters'
+
+Tunable = collections.namedtuple(
+    'Tunable', ['option', 'key', 'minimum', 'maximum'])
+Tunable.__doc__ = """A charm config option rendered as-is into zoo.cfg.
+
+`minimum` and `maximum` are inclusive, None meaning unbounded.
+"""
+
+# NOTE: zoo.cfg keys ZooKeeper doesn't know about become Java system
+# properties prefixed with `zookeeper.`, which is how the throttling
+# settings introduced in ZooKeeper 3.6 are set.
+TUNABLES = (
+    Tunable('tick-time', 'tickTime', 1, None),
+    Tunable('init-limit', 'initLimit', 1, None),
+    Tunable('sync-limit', 'syncLimit', 1, None),
+    Tunable('max-client-cnxns', 'maxClientCnxns', 0, None),
+    Tunable('snap-count', 'snapCount', 2, None),
+    Tunable('pre-alloc-size', 'preAllocSize', 1, None),
+    Tunable('global-outstanding-limit', 'globalOutstandingLimit', 1, None),
+    Tunable('commit-log-count', 'commitLogCount', 1, None),
+    Tunable('request-throttle-limit', 'request_throttle_max_requests',
+            0, None),
+    Tunable('request-throttle-stall-time', 'request_throttle_stall_time',
+            1, None),
+    Tunable('request-throttle-drop-stale', 'request_throttle_drop_stale',
+            None, None),
+    Tunable('connection-throttle-tokens', 'connection_throttle_tokens',
+            0, None),
+    Tunable('connection-throttle-fill-time', 'connection_throttle_fill_time',
+            1, None),
+    Tunable('connection-throttle-fill-count',
+            'connection_throttle_fill_count', 1, None),
+    Tunable('connection-throttle-freeze-time',
+            'connection_throttle_freeze_time', -1, None),
+    Tunable('force-sync', 'forceSync', None, None),
+    Tunable('fsync-warning-threshold', 'fsync.warningthresholdms', 0, None),
+    Tunable('metrics-port', 'metricsProvider.httpPort', 1, 65535),
+    Tunable('snap-retain-count', 'autopurge.snapRetainCount', 3, None),
+    Tunable('purge-interval-hours', 'autopurge.purgeInterval', 0, None),
+    Tunable('local-sessions', 'localSessionsEnabled', None, None),
+    Tunable('local-sessions-upgrading', 'localSessionsUpgradingEnabled',
+            None, None),
+)
+
+# Charm config options enabling features clients opt in to, as shared with
+# them:
+LOCAL_SESSIONS_OPTION = 'local-sessions'
+LOCAL_SESSIONS_UPGRADING_OPTION = 'local-sessions-upgrading'
+# Passed to the JVM as `-Dreadonlymode.enabled`, which ZooKeeper only reads
+# as a system property:
+READ_ONLY_MODE_OPTION = 'read-only-mode'
+
+# Boolean keys for which ZooKeeper expects `yes` or `no`:
+YES_NO_KEYS = ('forceSync',)
+
+# Charm config option passed to the JVM as `-Djute.maxbuffer`. It bounds the
+# size of any request or response, including transactions and the
+# children list of a znode, and must be the same on all servers.
+JUTE_MAX_BUFFER_OPTION = 'jute-max-buffer'
+JUTE_MAX_BUFFER_MINIMUM = 1024
+
+# Conservative rate at which a follower is assumed to receive a snapshot
+# from the leader, in bytes per second, when checking init-limit. A follower
+# which doesn't get in sync within initLimit ticks is dropped by the leader.
+SNAPSHOT_TRANSFER_RATE = 20 * 1024 * 1024
+
+# Charm config options limiting the znodes and bytes of each client
+# application's chroot, 0 meaning unlimited:
+CLIENT_ZNODE_QUOTA_OPTION = 'client-znode-quota'
+CLIENT_BYTE_QUOTA_OPTION = 'client-byte-quota'
+
+# Charm config option overriding the heap size, in the format of `-Xmx`:
+HEAP_SIZE_OPTION = 'heap-size'
+HEAP_SIZE_PATTERN = re.compile(r'[0-9]+[kKmMgG]?')
+
+
+def render_server_spec(address, server_port, leader_election_port,
+                       role=None, client_port=None):
+    """Render the value of a `server.N` line.
+
+    :param role: `participant` or `observer`. Left out if None.
+    :type role: Optional[str]
+    :param client_port: only needed in dynamic config files.
+    :type client_port: Optional[int]
+    :rtype: str
+    """
+    spec = f'{address}:{server_port}:{leader_election_port}'
+    if role is not None:
+        spec += f':{role}'
+    if client_port is not None:
+        # This is how ZooKeeper itself writes it in /zookeeper/config:
+        spec += f';0.0.0.0:{client_port}'
+    return spec
+
+
+def parse_dynamic_config(content):
+    """Parse a dynamic config, e.g. the content of /zookeeper/config.
+
+    :type content: str
+    :returns: the spec of each server by server ID, and the config version
+              if any.
+    :rtype: Tuple[Dict[int, str], Optional[str]]
+    """
+    servers = {}
+    version = None
+    for line in content.splitlines():
+        key, _, value = line.strip().partition('=')
+        if key.startswith('server.'):
+            servers[int(key[len('server.'):])] = value
+        elif key == 'version':
+            version = value
+    return servers, version
+
+
+def get_server_roles(server_ids, voters):
+    """Decide which servers vote and which ones only observe.
+
+    Observers serve reads and forward writes like any other server, but
+    don't take part in elections nor in the write quorum, so they scale read
+    throughput without slowing writes down. The servers with the lowest IDs,
+    i.e. the oldest ones, vote, so that an observer gets promoted when a
+    voter leaves.
+
+    :param server_ids: the IDs of all servers
+    :type server_ids: Iterable[int]
+    :param voters: the wanted number of voting servers, 0 meaning all.
+    :type voters: int
+    :returns: the role of each server by server ID.
+    :rtype: Dict[int, str]
+    """
+    server_ids = sorted(server_ids)
+    if not voters:
+        voters = len(server_ids)
+    return {server_id: PARTICIPANT if i < voters else OBSERVER
+            for i, server_id in enumerate(server_ids)}
+
+
+def get_membership_changes(current_servers, wanted_servers):
+    """Compute the incremental reconfiguration turning an ensemble's
+    membership into another.
+
+    :param current_servers: spec of each current server by server ID
+    :type current_servers: Dict[int, str]
+    :param wanted_servers: spec of each wanted server by server ID
+    :type wanted_servers: Dict[int, str]
+    :returns: the `joining` servers, as `server.N=spec` strings, including
+              the ones whose spec changed, and the IDs of the `leaving` ones.
+    :rtype: Tuple[List[str], List[str]]
+    """
+    joining = [f'server.{server_id}={spec}'
+               for server_id, spec in sorted(wanted_servers.items())
+               if current_servers.get(server_id) != spec]
+    leaving = [str(server_id) for server_id in sorted(current_servers)
+               if server_id not in wanted_servers]
+    return joining, leaving
+
+
+def get_digest(user, password):
+    """Compute the digest of a user's credentials, as expected by
+    ZooKeeper's `DigestAuthenticationProvider.superDigest`.
+
+    :rtype: str
+    """
+    sha1 = hashlib.sha1(f'{user}:{password}'.encode()).digest()
+    return '{}:{}'.format(user, base64.b64encode(sha1).decode())
+
+
+def render_tunables(config):
+    """Render the tunable part of zoo.cfg.
+
+    :param config: the charm config
+    :type config: Mapping[str, Any]
+    :rtype: str
+    """
+    lines = []
+    for tunable in TUNABLES:
+        value = config[tunable.option]
+        if tunable.key in YES_NO_KEYS:
+            value = 'yes' if value else 'no'
+        elif isinstance(value, bool):
+            value = str(value).lower()
+        lines.append(f'{tunable.key}={value}\n')
+    return ''.join(lines)
+
+
+def validate(config):
+    """Check the charm config for values ZooKeeper would reject or choke on.
+
+    :param config: the charm config
+    :type config: Mapping[str, Any]
+    :returns: one human-readable message per problem.
+    :rtype: List[str]
+    """
+    errors = []
+    for tunable in TUNABLES:
+        value = config[tunable.option]
+        if tunable.minimum is not None and value < tunable.minimum:
+            errors.append(f'{tunable.option} must be >= {tunable.minimum}')
+        if tunable.maximum is not None and value > tunable.maximum:
+            errors.append(f'{tunable.option} must be <= {tunable.maximum}')
+    for option in (VOTERS_OPTION, CLIENT_ZNODE_QUOTA_OPTION,
+                   CLIENT_BYTE_QUOTA_OPTION):
+        if config[option] < 0:
+            errors.append(f'{option} must be >= 0')
+    if config[JUTE_MAX_BUFFER_OPTION] < JUTE_MAX_BUFFER_MINIMUM:
+        errors.append(f'{JUTE_MAX_BUFFER_OPTION} must be >= '
+                      f'{JUTE_MAX_BUFFER_MINIMUM}')
+    heap_size = config[HEAP_SIZE_OPTION]
+    if heap_size and not HEAP_SIZE_PATTERN.fullmatch(heap_size):
+        errors.append(f'{HEAP_SIZE_OPTION} must be like 512m or 2g')
+    if len(errors):
+        # The cross-field checks below assume sane values:
+        return errors
+
+    if config['sync-limit'] > config['init-limit']:
+        errors.append('sync-limit must be <= init-limit')
+
+    if config[LOCAL_SESSIONS_UPGRADING_OPTION] and not (
+            config[LOCAL_SESSIONS_OPTION]):
+        errors.append(f'{LOCAL_SESSIONS_UPGRADING_OPTION} requires '
+                      f'{LOCAL_SESSIONS_OPTION}')
+
+    tokens = config['connection-throttle-tokens']
+    if tokens and config['connection-throttle-fill-count'] > tokens:
+        errors.append('connection-throttle-fill-count must be <= '
+                      'connection-throttle-tokens')
+
+    return errors
+
+
+def get_warnings(config, snapshot_size=0):
+    """Check a valid charm config against heuristics, for values which
+    ZooKeeper accepts but which may cause trouble.
+
+    These are only estimates, e.g. based on an assumed transfer rate, so
+    they shouldn't keep a server which ran with the same config from
+    starting.
+
+    :param config: the charm config, as accepted by validate()
+    :type config: Mapping[str, Any]
+    :param snapshot_size: the size in bytes of the latest snapshot, if any
+    :type snapshot_size: int
+    :returns: one human-readable message per potential problem.
+    :rtype: List[str]
+    """
+    warnings = []
+    init_time_ms = config['init-limit'] * config['tick-time']
+    needed_init_time_ms = 1000 * snapshot_size // SNAPSHOT_TRANSFER_RATE
+    if init_time_ms < needed_init_time_ms:
+        needed_init_limit = -(-needed_init_time_ms // config['tick-time'])
+        warnings.append(
+            'init-limit may be too low for {} MiB snapshots, consider >= '
+            '{}'.format(snapshot_size // (1024 * 1024), needed_init_limit))
+    return warnings
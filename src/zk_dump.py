@@ -0,0 +1,239 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Dump files: gzip-compressed JSON Lines, one record per znode.
+
+Each line looks like
+
+    {"path": "/foo", "value": "<base64>", "stat": {"czxid": 2, ...}}
+
+and a znode always comes before its children.
+"""
+
+import base64
+import collections
+import gzip
+import hashlib
+import json
+import zlib
+
+from kazoo.exceptions import NodeExistsError
+
+import zk_tree
+
+# zlib's wbits for producing a gzip container instead of a raw zlib stream:
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_MAX_BATCHES_IN_FLIGHT = 8
+
+# A transaction is sent as one request, which ZooKeeper rejects if it is
+# bigger than jute.maxbuffer (1 MiB by default):
+MAX_BATCH_BYTES = 512 * 1024
+
+# Znodes managed by ZooKeeper itself, never to be restored:
+SYSTEM_PATHS = ('/', '/zookeeper')
+
+LoadReport = collections.namedtuple(
+    'LoadReport', ['created', 'existing', 'ignored'])
+LoadReport.__doc__ = """Outcome of load_records().
+
+`existing` counts znodes already present, which are left untouched, and
+`ignored` counts ephemeral and system znodes, which are never restored.
+"""
+
+
+def node_to_record(node):
+    """Convert a zk_tree.ZNode to a dump record.
+
+    :type node: zk_tree.ZNode
+    :rtype: Dict[str, Any]
+    """
+    return {
+        'path': node.path,
+        'value': base64.b64encode(node.value or b'').decode('ascii'),
+        'stat': zk_tree.stat_to_dict(node.stat),
+    }
+
+
+class DumpStream:
+    """Read-only file-like object producing a dump file on the fly.
+
+    Only as much of the tree as needed to serve each `read()` is pulled
+    from `nodes`, so memory use doesn't depend on the size of the tree. This
+    is meant to be passed as `source` to `ops.model.Container.push()`.
+
+    Once fully read, `node_count`, `byte_count` and `sha256` describe the
+    produced (compressed) file.
+
+    :param nodes: znodes to dump, parents first
+    :type nodes: Iterable[zk_tree.ZNode]
+    """
+    def __init__(self, nodes):
+        self.__nodes = iter(nodes)
+        self.__compressor = zlib.compressobj(wbits=GZIP_WBITS)
+        self.__buffer = bytearray()
+        self.__eof = False
+        self.__sha256 = hashlib.sha256()
+        self.node_count = 0
+        self.byte_count = 0
+
+    @property
+    def sha256(self):
+        return self.__sha256.hexdigest()
+
+    def read(self, size=-1):
+        while not self.__eof and (size < 0 or len(self.__buffer) < size):
+            self.__fill()
+
+        if size < 0:
+            size = len(self.__buffer)
+        chunk = bytes(self.__buffer[:size])
+        del self.__buffer[:size]
+
+        self.__sha256.update(chunk)
+        self.byte_count += len(chunk)
+        return chunk
+
+    def __fill(self):
+        try:
+            node = next(self.__nodes)
+        except StopIteration:
+            self.__buffer += self.__compressor.flush()
+            self.__eof = True
+            return
+
+        line = json.dumps(node_to_record(node), separators=(',', ':')) + '\n'
+        self.__buffer += self.__compressor.compress(line.encode('utf-8'))
+        self.node_count += 1
+
+
+def read_records(fileobj):
+    """Read a dump file.
+
+    :param fileobj: the compressed dump file, opened in binary mode
+    :returns: the dump records, with `value` decoded back to bytes
+    :rtype: Iterator[Dict[str, Any]]
+    """
+    with gzip.GzipFile(fileobj=fileobj, mode='rb') as lines:
+        for line in lines:
+            record = json.loads(line)
+            record['value'] = base64.b64decode(record['value'])
+            yield record
+
+
+def is_restorable(record):
+    """Whether load_records() would restore the given dump record.
+
+    :rtype: bool
+    """
+    path = record['path']
+    if path in SYSTEM_PATHS or path.startswith('/zookeeper/'):
+        return False
+    return not record['stat'].get('ephemeralOwner')
+
+
+def load_records(zk, records, batch_size=DEFAULT_BATCH_SIZE,
+                 max_in_flight=DEFAULT_MAX_BATCHES_IN_FLIGHT):
+    """Create the znodes described by dump records.
+
+    Znodes are created by transactions of up to `batch_size` creations, with
+    up to `max_in_flight` transactions sent before waiting for the oldest
+    one to complete. ZooKeeper applies the requests of a session in the
+    order they were sent, so a transaction can safely create the children of
+    znodes created by a transaction that is still in flight.
+
+    A transaction fails as a whole if one of its znodes already exists, e.g.
+    when a restore is re-run or resumed. Which of its znodes exist is then
+    found out with pipelined requests, and the missing ones are sent again
+    as a single transaction. Only if that fails too, e.g. because the
+    parents of a dumped subtree are missing, are they created one by one,
+    along with their missing parents.
+
+    :param zk: a started client
+    :type zk: kazoo.client.KazooClient
+    :param records: dump records, parents first
+    :type records: Iterable[Dict[str, Any]]
+    :param batch_size: maximum number of znodes created per transaction
+    :type batch_size: int
+    :param max_in_flight: maximum number of transactions in flight
+    :type max_in_flight: int
+    :rtype: LoadReport
+    """
+    if batch_size < 1 or max_in_flight < 1:
+        raise ValueError('batch_size and max_in_flight must be >= 1')
+
+    counts = {'created': 0, 'existing': 0, 'ignored': 0}
+    in_flight = collections.deque()
+
+    def _create_batch(batch):
+        transaction = zk.transaction()
+        for path, value in batch:
+            transaction.create(path, value)
+        return transaction.commit_async()
+
+    def _is_committed(result):
+        return not any(isinstance(r, Exception) for r in result.get())
+
+    def _wait_oldest_batch():
+        batch, result = in_flight.popleft()
+        if _is_committed(result):
+            counts['created'] += len(batch)
+            return
+
+        exists_results = [zk.exists_async(path) for path, _ in batch]
+        missing = [(path, value) for (path, value), exists_result
+                   in zip(batch, exists_results)
+                   if exists_result.get() is None]
+        counts['existing'] += len(batch) - len(missing)
+        if not missing:
+            return
+        if _is_committed(_create_batch(missing)):
+            counts['created'] += len(missing)
+            return
+
+        for path, value in missing:
+            try:
+                zk.create(path, value, makepath=True)
+                counts['created'] += 1
+            except NodeExistsError:
+                counts['existing'] += 1
+
+    def _send_batch(batch):
+        if len(in_flight) >= max_in_flight:
+            _wait_oldest_batch()
+        in_flight.append((batch, _create_batch(batch)))
+
+    batch = []
+    batch_bytes = 0
+    for record in records:
+        if not is_restorable(record):
+            counts['ignored'] += 1
+            continue
+        path, value = record['path'], record['value']
+        record_bytes = len(path) + len(value)
+        is_batch_full = len(batch) >= batch_size
+        is_batch_too_big = batch_bytes + record_bytes > MAX_BATCH_BYTES
+        if batch and (is_batch_full or is_batch_too_big):
+            _send_batch(batch)
+            batch = []
+            batch_bytes = 0
+        batch.append((path, value))
+        batch_bytes += record_bytes
+    if batch:
+        _send_batch(batch)
+    while in_flight:
+        _wait_oldest_batch()
+
+    return LoadReport(**counts)
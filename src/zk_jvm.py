@@ -0,0 +1,144 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sizing ZooKeeper's JVM after the resources of its container.
+
+See https://zookeeper.apache.org/doc/current/zookeeperAdmin.html#sc_commonProblems
+"""
+
+import collections
+import math
+
+CGROUP_V2_MEMORY_MAX_PATH = '/sys/fs/cgroup/memory.max'
+CGROUP_V2_CPU_MAX_PATH = '/sys/fs/cgroup/cpu.max'
+CGROUP_V1_MEMORY_LIMIT_PATH = '/sys/fs/cgroup/memory/memory.limit_in_bytes'
+CGROUP_V1_CPU_QUOTA_PATH = '/sys/fs/cgroup/cpu/cpu.cfs_quota_us'
+CGROUP_V1_CPU_PERIOD_PATH = '/sys/fs/cgroup/cpu/cpu.cfs_period_us'
+
+# cgroup v1 reports the absence of memory limit as a huge number:
+CGROUP_V1_NO_MEMORY_LIMIT = 2 ** 60
+
+# Share of the container's memory given to the heap. The rest is left to
+# the JVM's own memory (metaspace, thread stacks, direct buffers) and to the
+# page cache, which the transaction log and snapshots go through.
+HEAP_RATIO = 0.5
+MIN_HEAP_SIZE = 64 * 1024 * 1024
+# Above this, the JVM can't use compressed object pointers anymore:
+MAX_HEAP_SIZE = 31 * 1024 * 1024 * 1024
+
+# Pause time goal of G1. It must stay well below ZooKeeper's tickTime so
+# that GC pauses don't expire sessions or get followers dropped.
+MAX_GC_PAUSE_MILLIS = 50
+
+Resources = collections.namedtuple('Resources', ['memory_limit', 'cpu_limit'])
+Resources.__doc__ = """Resource limits of a container.
+
+`memory_limit` is in bytes and `cpu_limit` in CPUs, None meaning unlimited.
+"""
+
+
+def get_resources(read_file):
+    """Get the resource limits of a container from its cgroup files.
+
+    Both cgroup v2 and v1 are supported.
+
+    :param read_file: returns the content of a file in the container, or None
+                      if it doesn't exist.
+    :type read_file: Callable[[str], Optional[str]]
+    :rtype: Resources
+    """
+    memory_max = read_file(CGROUP_V2_MEMORY_MAX_PATH)
+    if memory_max is not None:
+        memory_limit = _parse_limit(memory_max)
+    else:
+        memory_limit = _parse_limit(
+            read_file(CGROUP_V1_MEMORY_LIMIT_PATH) or 'max')
+        if memory_limit is not None and (
+                memory_limit >= CGROUP_V1_NO_MEMORY_LIMIT):
+            memory_limit = None
+
+    cpu_max = read_file(CGROUP_V2_CPU_MAX_PATH)
+    if cpu_max is not None:
+        quota, _, period = cpu_max.strip().partition(' ')
+    else:
+        quota = read_file(CGROUP_V1_CPU_QUOTA_PATH) or 'max'
+        period = read_file(CGROUP_V1_CPU_PERIOD_PATH) or '100000'
+    quota = _parse_limit(quota)
+    # cgroup v1 reports the absence of CPU quota as -1:
+    if quota is None or quota <= 0:
+        cpu_limit = None
+    else:
+        cpu_limit = quota / int(period)
+
+    return Resources(memory_limit=memory_limit, cpu_limit=cpu_limit)
+
+
+def _parse_limit(content):
+    """Parse a cgroup limit, `max` meaning unlimited.
+
+    :rtype: Optional[int]
+    """
+    content = content.strip()
+    if content == 'max':
+        return None
+    return int(content)
+
+
+def get_heap_size(memory_limit):
+    """Compute the heap size suiting a container's memory limit.
+
+    :param memory_limit: in bytes, None if unlimited.
+    :type memory_limit: Optional[int]
+    :returns: the heap size in MiB, or None to keep the image's default.
+    :rtype: Optional[int]
+    """
+    if memory_limit is None:
+        return None
+    heap_size = int(memory_limit * HEAP_RATIO)
+    heap_size = min(max(heap_size, MIN_HEAP_SIZE), MAX_HEAP_SIZE)
+    return heap_size // (1024 * 1024)
+
+
+def get_jvm_flags(resources, heap_size=None):
+    """Compute the JVM flags suiting a container's resource limits.
+
+    :param resources: the container's resource limits
+    :type resources: Resources
+    :param heap_size: the heap size as passed to `-Xmx`, e.g. `2g`, overriding
+                      the one derived from the memory limit.
+    :type heap_size: Optional[str]
+    :rtype: List[str]
+    """
+    flags = []
+
+    if not heap_size:
+        heap_size_mib = get_heap_size(resources.memory_limit)
+        if heap_size_mib is not None:
+            heap_size = f'{heap_size_mib}m'
+    if heap_size:
+        # A fixed size heap, committed upfront, doesn't cause resizing pauses
+        # nor page faults under load:
+        flags += [f'-Xms{heap_size}', f'-Xmx{heap_size}',
+                  '-XX:+AlwaysPreTouch']
+
+    flags += ['-XX:+UseG1GC', f'-XX:MaxGCPauseMillis={MAX_GC_PAUSE_MILLIS}',
+              '-XX:+ParallelRefProcEnabled']
+    if resources.cpu_limit is not None:
+        # The JVM would otherwise size its thread pools after the host's CPUs:
+        cpus = max(1, math.ceil(resources.cpu_limit))
+        flags += [f'-XX:ActiveProcessorCount={cpus}',
+                  f'-XX:ParallelGCThreads={cpus}',
+                  f'-XX:ConcGCThreads={max(1, cpus // 4)}']
+
+    return flags
@@ -0,0 +1,79 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Exposing ZooKeeper's metrics to Prometheus.
+
+ZooKeeper >= 3.6 serves its metrics itself, see
+https://zookeeper.apache.org/doc/current/zookeeperMonitor.html . They are
+advertised over the `prometheus_scrape` interface, see
+https://charmhub.io/prometheus-k8s/libraries/prometheus_scrape
+"""
+
+import os
+import pathlib
+
+import yaml
+
+PROMETHEUS_METRICS_PROVIDER = (
+    'org.apache.zookeeper.metrics.prometheus.PrometheusMetricsProvider')
+METRICS_PATH = '/metrics'
+
+ALERT_RULES_DIR_PATH = os.path.join(os.path.dirname(__file__),
+                                    'prometheus_alert_rules')
+# Replaced in alert rule expressions by a selector matching the metrics of
+# this application only:
+TOPOLOGY_PLACEHOLDER = '%%juju_topology%%'
+
+
+def get_scrape_jobs(port):
+    """Get the scrape jobs of the servers, `*` standing for each unit's
+    address.
+
+    :type port: int
+    :rtype: List[Dict[str, Any]]
+    """
+    return [{
+        'metrics_path': METRICS_PATH,
+        'static_configs': [{'targets': [f'*:{port}']}],
+    }]
+
+
+def load_alert_rules(topology, dir_path=ALERT_RULES_DIR_PATH):
+    """Load the alert rules, scoped to an application.
+
+    :param topology: the application's Juju topology, e.g. `{'model': 'foo',
+                     'model_uuid': '...', 'application': 'zookeeper-k8s'}`
+    :type topology: Dict[str, str]
+    :param dir_path: the directory containing the `*.rules` files
+    :type dir_path: str
+    :returns: the alert rules, in Prometheus' rule file format.
+    :rtype: Dict[str, Any]
+    """
+    labels = {f'juju_{key}': value for key, value in topology.items()}
+    selector = ','.join(f'{label}="{value}"'
+                        for label, value in sorted(labels.items()))
+    group_name_prefix = '_'.join(
+        topology[key] for key in ('model', 'model_uuid', 'application'))
+
+    groups = []
+    for rules_file_path in sorted(pathlib.Path(dir_path).glob('*.rules')):
+        with rules_file_path.open() as rules_file:
+            for group in yaml.safe_load(rules_file)['groups']:
+                for rule in group['rules']:
+                    rule['expr'] = rule['expr'].replace(TOPOLOGY_PLACEHOLDER,
+                                                        selector)
+                    rule.setdefault('labels', {}).update(labels)
+                group['name'] = f'{group_name_prefix}_{group["name"]}_alerts'
+                groups.append(group)
+    return {'groups': groups}
@@ -0,0 +1,132 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Finding the subtrees which weigh the most in ZooKeeper's snapshots."""
+
+import collections
+import heapq
+import posixpath
+
+DEFAULT_TOP_COUNT = 10
+DEFAULT_GROUP_DEPTH = 1
+
+SubtreeStats = collections.namedtuple(
+    'SubtreeStats', ['path', 'znode_count', 'data_length', 'max_children',
+                     'ephemeral_count'])
+SubtreeStats.__doc__ = """Aggregated stats of the znodes of a subtree.
+
+`data_length` is the total size of their values in bytes and `max_children`
+the highest number of children of any of them.
+"""
+
+
+def get_size_bucket(size):
+    """Get the histogram bucket of a value size: the smallest power of two
+    greater than or equal to it, or 0 for empty values.
+
+    :type size: int
+    :rtype: int
+    """
+    if size <= 0:
+        return 0
+    return 1 << (size - 1).bit_length()
+
+
+class _Accumulator:
+    """Aggregates the stats of the znodes of one subtree."""
+    def __init__(self, path):
+        self.path = path
+        self.znode_count = 0
+        self.data_length = 0
+        self.max_children = 0
+        self.ephemeral_count = 0
+        # Znodes of the subtree known of but not added yet:
+        self.remaining = 1
+
+    def add(self, stat, walked_children_count):
+        self.znode_count += 1
+        self.data_length += stat.dataLength
+        self.max_children = max(self.max_children, stat.numChildren)
+        if stat.ephemeralOwner:
+            self.ephemeral_count += 1
+        self.remaining += walked_children_count - 1
+
+    def to_stats(self):
+        return SubtreeStats(self.path, self.znode_count, self.data_length,
+                            self.max_children, self.ephemeral_count)
+
+
+def compute_stats(nodes, top_count=DEFAULT_TOP_COUNT,
+                  group_depth=DEFAULT_GROUP_DEPTH):
+    """Aggregate the stats of walked znodes, per subtree.
+
+    The subtrees are the ones rooted `group_depth` levels below the walked
+    root. Each is aggregated while its znodes are walked and dropped once all
+    of them are, only the heaviest ones being kept. When walking depth-first,
+    memory use is thus bounded by `top_count` and by the number of znodes in
+    flight, not by the size of the tree.
+
+    :param nodes: ZNodes as yielded by zk_tree.walk_tree(), ideally
+                  depth-first
+    :type nodes: Iterable[zk_tree.ZNode]
+    :param top_count: number of subtrees to return
+    :type top_count: int
+    :param group_depth: depth below the walked root of the subtrees to rank
+    :type group_depth: int
+    :returns: the stats of the whole walked tree, the `top_count` subtrees
+              with the largest values in total, heaviest first, and the
+              number of values per size bucket, see get_size_bucket().
+    :rtype: Tuple[SubtreeStats, List[SubtreeStats], Dict[int, int]]
+    """
+    total = None
+    open_subtrees = {}
+    # Min-heap of the heaviest subtrees seen so far:
+    top = []
+    histogram = collections.Counter()
+
+    def _close(accumulator):
+        stats = accumulator.to_stats()
+        entry = (stats.data_length, stats.znode_count, stats)
+        if len(top) < top_count:
+            heapq.heappush(top, entry)
+        elif top_count:
+            heapq.heappushpop(top, entry)
+
+    for node in nodes:
+        if total is None:
+            total = _Accumulator(node.path)
+        total.add(node.stat, len(node.children))
+        histogram[get_size_bucket(node.stat.dataLength)] += 1
+        if node.depth < group_depth:
+            continue
+
+        subtree_path = node.path
+        for _ in range(node.depth - group_depth):
+            subtree_path = posixpath.dirname(subtree_path)
+        accumulator = open_subtrees.get(subtree_path)
+        if accumulator is None:
+            accumulator = open_subtrees[subtree_path] = _Accumulator(
+                subtree_path)
+        accumulator.add(node.stat, len(node.children))
+        if not accumulator.remaining:
+            _close(open_subtrees.pop(subtree_path))
+
+    # Subtrees some znodes of which were deleted while walking:
+    for accumulator in open_subtrees.values():
+        _close(accumulator)
+
+    if total is None:
+        total = _Accumulator(None)
+    top = [stats for _, _, stats in sorted(top, reverse=True)]
+    return total.to_stats(), top, dict(histogram)
@@ -0,0 +1,144 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Walking ZooKeeper's tree of znodes."""
+
+import collections
+import posixpath
+import re
+
+from kazoo.exceptions import NoNodeError
+
+DEFAULT_MAX_IN_FLIGHT = 64
+
+ZNode = collections.namedtuple(
+    'ZNode', ['path', 'depth', 'value', 'stat', 'children'])
+ZNode.__doc__ = """A znode as returned by walk_tree().
+
+`children` is empty for znodes at `max_depth`, even if they have some.
+"""
+
+
+def walk_tree(zk, path='/', max_depth=None,
+              max_in_flight=DEFAULT_MAX_IN_FLIGHT, depth_first=False):
+    """Walk the tree, yielding one ZNode per znode.
+
+    Instead of one blocking round trip per request, up to `max_in_flight`
+    znodes are requested at once with kazoo's asynchronous API. Results are
+    yielded in the order they were requested, i.e. breadth-first by default.
+    Either way a znode is always yielded before its children.
+
+    Walking depth-first keeps the number of known-but-not-yet-requested
+    znodes proportional to the depth of the tree instead of its width, which
+    matters for very large trees.
+
+    Znodes deleted while walking are silently skipped.
+
+    :param zk: a started client
+    :type zk: kazoo.client.KazooClient
+    :param path: the root of the subtree to walk
+    :type path: str
+    :param max_depth: don't walk deeper than this many levels below `path`.
+                      None means no limit.
+    :type max_depth: Optional[int]
+    :param max_in_flight: maximum number of znodes requested at once
+    :type max_in_flight: int
+    :param depth_first: walk depth-first instead of breadth-first
+    :type depth_first: bool
+    :rtype: Iterator[ZNode]
+    """
+    if max_in_flight < 1:
+        raise ValueError('max_in_flight must be >= 1')
+
+    pending = collections.deque([(path, 0)])
+    in_flight = collections.deque()
+    while pending or in_flight:
+        while pending and len(in_flight) < max_in_flight:
+            node_path, depth = (pending.pop() if depth_first
+                                else pending.popleft())
+            in_flight.append((node_path, depth,
+                              zk.get_async(node_path),
+                              zk.get_children_async(node_path)))
+
+        node_path, depth, value_result, children_result = (
+            in_flight.popleft())
+        try:
+            value, stat = value_result.get()
+            children = children_result.get()
+        except NoNodeError:
+            continue
+
+        if max_depth is not None and depth >= max_depth:
+            children = []
+        children = sorted(children)
+        # When walking depth-first, `pending` is used as a stack, so the
+        # children are pushed in reverse order to be walked in order:
+        for child in (reversed(children) if depth_first else children):
+            pending.append((posixpath.join(node_path, child), depth + 1))
+
+        yield ZNode(node_path, depth, value, stat, children)
+
+
+def nodes_to_dict(nodes, include_stat=False):
+    """Assemble the ZNodes yielded by walk_tree() into nested dicts.
+
+    Znodes with children become dicts keyed by child name, other znodes
+    become their value. With `include_stat`, the latter become
+    `{'value': ..., 'stat': {...}}` instead, the stat being keyed the way
+    action results must be, see stat_to_results().
+
+    :param nodes: ZNodes in breadth-first order
+    :type nodes: Iterable[ZNode]
+    :param include_stat: whether to include the stat of leaf znodes
+    :type include_stat: bool
+    :returns: the content of the walked tree
+    """
+    content = None
+    subtrees = {}
+    for node in nodes:
+        if node.children:
+            entry = {}
+            subtrees[node.path] = entry
+        elif include_stat:
+            entry = {'value': node.value,
+                     'stat': stat_to_results(node.stat)}
+        else:
+            entry = node.value
+
+        if node.depth == 0:
+            content = entry
+        else:
+            parent = subtrees[posixpath.dirname(node.path)]
+            parent[posixpath.basename(node.path)] = entry
+    return content
+
+
+def stat_to_dict(stat):
+    """Convert a kazoo.protocol.states.ZnodeStat to a plain dict, keyed by
+    its field names, e.g. for the JSON Lines dumps of zk_dump.
+
+    :rtype: Dict[str, int]
+    """
+    return dict(stat._asdict())
+
+
+def stat_to_results(stat):
+    """Convert a kazoo.protocol.states.ZnodeStat to a dict fit for action
+    results, which Juju only accepts lowercase alphanumeric and hyphenated
+    keys in, e.g. with `data-length` instead of `dataLength`.
+
+    :rtype: Dict[str, int]
+    """
+    return {re.sub('([A-Z])', r'-\1', name).lower(): value
+            for name, value in stat._asdict().items()}
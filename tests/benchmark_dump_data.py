@@ -0,0 +1,81 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of the tree walkers used by the dump-data action.
+
+Compares the former recursive, one-blocking-request-at-a-time walker with
+zk_tree.walk_tree() against an in-memory fake of KazooClient simulating a
+network round trip time. Run with
+
+    $ PYTHONPATH=lib:src:. python3 -m tests.benchmark_dump_data
+"""
+
+import argparse
+import os
+import time
+
+import zk_tree
+
+from tests.fake_kazoo import FakeKazooClient
+
+
+def legacy_get_tree(path, zk):
+    """The recursive walker dump-data used before zk_tree.walk_tree()."""
+    children = zk.get_children(path)
+    if not len(children):
+        value = zk.get(path)[0]
+        return value
+    return {child: legacy_get_tree(os.path.join(path, child), zk)
+            for child in children}
+
+
+def make_tree(fan_out, depth):
+    if depth == 0:
+        return b'some value'
+    return {'node-{}'.format(i): make_tree(fan_out, depth - 1)
+            for i in range(fan_out)}
+
+
+def run(name, walker, zk):
+    start = time.monotonic()
+    walker(zk)
+    elapsed = time.monotonic() - start
+    node_count = len(zk.nodes)
+    print('{:<28} {:>8} znodes {:>8.2f} s {:>10.0f} znodes/s'.format(
+        name, node_count, elapsed, node_count / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fan-out', type=int, default=10)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--latency-ms', type=float, default=0.5)
+    parser.add_argument('--max-in-flight', type=int, nargs='+',
+                        default=[1, 16, zk_tree.DEFAULT_MAX_IN_FLIGHT, 256])
+    args = parser.parse_args()
+
+    tree = make_tree(args.fan_out, args.depth)
+    latency = args.latency_ms / 1000
+
+    run('recursive (before)', lambda zk: legacy_get_tree('/', zk),
+        FakeKazooClient(tree, latency))
+    for max_in_flight in args.max_in_flight:
+        run('walk_tree(max_in_flight={})'.format(max_in_flight),
+            lambda zk: zk_tree.nodes_to_dict(zk_tree.walk_tree(
+                zk, max_in_flight=max_in_flight)),
+            FakeKazooClient(tree, latency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of the peer relation hooks when scaling out.
+
+Simulates adding units one at a time, from --initial-units to --units, with
+two Harness instances: one for the leader unit and one for a non-leader
+unit, which the peer application data written by the leader is copied to.
+Each simulated hook starts with empty relation data caches, as it would in a
+new hook process. The time a new hook process takes to import the charm is
+measured separately. Run with
+
+    $ PYTHONPATH=lib:src:. python3 -m tests.benchmark_scale_out
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from unittest.mock import patch
+
+import hook_timing
+from charm import ZookeeperK8SCharm
+from ops.testing import Harness
+
+APP_NAME = 'zookeeper-k8s'
+PEER_RELATION_NAME = 'replicas'
+
+
+def get_address(unit_number):
+    return '10.1.{}.{}'.format(unit_number // 256, unit_number % 256)
+
+
+class SimulatedUnit:
+    """A unit of the application, under Harness, counting its hook tool
+    calls.
+    """
+    def __init__(self, is_leader):
+        self.harness = Harness(ZookeeperK8SCharm)
+        for name in ('data', 'datalog'):
+            self.harness.add_storage(name, attach=True)
+        self.harness.set_model_name('benchmark')
+        self.harness.begin()
+
+        self.hook_count = 0
+        self.relation_get_count = 0
+        self.network_get_count = 0
+        self.seconds = 0
+        self.timer = hook_timing.HookTimer('benchmark')
+        self.timer.instrument(
+            self.harness.model.unit.get_container('zookeeper').pebble,
+            hook_timing.PEBBLE)
+
+        backend = self.harness._backend
+        relation_get = backend.relation_get
+
+        def _counting_relation_get(*args, **kwargs):
+            self.relation_get_count += 1
+            return relation_get(*args, **kwargs)
+        backend.relation_get = _counting_relation_get
+
+        def _counting_get_my_ingress_address(_):
+            self.network_get_count += 1
+            return get_address(0)
+        self.harness.charm._get_my_ingress_address = (
+            _counting_get_my_ingress_address)
+
+        with self.harness.hooks_disabled():
+            self.relation_id = self.harness.add_relation(PEER_RELATION_NAME,
+                                                         APP_NAME)
+            self.harness.set_leader(is_leader)
+
+    def run_hook(self, hook, *args):
+        """Run a Harness method emitting a hook, as a new hook process."""
+        self.harness.model.relations._invalidate(PEER_RELATION_NAME)
+        start = time.monotonic()
+        hook(self.relation_id, *args)
+        self.seconds += time.monotonic() - start
+        self.hook_count += 1
+
+    def get_app_data(self):
+        return dict(self.harness.get_relation_data(self.relation_id,
+                                                   APP_NAME))
+
+
+def get_pebble_call_count(unit):
+    return sum(count for (kind, _), (count, _) in unit.timer.totals.items()
+               if kind == hook_timing.PEBBLE)
+
+
+def measure_import_seconds(repeat=15):
+    """Measure how long a new hook process takes to import the charm.
+
+    :returns: the best time of `repeat` runs, in seconds.
+    :rtype: float
+    """
+    code = ('import time; start = time.monotonic(); import charm; '
+            'print(time.monotonic() - start)')
+    return min(float(subprocess.check_output(
+        [sys.executable, '-c', code], env=os.environ))
+        for _ in range(repeat))
+
+
+def add_unit(leader, follower, unit_number):
+    """Add a unit, running the resulting hooks on the leader and follower."""
+    unit_name = '{}/{}'.format(APP_NAME, unit_number)
+    address = {'ingress-address': get_address(unit_number)}
+    for hook, args in [
+            (Harness.add_relation_unit, (unit_name,)),
+            (Harness.update_relation_data, (unit_name, address))]:
+        app_data = leader.get_app_data()
+        leader.run_hook(hook.__get__(leader.harness), *args)
+        follower.run_hook(hook.__get__(follower.harness), *args)
+        new_app_data = leader.get_app_data()
+        if new_app_data != app_data:
+            # The leader changed the peer application data:
+            follower.run_hook(follower.harness.update_relation_data,
+                              APP_NAME, new_app_data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--initial-units', type=int, default=3)
+    parser.add_argument('--units', type=int, default=25)
+    args = parser.parse_args()
+
+    with patch('zk_admin.is_serving', return_value=False), patch(
+            'charm.ZookeeperK8SCharm._ZookeeperK8SCharm__restart_zookeeper',
+            return_value=True), patch('ops.model.Container.push'):
+        leader = SimulatedUnit(is_leader=True)
+        follower = SimulatedUnit(is_leader=False)
+        for unit_number in range(1, args.initial_units):
+            add_unit(leader, follower, unit_number)
+
+        for unit in (leader, follower):
+            unit.hook_count = unit.relation_get_count = 0
+            unit.network_get_count = unit.seconds = 0
+            unit.timer.totals.clear()
+        for unit_number in range(args.initial_units, args.units):
+            add_unit(leader, follower, unit_number)
+
+    print('Scaling out from {} to {} units:'.format(args.initial_units,
+                                                    args.units))
+    print('{:<12} {:>6} {:>13} {:>12} {:>7} {:>9}'.format(
+        '', 'hooks', 'relation-get', 'network-get', 'pebble', 'seconds'))
+    for name, unit in (('leader', leader), ('non-leader', follower)):
+        print('{:<12} {:>6} {:>13} {:>12} {:>7} {:>9.3f}'.format(
+            name, unit.hook_count, unit.relation_get_count,
+            unit.network_get_count, get_pebble_call_count(unit),
+            unit.seconds))
+    print('Importing the charm: {:.3f} seconds per hook'.format(
+        measure_import_seconds()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-memory fake of kazoo.client.KazooClient, for tests and benchmarks."""
+
+import posixpath
+import time
+
+from kazoo.exceptions import NodeExistsError, NoNodeError, RolledBackError
+from kazoo.protocol.states import ZnodeStat
+
+
+class FakeAsyncResult:
+    """Fake of kazoo.interfaces.IAsyncResult.
+
+    The result becomes available `latency` seconds after the request was
+    sent, regardless of how many other requests are in flight, which is how
+    pipelined requests behave on a real connection.
+    """
+    def __init__(self, func, latency):
+        self.__ready_at = time.monotonic() + latency
+        try:
+            self.__value = func()
+            self.__exception = None
+        except Exception as e:
+            self.__value = None
+            self.__exception = e
+
+    def get(self, block=True, timeout=None):
+        remaining = self.__ready_at - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        if self.__exception is not None:
+            raise self.__exception
+        return self.__value
+
+
+class FakeTransaction:
+    """Fake of kazoo.client.TransactionRequest, only supporting create()."""
+    def __init__(self, client):
+        self.__client = client
+        self.__operations = []
+
+    def create(self, path, value=b'', acl=None, ephemeral=False,
+               sequence=False):
+        self.__operations.append((path, value))
+
+    def commit_async(self):
+        return self.__client._request(self.__commit)
+
+    def commit(self):
+        return self.commit_async().get()
+
+    def __commit(self):
+        created = []
+        for path, value in self.__operations:
+            try:
+                self.__client.create(path, value)
+            except Exception as e:
+                for created_path in reversed(created):
+                    self.__client.delete(created_path)
+                results = [RolledBackError()] * len(self.__operations)
+                results[len(created)] = e
+                return results
+            created.append(path)
+        return created
+
+
+class FakeKazooClient:
+    """Fake of kazoo.client.KazooClient keeping the tree in memory.
+
+    :param tree: initial content, as nested dicts of `{name: subtree}` where
+                 leaves are `bytes` values.
+    :param latency: simulated round trip time in seconds.
+    """
+    def __init__(self, tree=None, latency=0):
+        self.latency = latency
+        self.request_count = 0
+        self.nodes = {'/': b''}
+        self.children = {'/': []}
+        self.__zxid = 0
+        self.__stats = {'/': self.__new_stat(b'')}
+        if tree is not None:
+            self.__load('/', tree)
+
+    def start(self, timeout=15):
+        pass
+
+    def stop(self):
+        pass
+
+    def get(self, path, watch=None):
+        return self.get_async(path).get()
+
+    def get_children(self, path, watch=None, include_data=False):
+        return self.get_children_async(path).get()
+
+    def get_async(self, path, watch=None):
+        return self._request(lambda: self.__get(path))
+
+    def get_children_async(self, path, watch=None, include_data=False):
+        return self._request(lambda: self.__get_children(path))
+
+    def exists(self, path, watch=None):
+        return self.exists_async(path).get()
+
+    def exists_async(self, path, watch=None):
+        return self._request(lambda: self.__stats.get(path))
+
+    def create(self, path, value=b'', makepath=False, **kwargs):
+        self.request_count += 1
+        if makepath:
+            self.ensure_path(posixpath.dirname(path))
+        self.__create(path, value)
+        return path
+
+    def set(self, path, value, version=-1):
+        self.request_count += 1
+        if path not in self.nodes:
+            raise NoNodeError(path)
+        self.nodes[path] = value
+        self.__stats[path] = self.__stats[path]._replace(
+            dataLength=len(value), version=self.__stats[path].version + 1)
+        return self.__stats[path]
+
+    def ensure_path(self, path, acl=None):
+        if path in self.nodes:
+            return True
+        self.ensure_path(posixpath.dirname(path))
+        self.__create(path, b'')
+        return True
+
+    def delete(self, path, version=-1, recursive=False):
+        self.request_count += 1
+        if path not in self.nodes:
+            raise NoNodeError(path)
+        for child in list(self.children[path]):
+            self.delete(posixpath.join(path, child), recursive=True)
+        parent = posixpath.dirname(path)
+        del self.nodes[path]
+        del self.children[path]
+        del self.__stats[path]
+        self.children[parent].remove(posixpath.basename(path))
+        self.__stats[parent] = self.__stats[parent]._replace(
+            numChildren=len(self.children[parent]))
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+    def _request(self, func):
+        self.request_count += 1
+        return FakeAsyncResult(func, self.latency)
+
+    def __get(self, path):
+        try:
+            return self.nodes[path], self.__stats[path]
+        except KeyError:
+            raise NoNodeError(path)
+
+    def __get_children(self, path):
+        try:
+            return list(self.children[path])
+        except KeyError:
+            raise NoNodeError(path)
+
+    def __create(self, path, value):
+        parent = posixpath.dirname(path)
+        if parent not in self.nodes:
+            raise NoNodeError(path)
+        if path in self.nodes:
+            raise NodeExistsError(path)
+        self.nodes[path] = value
+        self.children[path] = []
+        self.children[parent].append(posixpath.basename(path))
+        self.__stats[path] = self.__new_stat(value)
+        self.__stats[parent] = self.__stats[parent]._replace(
+            numChildren=len(self.children[parent]))
+
+    def __new_stat(self, value):
+        self.__zxid += 1
+        return ZnodeStat(czxid=self.__zxid, mzxid=self.__zxid, ctime=0,
+                         mtime=0, version=0, cversion=0, aversion=0,
+                         ephemeralOwner=0, dataLength=len(value),
+                         numChildren=0, pzxid=self.__zxid)
+
+    def __load(self, path, tree):
+        for name, subtree in tree.items():
+            child_path = posixpath.join(path, name)
+            if isinstance(subtree, dict):
+                self.__create(child_path, b'')
+                self.__load(child_path, subtree)
+            else:
+                self.__create(child_path, subtree)
@@ -14,29 +14,57 @@
 
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 
+import base64
+import gzip
+import hashlib
+import io
+import json
 import unittest
 from unittest.mock import ANY, call, Mock, patch
 
 from charm import ZookeeperK8SCharm
-from ops.model import ActiveStatus
+from kazoo.handlers.threading import KazooTimeoutError
+from ops.model import ActiveStatus, BlockedStatus, WaitingStatus
 from ops.testing import Harness
 
+from tests.fake_kazoo import FakeKazooClient
+
 
 class TestCharm(unittest.TestCase):
     def setUp(self):
         self.harness = Harness(ZookeeperK8SCharm)
         self.addCleanup(self.harness.cleanup)
+        self.harness.set_model_name('test-model')
         self.harness.begin()
 
+    def _attach_storages(self):
+        """Attach the data and datalog storages."""
+        for name in ('data', 'datalog'):
+            self.harness.add_storage(name, attach=True)
+
+    def _add_peers(self, unit_addresses, leader=True):
+        """Add the peer relation with the given units, hooks disabled.
+
+        :param unit_addresses: ingress address by remote unit name
+        :returns: the relation ID
+        """
+        with self.harness.hooks_disabled():
+            rel_id = self.harness.add_relation('replicas', 'zookeeper-k8s')
+            for unit_name, address in unit_addresses.items():
+                self.harness.add_relation_unit(rel_id, unit_name)
+                self.harness.update_relation_data(rel_id, unit_name, {
+                    'ingress-address': address})
+            self.harness.set_leader(leader)
+        return rel_id
+
     @patch('ops.model.Container.push')
-    @patch('charm.ZookeeperK8SCharm._get_all_unit_ingress_addresses')
     @patch('charm.ZookeeperK8SCharm._share_address_with_peers')
     @patch('charm.ZookeeperK8SCharm._get_my_ingress_address')
     def test_config_changed(self, mock_my_address, mock_share_address,
-                            mock_get_all_addresses, mock_push):
+                            mock_push):
         mock_my_address.return_value = '10.1.0.42'
-        mock_get_all_addresses.return_value = ['10.1.0.42', '10.1.0.43',
-                                               '10.1.0.44']
+        self._add_peers({'zookeeper-k8s/1': '10.1.0.43',
+                         'zookeeper-k8s/2': '10.1.0.44'})
 
         self.harness.update_config({'client-port': 1234})
         mock_share_address.assert_called_once_with('10.1.0.42', ANY)
@@ -46,28 +74,652 @@ class TestCharm(unittest.TestCase):
             call(path='/data/myid', source=SuperstringOf(['1']))
         ], any_order=True)
 
-    @patch('charm.KazooClient')
-    def test_dump_data_action(self, mock_zk):
-        def get_children_mock(path):
-            if path == '/':
-                return ['first-child', 'second-child']
-            return []
+    @patch('ops.model.Container.push')
+    @patch('charm.ZookeeperK8SCharm._ZookeeperK8SCharm__restart_zookeeper')
+    @patch('charm.ZookeeperK8SCharm._get_my_ingress_address')
+    def test_unchanged_config_not_pushed(self, mock_my_address, mock_restart,
+                                         mock_push):
+        mock_my_address.return_value = '10.1.0.42'
+        rel_id = self._add_peers({'zookeeper-k8s/1': '10.1.0.43'})
 
-        mock_zk.return_value.get_children.side_effect = get_children_mock
-        mock_zk.return_value.get.return_value = ('my value', 'some metadata')
-        action_event = Mock()
+        self.harness.update_config({'client-port': 1234})
+        self.assertEqual(mock_push.call_count, 2)
+        mock_restart.assert_called_once()
+
+        mock_push.reset_mock()
+        mock_restart.reset_mock()
+        self.harness.update_config({'client-port': 1234})
+        mock_push.assert_not_called()
+        mock_restart.assert_not_called()
+
+        self.harness.update_relation_data(rel_id, 'zookeeper-k8s/1', {
+            'ingress-address': '10.1.0.44'})
+        self.assertEqual(mock_push.call_count, 2)
+        mock_restart.assert_called_once()
+
+    @patch('ops.model.Container.push')
+    @patch('charm.ZookeeperK8SCharm._ZookeeperK8SCharm__restart_zookeeper')
+    @patch('charm.ZookeeperK8SCharm._get_my_ingress_address')
+    def test_tunables(self, mock_my_address, mock_restart, mock_push):
+        mock_my_address.return_value = '10.1.0.42'
+        self._add_peers({'zookeeper-k8s/1': '10.1.0.43'})
+
+        self.harness.update_config({'max-client-cnxns': 1000,
+                                    'request-throttle-limit': 500,
+                                    'request-throttle-drop-stale': False})
+        mock_push.assert_any_call(path='/conf/zoo.cfg', source=SuperstringOf([
+            'tickTime=2000\n', 'maxClientCnxns=1000\n',
+            'request_throttle_max_requests=500\n',
+            'request_throttle_drop_stale=false\n', 'forceSync=yes\n',
+            'fsync.warningthresholdms=1000\n']))
+
+        # Invalid config is not applied:
+        mock_push.reset_mock()
+        mock_restart.reset_mock()
+        self.harness.update_config({'sync-limit': 10})
+        self.assertEqual(self.harness.model.unit.status,
+                         BlockedStatus('sync-limit must be <= init-limit'))
+        mock_push.assert_not_called()
+        mock_restart.assert_not_called()
+
+        self.harness.update_config({'init-limit': 10})
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+        mock_push.assert_any_call(path='/conf/zoo.cfg', source=SuperstringOf([
+            'initLimit=10\n', 'syncLimit=10\n']))
+        mock_restart.assert_called_once()
+
+    @patch('ops.model.Container.push')
+    @patch('charm.ZookeeperK8SCharm._get_my_ingress_address')
+    def test_metrics_endpoint(self, mock_my_address, mock_push):
+        mock_my_address.return_value = '10.1.0.42'
+        self._add_peers({})
+        rel_id = self.harness.add_relation('metrics-endpoint', 'prometheus')
+        self.harness.add_relation_unit(rel_id, 'prometheus/0')
+
+        self.assertEqual(self.harness.get_relation_data(
+            rel_id, 'zookeeper-k8s/0'), {
+                'prometheus_scrape_unit_address': '10.1.0.42',
+                'prometheus_scrape_unit_name': 'zookeeper-k8s/0'})
+        app_data = self.harness.get_relation_data(rel_id, 'zookeeper-k8s')
+        self.assertEqual(json.loads(app_data['scrape_jobs']), [{
+            'metrics_path': '/metrics',
+            'static_configs': [{'targets': ['*:7000']}]}])
+        self.assertEqual(json.loads(app_data['scrape_metadata'])[
+            'application'], 'zookeeper-k8s')
+        rules = json.loads(app_data['alert_rules'])['groups'][0]['rules']
+        no_leader_rule = [rule for rule in rules
+                          if rule['alert'] == 'ZooKeeperNoLeader'][0]
+        self.assertEqual(no_leader_rule['expr'], SuperstringOf([
+            'absent(leader_uptime{', 'juju_application="zookeeper-k8s"']))
+        self.assertEqual(no_leader_rule['labels']['juju_application'],
+                         'zookeeper-k8s')
+
+        self.harness.update_config({'metrics-port': 7070})
+        app_data = self.harness.get_relation_data(rel_id, 'zookeeper-k8s')
+        self.assertEqual(json.loads(app_data['scrape_jobs'])[0][
+            'static_configs'], [{'targets': ['*:7070']}])
+        mock_push.assert_any_call(path='/conf/zoo.cfg', source=SuperstringOf([
+            'metricsProvider.className=', 'metricsProvider.httpPort=7070\n']))
+
+    @patch('ops.model.Container.push')
+    @patch('charm.ZookeeperK8SCharm._share_address_with_peers')
+    @patch('charm.ZookeeperK8SCharm._get_my_ingress_address')
+    def test_stable_server_ids(self, mock_my_address, mock_share_address,
+                               mock_push):
+        mock_my_address.return_value = '10.1.0.42'
+        rel_id = self._add_peers({'zookeeper-k8s/1': '10.1.0.43'})
+        self.harness.update_config({'client-port': 1234})
+        self.assertEqual(json.loads(self.harness.get_relation_data(
+            rel_id, 'zookeeper-k8s')['server-ids']),
+            {'zookeeper-k8s/0': 1, 'zookeeper-k8s/1': 2})
+
+        # A new unit with a lower address, a rescheduled unit getting a new
+        # address and a departed unit:
+        self.harness.add_relation_unit(rel_id, 'zookeeper-k8s/2')
+        self.harness.update_relation_data(rel_id, 'zookeeper-k8s/2', {
+            'ingress-address': '10.1.0.1'})
+        self.harness.update_relation_data(rel_id, 'zookeeper-k8s/1', {
+            'ingress-address': '10.1.0.2'})
+        self.harness.add_relation_unit(rel_id, 'zookeeper-k8s/3')
+        self.harness.remove_relation_unit(rel_id, 'zookeeper-k8s/3')
+        self.harness.add_relation_unit(rel_id, 'zookeeper-k8s/4')
+
+        self.assertEqual(json.loads(self.harness.get_relation_data(
+            rel_id, 'zookeeper-k8s')['server-ids']),
+            {'zookeeper-k8s/0': 1, 'zookeeper-k8s/1': 2,
+             'zookeeper-k8s/2': 3, 'zookeeper-k8s/4': 5})
+        zoo_cfg = [c for c in mock_push.call_args_list
+                   if c[1]['path'] == '/conf/zoo.cfg'][-1][1]['source']
+        self.assertEqual(zoo_cfg, SuperstringOf([
+            'server.1=10.1.0.42:', 'server.2=10.1.0.2:',
+            'server.3=10.1.0.1:']))
+
+    @patch('ops.model.Container.push')
+    @patch('charm.ZookeeperK8SCharm._ZookeeperK8SCharm__restart_zookeeper')
+    @patch('zk_admin.wait_until_serving')
+    @patch('zk_admin.get_leader_address')
+    @patch('zk_admin.is_serving')
+    @patch('charm.ZookeeperK8SCharm._get_my_ingress_address')
+    def test_rolling_restart(self, mock_my_address, mock_is_serving,
+                             mock_leader_address, mock_wait, mock_restart,
+                             mock_push):
+        mock_my_address.return_value = '10.1.0.42'
+        mock_is_serving.return_value = True
+        # This unit runs the ZooKeeper leader so should restart last:
+        mock_leader_address.return_value = '10.1.0.42'
+        mock_wait.return_value = True
+        mock_restart.return_value = True
+        rel_id = self._add_peers({'zookeeper-k8s/1': '10.1.0.43'})
+        self.harness.update_relation_data(rel_id, 'zookeeper-k8s/1', {
+            'restart-request': '1',
+        })
+
+        self.assertEqual(self.harness.get_relation_data(
+            rel_id, 'zookeeper-k8s')['restart-token'], 'zookeeper-k8s/1:1')
+        self.assertEqual(self.harness.get_relation_data(
+            rel_id, 'zookeeper-k8s/0')['restart-request'], '1')
+        mock_restart.assert_not_called()
+
+        self.harness.update_relation_data(rel_id, 'zookeeper-k8s/1', {
+            'restart-done': '1',
+        })
+
+        mock_restart.assert_called_once()
+        self.assertEqual(self.harness.get_relation_data(
+            rel_id, 'zookeeper-k8s/0')['restart-done'], '1')
+        self.assertNotIn('restart-token', self.harness.get_relation_data(
+            rel_id, 'zookeeper-k8s'))
+
+    @patch('kazoo.client.KazooClient')
+    @patch('zk_admin.is_serving')
+    @patch('ops.model.Container.push')
+    @patch('charm.ZookeeperK8SCharm._get_my_ingress_address')
+    def test_dynamic_reconfig(self, mock_my_address, mock_push,
+                              mock_is_serving, mock_zk):
+        mock_my_address.return_value = '10.1.0.42'
+        mock_is_serving.return_value = False
+        rel_id = self._add_peers({'zookeeper-k8s/1': '10.1.0.43'})
+
+        self.harness.update_config({'dynamic-reconfig': True})
+        zoo_cfg = [c for c in mock_push.call_args_list
+                   if c[1]['path'] == '/conf/zoo.cfg'][-1][1]['source']
+        self.assertEqual(zoo_cfg, SuperstringOf([
+            'reconfigEnabled=true',
+            'dynamicConfigFile=/conf/zoo.cfg.dynamic']))
+        self.assertNotIn('server.1', zoo_cfg)
+        mock_push.assert_any_call(
+            path='/conf/zoo.cfg.dynamic', source=SuperstringOf([
+                'server.1=10.1.0.42:2888:3888:participant;0.0.0.0:2181',
+                'server.2=10.1.0.43:2888:3888:participant;0.0.0.0:2181']))
+        mock_zk.return_value.reconfig.assert_not_called()
+
+        # Scaling out:
+        mock_push.reset_mock()
+        mock_is_serving.return_value = True
+        mock_zk.return_value.get.return_value = (
+            b'server.1=10.1.0.42:2888:3888:participant;0.0.0.0:2181\n'
+            b'server.2=10.1.0.43:2888:3888:participant;0.0.0.0:2181\n'
+            b'version=100000000', None)
+        self.harness.add_relation_unit(rel_id, 'zookeeper-k8s/2')
+        self.harness.update_relation_data(rel_id, 'zookeeper-k8s/2', {
+            'ingress-address': '10.1.0.44'})
+
+        mock_push.assert_not_called()
+        mock_zk.return_value.reconfig.assert_called_once_with(
+            joining='server.3=10.1.0.44:2888:3888:participant;0.0.0.0:2181',
+            leaving=None, new_members=None)
+        password = self.harness.get_relation_data(
+            rel_id, 'zookeeper-k8s')['super-password']
+        self.assertEqual(mock_zk.call_args[1]['auth_data'],
+                         [('digest', 'super:' + password)])
+
+        # Scaling in while ZooKeeper doesn't serve is retried:
+        mock_zk.return_value.reconfig.reset_mock()
+        mock_is_serving.return_value = False
+        mock_zk.return_value.get.return_value = (
+            b'server.1=10.1.0.42:2888:3888:participant;0.0.0.0:2181\n'
+            b'server.2=10.1.0.43:2888:3888:participant;0.0.0.0:2181\n'
+            b'server.3=10.1.0.44:2888:3888:participant;0.0.0.0:2181\n'
+            b'version=100000001', None)
+        self.harness.remove_relation_unit(rel_id, 'zookeeper-k8s/2')
+        mock_zk.return_value.reconfig.assert_not_called()
+        mock_is_serving.return_value = True
+        current_config = mock_zk.return_value.get.return_value
+
+        def _reconfig(**kwargs):
+            mock_zk.return_value.get.return_value = (
+                b'server.1=10.1.0.42:2888:3888:participant;0.0.0.0:2181\n'
+                b'server.2=10.1.0.43:2888:3888:participant;0.0.0.0:2181\n'
+                b'version=100000002', None)
+        mock_zk.return_value.reconfig.side_effect = _reconfig
+        self.harness.framework.reemit()
+        mock_zk.return_value.reconfig.assert_called_once_with(
+            joining=None, leaving='3', new_members=None)
+
+        # Even if the deferred event is lost, update-status converges:
+        mock_zk.return_value.reconfig.reset_mock()
+        mock_zk.return_value.get.return_value = current_config
+        self._attach_storages()
+        container = self.harness.model.unit.get_container('zookeeper')
+        self.harness.charm.on.zookeeper_pebble_ready.emit(container)
+        with patch('zk_admin.get_server_stats') as mock_stats:
+            mock_stats.return_value = {
+                'server_state': 'leader', 'avg_latency': 0.5,
+                'max_latency': 12, 'num_alive_client_connections': 3,
+                'last_processed_zxid': 0x200000010}
+            self.harness.charm.on.update_status.emit()
+        mock_zk.return_value.reconfig.assert_called_once_with(
+            joining=None, leaving='3', new_members=None)
+
+    @patch('ops.model.Container.push')
+    @patch('charm.ZookeeperK8SCharm._get_my_ingress_address')
+    def test_published_members(self, mock_my_address, mock_push):
+        mock_my_address.return_value = '10.1.0.42'
+        rel_id = self._add_peers({'zookeeper-k8s/1': '10.1.0.43'})
+        self.harness.update_config({})
+        app_data = self.harness.get_relation_data(rel_id, 'zookeeper-k8s')
+        self.assertEqual(json.loads(app_data['members']),
+                         {'1': '10.1.0.42', '2': '10.1.0.43'})
+        self.assertEqual(app_data['members-generation'], '1')
+
+        # As a non-leader, only the members published by the leader matter:
+        self.harness.set_leader(False)
+        mock_push.reset_mock()
+        self.harness.add_relation_unit(rel_id, 'zookeeper-k8s/2')
+        self.harness.update_relation_data(rel_id, 'zookeeper-k8s/2', {
+            'ingress-address': '10.1.0.44'})
+        mock_push.assert_not_called()
+
+        self.harness.update_relation_data(rel_id, 'zookeeper-k8s', {
+            'server-ids': json.dumps({'zookeeper-k8s/0': 1,
+                                      'zookeeper-k8s/1': 2,
+                                      'zookeeper-k8s/2': 3}),
+            'members': json.dumps({'1': '10.1.0.42', '2': '10.1.0.43',
+                                   '3': '10.1.0.44'}),
+            'members-generation': '2'})
+        mock_push.assert_any_call(path='/conf/zoo.cfg', source=SuperstringOf([
+            'server.3=10.1.0.44:2888:3888\n']))
+
+    @patch('ops.model.Container.push')
+    @patch('charm.ZookeeperK8SCharm._get_my_ingress_address')
+    def test_hook_timing(self, mock_my_address, mock_push):
+        mock_my_address.return_value = '10.1.0.42'
+        # Instrumentation is set up when the charm is instantiated:
+        harness = Harness(ZookeeperK8SCharm)
+        self.addCleanup(harness.cleanup)
+        harness.update_config({'hook-timing': True})
+        harness.begin()
+        with harness.hooks_disabled():
+            harness.add_relation('replicas', 'zookeeper-k8s')
+            harness.set_leader(True)
+
+        with self.assertLogs('hook_timing', 'DEBUG') as logs:
+            harness.charm.on.config_changed.emit()
+            harness.framework.on.commit.emit()
+        summary = json.loads(logs.records[-1].getMessage())
+        calls = {(call['kind'], call['name']): call['count']
+                 for call in summary['calls']}
+        self.assertEqual(calls[('handler', '_on_config_or_peer_changed')], 1)
+        self.assertIn(('juju-tool', 'relation_get'), calls)
+        self.assertIn(('pebble', 'list_files'), calls)
+
+    @patch('zk_admin.is_serving')
+    @patch('kazoo.client.KazooClient')
+    @patch('ops.model.Container.push')
+    @patch('charm.ZookeeperK8SCharm._get_my_ingress_address')
+    def test_client_provisioning(self, mock_my_address, mock_push, mock_zk,
+                                 mock_is_serving):
+        mock_my_address.return_value = '10.1.0.42'
+        zk = mock_zk.return_value = FakeKazooClient({'zookeeper': {}})
+        mock_is_serving.return_value = False
+        self._add_peers({'zookeeper-k8s/1': '10.1.0.43'})
+        self.harness.charm.on.config_changed.emit()
+
+        # Deferred until ZooKeeper serves:
+        kafka_rel_id = self.harness.add_relation('client', 'kafka')
+        self.harness.add_relation_unit(kafka_rel_id, 'kafka/0')
+        self.assertEqual(self.harness.get_relation_data(
+            kafka_rel_id, 'zookeeper-k8s')['ingress-addresses'],
+            '10.1.0.42,10.1.0.43')
+        self.assertNotIn('chroot', self.harness.get_relation_data(
+            kafka_rel_id, 'zookeeper-k8s'))
+        mock_is_serving.return_value = True
+
+        # Timing out is retried too:
+        mock_zk.return_value = Mock()
+        mock_zk.return_value.handler.timeout_exception = KazooTimeoutError
+        mock_zk.return_value.start.side_effect = KazooTimeoutError(
+            'Connection time-out')
+        self.harness.framework.reemit()
+        self.assertNotIn('chroot', self.harness.get_relation_data(
+            kafka_rel_id, 'zookeeper-k8s'))
+
+        mock_zk.return_value = zk
+        self.harness.framework.reemit()
+        self.assertEqual(self.harness.get_relation_data(
+            kafka_rel_id, 'zookeeper-k8s')['chroot'], '/clients/kafka')
+        self.assertIn('/clients/kafka', zk.nodes)
+
+        # Each application gets its own chroot:
+        solr_rel_id = self.harness.add_relation('client', 'solr')
+        self.harness.add_relation_unit(solr_rel_id, 'solr/0')
+        self.assertEqual(dict(self.harness.get_relation_data(
+            solr_rel_id, 'zookeeper-k8s')), {
+            'ingress-addresses': '10.1.0.42,10.1.0.43',
+            'client-port': '2181',
+            'chroot': '/clients/solr',
+            'znode-quota': '0',
+            'byte-quota': '0',
+            'zone-addresses': '{}',
+            'local-sessions': 'false',
+            'local-sessions-upgrading': 'false',
+            'read-only': 'false',
+        })
+
+        self.harness.update_config({'client-znode-quota': 1000})
+        for app in ('kafka', 'solr'):
+            self.assertEqual(
+                zk.nodes[f'/zookeeper/quota/clients/{app}/zookeeper_limits'],
+                b'count=1000,bytes=-1')
+        self.assertEqual(self.harness.get_relation_data(
+            solr_rel_id, 'zookeeper-k8s')['znode-quota'], '1000')
+
+    @patch('charms.zookeeper_k8s.v0.zookeeper.get_k8s_zone')
+    @patch('ops.model.Container.push')
+    @patch('charm.ZookeeperK8SCharm._get_my_ingress_address')
+    def test_client_zones(self, mock_my_address, mock_push, mock_k8s_zone):
+        mock_my_address.return_value = '10.1.0.42'
+        mock_k8s_zone.return_value = 'zone-a'
+        rel_id = self._add_peers({'zookeeper-k8s/1': '10.1.0.43',
+                                  'zookeeper-k8s/2': '10.1.0.44'})
+        self.harness.update_relation_data(rel_id, 'zookeeper-k8s/1', {
+            'zone': 'zone-b'})
+        client_rel_id = self.harness.add_relation('client', 'kafka')
+        self.harness.add_relation_unit(client_rel_id, 'kafka/0')
+        self.assertEqual(self.harness.get_relation_data(
+            rel_id, 'zookeeper-k8s/0')['zone'], 'zone-a')
+        # Units of unknown zone are left out:
+        self.assertEqual(json.loads(self.harness.get_relation_data(
+            client_rel_id, 'zookeeper-k8s')['zone-addresses']), {
+            'zone-a': ['10.1.0.42'], 'zone-b': ['10.1.0.43']})
+
+        # Looked up once, the config overrides it:
+        self.harness.update_config({'zone': 'zone-b'})
+        mock_k8s_zone.assert_called_once_with('test-model',
+                                              'zookeeper-k8s-0')
+        self.assertEqual(json.loads(self.harness.get_relation_data(
+            client_rel_id, 'zookeeper-k8s')['zone-addresses']), {
+            'zone-b': ['10.1.0.42', '10.1.0.43']})
+
+    @patch('ops.model.Container.push')
+    @patch('charm.ZookeeperK8SCharm._get_my_ingress_address')
+    def test_client_features(self, mock_my_address, mock_push):
+        mock_my_address.return_value = '10.1.0.42'
+        self._add_peers({})
+        client_rel_id = self.harness.add_relation('client', 'kafka')
+
+        self.harness.update_config({'local-sessions': True,
+                                    'local-sessions-upgrading': True,
+                                    'read-only-mode': True})
+        mock_push.assert_any_call(path='/conf/zoo.cfg', source=SuperstringOf([
+            'localSessionsEnabled=true\n',
+            'localSessionsUpgradingEnabled=true\n']))
+        container = self.harness.model.unit.get_container('zookeeper')
+        service = self.harness.charm._get_pebble_layer(container)[
+            'services']['zookeeper']
+        self.assertIn('-Dreadonlymode.enabled=true',
+                      service['environment']['SERVER_JVMFLAGS'].split())
+        client_data = self.harness.get_relation_data(client_rel_id,
+                                                     'zookeeper-k8s')
+        self.assertEqual(client_data['local-sessions'], 'true')
+        self.assertEqual(client_data['local-sessions-upgrading'], 'true')
+        self.assertEqual(client_data['read-only'], 'true')
+
+        self.harness.update_config({'local-sessions': False})
+        self.assertEqual(
+            self.harness.model.unit.status,
+            BlockedStatus('local-sessions-upgrading requires local-sessions'))
+
+    @patch('ops.model.Container.push')
+    @patch('charm.ZookeeperK8SCharm._get_my_ingress_address')
+    def test_observers(self, mock_my_address, mock_push):
+        mock_my_address.return_value = '10.1.0.42'
+        rel_id = self._add_peers({'zookeeper-k8s/1': '10.1.0.43',
+                                  'zookeeper-k8s/2': '10.1.0.44'})
+        client_rel_id = self.harness.add_relation('client', 'kafka')
+
+        self.harness.update_config({'voters': 2})
+        zoo_cfg = [c for c in mock_push.call_args_list
+                   if c[1]['path'] == '/conf/zoo.cfg'][-1][1]['source']
+        self.assertEqual(zoo_cfg, SuperstringOf([
+            'server.1=10.1.0.42:2888:3888\n', 'server.2=10.1.0.43:2888:3888\n',
+            'server.3=10.1.0.44:2888:3888:observer\n']))
+        self.assertNotIn('peerType', zoo_cfg)
+        # Observers serve reads too:
+        self.assertEqual(sorted(self.harness.get_relation_data(
+            client_rel_id, 'zookeeper-k8s')['ingress-addresses'].split(',')),
+            ['10.1.0.42', '10.1.0.43', '10.1.0.44'])
+
+        # The observer gets promoted when a voter leaves:
+        self.harness.remove_relation_unit(rel_id, 'zookeeper-k8s/1')
+        zoo_cfg = [c for c in mock_push.call_args_list
+                   if c[1]['path'] == '/conf/zoo.cfg'][-1][1]['source']
+        self.assertEqual(zoo_cfg, SuperstringOf([
+            'server.1=10.1.0.42:2888:3888\n',
+            'server.3=10.1.0.44:2888:3888\n']))
+        self.assertNotIn('server.2', zoo_cfg)
+
+        self.harness.update_config({'voters': 1})
+        zoo_cfg = [c for c in mock_push.call_args_list
+                   if c[1]['path'] == '/conf/zoo.cfg'][-1][1]['source']
+        self.assertIn('server.3=10.1.0.44:2888:3888:observer\n', zoo_cfg)
+
+    @patch('kazoo.client.KazooClient')
+    def test_dump_data_action(self, mock_zk):
+        mock_zk.return_value = FakeKazooClient({
+            'first-child': b'my value',
+            'second-child': b'my value',
+        })
+        action_event = Mock(params={})
 
         self.harness.charm._on_dump_data_action(action_event)
 
         mock_zk.assert_called_once_with(hosts='127.0.0.1:2181')
         action_event.set_results.assert_called_once_with({
             'content': {
-                'first-child': 'my value',
-                'second-child': 'my value',
+                'first-child': b'my value',
+                'second-child': b'my value',
             }
         })
 
-    @patch('charm.KazooClient')
+    @patch('kazoo.client.KazooClient')
+    def test_dump_data_action_subtree(self, mock_zk):
+        mock_zk.return_value = FakeKazooClient({
+            'a': {'b': {'c': b'too deep'}, 'd': b'my value'},
+            'e': b'not in subtree',
+        })
+        action_event = Mock(params={'path': '/a', 'max-depth': 1,
+                                    'include-stat': True})
+
+        self.harness.charm._on_dump_data_action(action_event)
+
+        content = action_event.set_results.call_args[0][0]['content']
+        self.assertEqual(content['b']['value'], b'')
+        self.assertEqual(content['d']['value'], b'my value')
+        self.assertEqual(content['d']['stat']['data-length'], 8)
+        # Juju rejects other action result keys:
+        for key in content['d']['stat']:
+            self.assertRegex(key, '^[a-z0-9]+(-[a-z0-9]+)*$')
+
+    @patch('kazoo.client.KazooClient')
+    def test_subtree_stats_action(self, mock_zk):
+        mock_zk.return_value = FakeKazooClient({
+            'a': {'b': b'12345', 'c': b''},
+            'd': b'1',
+        })
+        action_event = Mock(params={'top': 1})
+
+        self.harness.charm._on_subtree_stats_action(action_event)
+
+        results = action_event.set_results.call_args[0][0]
+        self.assertEqual(results['znodes'], 5)
+        self.assertEqual(results['bytes'], 6)
+        self.assertEqual(results['top'], {'1': {
+            'path': '/a', 'znodes': 3, 'bytes': 5, 'max-children': 2,
+            'ephemerals': 0}})
+        self.assertEqual(results['value-sizes'], {'0': 3, '1': 1, '8': 1})
+
+    @patch('kazoo.client.KazooClient')
+    def test_dump_data_action_to_file(self, mock_zk):
+        mock_zk.return_value = FakeKazooClient({
+            'a': {'b': b'\x00binary\xff'},
+        })
+        action_event = Mock(params={'output': 'file',
+                                    'output-path': '/backups/zoo.jsonl.gz'})
+
+        self.harness.charm._on_dump_data_action(action_event)
+
+        results = action_event.set_results.call_args[0][0]
+        self.assertEqual(results['path'], '/backups/zoo.jsonl.gz')
+        self.assertEqual(results['node-count'], 3)
+        container = self.harness.model.unit.get_container('zookeeper')
+        content = container.pull('/backups/zoo.jsonl.gz', encoding=None).read()
+        self.assertEqual(results['bytes'], len(content))
+        self.assertEqual(results['sha256'],
+                         hashlib.sha256(content).hexdigest())
+        records = [json.loads(line) for line in
+                   gzip.decompress(content).decode().splitlines()]
+        self.assertEqual([record['path'] for record in records],
+                         ['/', '/a', '/a/b'])
+        self.assertEqual(base64.b64decode(records[2]['value']),
+                         b'\x00binary\xff')
+        self.assertEqual(records[2]['stat']['dataLength'], 8)
+
+    @patch('kazoo.client.KazooClient')
+    def test_restore_data_action(self, mock_zk):
+        mock_zk.return_value = FakeKazooClient({'a': {'b': b'my value'}})
+        self.harness.charm._on_dump_data_action(Mock(params={
+            'output': 'file'}))
+        # Dumps default to the backups storage, away from the data:
+        container = self.harness.model.unit.get_container('zookeeper')
+        self.assertTrue(container.exists('/backups/dumps/dump.jsonl.gz'))
+
+        target = FakeKazooClient()
+        mock_zk.return_value = target
+        action_event = Mock(params={'dry-run': True})
+        self.harness.charm._on_restore_data_action(action_event)
+        results = action_event.set_results.call_args[0][0]
+        self.assertEqual(results['restorable'], 2)
+        self.assertEqual(results['created'], 0)
+        self.assertNotIn('/a', target.nodes)
+
+        action_event = Mock(params={})
+        self.harness.charm._on_restore_data_action(action_event)
+        results = action_event.set_results.call_args[0][0]
+        self.assertEqual(results['created'], 2)
+        self.assertEqual(results['ignored'], 1)
+        self.assertEqual(target.nodes['/a/b'], b'my value')
+
+    @patch('time.strftime')
+    def test_backup_actions(self, mock_strftime):
+        container = self.harness.model.unit.get_container('zookeeper')
+        container.add_layer('zookeeper', {'services': {'zookeeper': {
+            'override': 'replace', 'command': 'zkServer.sh',
+            'startup': 'enabled'}}})
+        container.autostart()
+        for path, content in [
+                ('/data/version-2/snapshot.100', b'snapshot'),
+                ('/data/version-2/snapshot.10', b'old snapshot'),
+                ('/data/version-2/acceptedEpoch', b'1'),
+                ('/data/version-2/currentEpoch', b'1'),
+                ('/datalog/version-2/log.1', b'too old'),
+                ('/datalog/version-2/log.50', b'txns 0x50 to 0x100'),
+                ('/datalog/version-2/log.101', b'txns 0x101')]:
+            container.push(path, content, make_dirs=True)
+
+        mock_strftime.return_value = '20211201T000000Z'
+        action_event = Mock(params={})
+        self.harness.charm._on_create_backup_action(action_event)
+        results = action_event.set_results.call_args[0][0]
+        self.assertEqual(results['files'], 5)
+        self.assertEqual(results['base'], '')
+        backup_dir = '/backups/20211201T000000Z'
+        self.assertEqual(sorted(f.name for f in container.list_files(
+            backup_dir)), [
+                'acceptedEpoch.gz', 'currentEpoch.gz', 'log.101.gz',
+                'log.50.gz', 'manifest.json', 'snapshot.100.gz'])
+        self.assertEqual(gzip.decompress(container.pull(
+            backup_dir + '/snapshot.100.gz', encoding=None).read()),
+            b'snapshot')
+
+        container.push('/datalog/version-2/log.101', b'txns 0x101 to 0x200')
+        container.push('/datalog/version-2/log.201', b'txns 0x201')
+        mock_strftime.return_value = '20211202T000000Z'
+        action_event = Mock(params={'incremental': True})
+        self.harness.charm._on_create_backup_action(action_event)
+        results = action_event.set_results.call_args[0][0]
+        self.assertEqual(results['base'], '20211201T000000Z')
+        manifest = json.loads(container.pull(
+            '/backups/20211202T000000Z/manifest.json').read())
+        self.assertEqual([f['path'] for f in manifest['files']], [
+            '/data/version-2/acceptedEpoch', '/data/version-2/currentEpoch',
+            '/datalog/version-2/log.101', '/datalog/version-2/log.201'])
+
+        # Backup IDs have a one second resolution:
+        action_event = Mock(params={'incremental': True})
+        self.harness.charm._on_create_backup_action(action_event)
+        action_event.fail.assert_called_once_with(
+            'Backup 20211202T000000Z already exists, try again in a second')
+
+        container.push('/data/version-2/snapshot.300', b'unwanted')
+        action_event = Mock(params={})
+        self.harness.charm._on_restore_backup_action(action_event)
+        results = action_event.set_results.call_args[0][0]
+        self.assertEqual(results['restored-backups'],
+                         '20211201T000000Z,20211202T000000Z')
+        self.assertEqual(sorted(f.name for f in container.list_files(
+            '/data/version-2')), [
+                'acceptedEpoch', 'currentEpoch', 'snapshot.100'])
+        self.assertEqual(sorted(f.name for f in container.list_files(
+            '/datalog/version-2')), ['log.101', 'log.201', 'log.50'])
+        self.assertEqual(container.pull(
+            '/datalog/version-2/log.101', encoding=None).read(),
+            b'txns 0x101 to 0x200')
+        self.assertTrue(container.get_service('zookeeper').is_running())
+
+        action_event = Mock(params={'backup-id': 'missing'})
+        self.harness.charm._on_restore_backup_action(action_event)
+        action_event.fail.assert_called_once_with('Backup missing not found')
+
+        # A corrupted backup is refused before ZooKeeper is stopped:
+        container.push(backup_dir + '/log.50.gz',
+                       gzip.compress(b'txns 0x50 to 0x99'))
+        action_event = Mock(params={'backup-id': '20211201T000000Z'})
+        self.harness.charm._on_restore_backup_action(action_event)
+        self.assertRegex(action_event.fail.call_args[0][0],
+                         '^/datalog/version-2/log.50 of backup '
+                         '20211201T000000Z is corrupted')
+        self.assertTrue(container.get_service('zookeeper').is_running())
+        self.assertEqual(container.pull(
+            '/datalog/version-2/log.101', encoding=None).read(),
+            b'txns 0x101 to 0x200')
+
+        # Transactions since the latest backup were purged:
+        for name in ('log.50', 'log.101', 'log.201'):
+            container.remove_path(f'/datalog/version-2/{name}')
+        container.push('/data/version-2/snapshot.300', b'snapshot')
+        container.push('/datalog/version-2/log.301', b'txns 0x301')
+        mock_strftime.return_value = '20211203T000000Z'
+        action_event = Mock(params={'incremental': True})
+        self.harness.charm._on_create_backup_action(action_event)
+        results = action_event.set_results.call_args[0][0]
+        self.assertEqual(results['base'], '')
+        manifest = json.loads(container.pull(
+            '/backups/20211203T000000Z/manifest.json').read())
+        self.assertIn('/data/version-2/snapshot.300',
+                      [f['path'] for f in manifest['files']])
+
+    @patch('kazoo.client.KazooClient')
     def test_seed_data_action(self, mock_zk):
         action_event = Mock()
 
@@ -98,18 +750,50 @@ class TestCharm(unittest.TestCase):
                     "summary": "zookeeper",
                     "command": "/docker-entrypoint.sh zkServer.sh start-foreground",
                     "startup": "enabled",
+                    "environment": {
+                        "SERVER_JVMFLAGS": (
+                            "-Djute.maxbuffer=1048575 -XX:+UseG1GC "
+                            "-XX:MaxGCPauseMillis=50 "
+                            "-XX:+ParallelRefProcEnabled"),
+                    },
                 }
             },
         }
+        expected_checks = {
+            "zookeeper-ready": {
+                "override": "replace",
+                "level": "ready",
+                "period": "10s",
+                "timeout": "3s",
+                "threshold": 3,
+                "exec": {
+                    "command": (
+                        "bash -c 'exec 3<>/dev/tcp/127.0.0.1/2181 && "
+                        "echo srvr >&3 && grep -q ^Mode: <&3'"),
+                },
+            }
+        }
         # Get the zookeeper container from the model
         container = self.harness.model.unit.get_container("zookeeper")
-        # Emit the PebbleReadyEvent carrying the zookeeper container
+        # Emit the PebbleReadyEvent carrying the zookeeper container, which
+        # is deferred until storage is attached
         self.harness.charm.on.zookeeper_pebble_ready.emit(container)
+        self.assertEqual(
+            self.harness.get_container_pebble_plan("zookeeper").to_dict(),
+            {})
+        self.assertEqual(self.harness.model.unit.status, WaitingStatus(
+            'Waiting for storage: data, datalog'))
+        self._attach_storages()
+        self.harness.framework.reemit()
         # Get the plan now we've run PebbleReady
         updated_plan = self.harness.get_container_pebble_plan(
             "zookeeper").to_dict()
         # Check we've got the plan we expected
         self.assertEqual(expected_plan, updated_plan)
+        # Harness doesn't render checks in plans
+        self.assertEqual(
+            self.harness.charm._get_pebble_layer(container)['checks'],
+            expected_checks)
         # Check the service was started
         service = self.harness.model.unit.get_container(
             "zookeeper").get_service("zookeeper")
@@ -123,6 +807,147 @@ class TestCharm(unittest.TestCase):
             call(path='/data/myid', source=SuperstringOf(['1']))
         ], any_order=True)
 
+    def test_purge_action(self):
+        container = self.harness.model.unit.get_container('zookeeper')
+        for path, content in [
+                ('/data/version-2/snapshot.10', b'old snapshot'),
+                ('/data/version-2/snapshot.100', b'snapshot'),
+                ('/datalog/version-2/log.1', b'too old'),
+                ('/datalog/version-2/log.50', b'txns 0x50 to 0x100')]:
+            container.push(path, content, make_dirs=True)
+
+        def _exec(command, **kwargs):
+            self.assertEqual(command, ['zkCleanup.sh', '-n', '3'])
+            container.remove_path('/data/version-2/snapshot.10')
+            container.remove_path('/datalog/version-2/log.1')
+            return Mock(**{'wait_output.return_value': ('', '')})
+
+        with patch('ops.model.Container.exec', create=True) as mock_exec:
+            mock_exec.side_effect = _exec
+            action_event = Mock(params={})
+            self.harness.charm._on_purge_action(action_event)
+        action_event.set_results.assert_called_once_with({
+            'removed-files': 2,
+            'removed-bytes': 19,
+            'data-bytes': 8,
+            'datalog-bytes': 18,
+        })
+
+    @patch('ops.model.Container.push')
+    @patch('charm.ZookeeperK8SCharm._ZookeeperK8SCharm__get_snapshot_size')
+    @patch('charm.ZookeeperK8SCharm._share_address_with_peers')
+    @patch('charm.ZookeeperK8SCharm._get_my_ingress_address')
+    def test_large_snapshot(self, mock_my_address, mock_share_address,
+                            mock_snapshot_size, mock_push):
+        mock_my_address.return_value = '10.1.0.42'
+        # 20s at the assumed transfer rate, twice the default
+        # initLimit * tickTime:
+        mock_snapshot_size.return_value = 400 * 1024 * 1024
+        self._attach_storages()
+        container = self.harness.model.unit.get_container('zookeeper')
+        self.harness.charm.on.zookeeper_pebble_ready.emit(container)
+        # Only warn, the server still starts with the config it has:
+        self.assertTrue(container.get_service('zookeeper').is_running())
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus(
+            'init-limit may be too low for 400 MiB snapshots, consider '
+            '>= 10'))
+        self.harness.update_config({'init-limit': 10})
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    @patch('zk_admin.get_leader_address')
+    @patch('zk_admin.get_server_stats')
+    @patch('ops.model.Container.push')
+    @patch('charm.ZookeeperK8SCharm._get_my_ingress_address')
+    def test_update_status(self, mock_my_address, mock_push, mock_stats,
+                           mock_leader_address):
+        mock_my_address.return_value = '10.1.0.42'
+        self._add_peers({})
+        self._attach_storages()
+        # Allocates this unit's server ID:
+        self.harness.charm.on.config_changed.emit()
+
+        # Nothing to report before ZooKeeper is started:
+        self.harness.charm.on.update_status.emit()
+        mock_stats.assert_not_called()
+
+        container = self.harness.model.unit.get_container('zookeeper')
+        self.harness.charm.on.zookeeper_pebble_ready.emit(container)
+        stats = {'server_state': 'follower', 'avg_latency': 0.5,
+                 'max_latency': 12, 'num_alive_client_connections': 3,
+                 'last_processed_zxid': 0x200000010}
+        leader_stats = dict(stats, server_state='leader',
+                            last_processed_zxid=0x200000015)
+        mock_stats.side_effect = lambda host='127.0.0.1': (
+            leader_stats if host == '10.1.0.43' else stats)
+        mock_leader_address.return_value = '10.1.0.43'
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus(
+            'follower, zxid lag 5, latency avg/max 0.5/12 ms, '
+            '3 connections, data 0.0 MiB, datalog 0.0 MiB'))
+
+        # Still on the former epoch:
+        leader_stats['last_processed_zxid'] = 0x300000001
+        with patch('charm.ZookeeperK8SCharm._ZookeeperK8SCharm__'
+                   'get_storage_usage') as mock_usage:
+            mock_usage.return_value = {
+                '/data/version-2': (1, 0),
+                '/datalog/version-2': (1, 512 * 1024)}
+            self.harness.charm.on.update_status.emit()
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus(
+            'follower, zxid lag unknown, latency avg/max 0.5/12 ms, '
+            '3 connections, data 0.0 MiB, datalog 0.5 MiB'))
+
+        stats['server_state'] = 'looking'
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(self.harness.model.unit.status,
+                         WaitingStatus('ZooKeeper is not serving (looking)'))
+
+        mock_stats.side_effect = None
+        mock_stats.return_value = None
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(self.harness.model.unit.status,
+                         WaitingStatus('ZooKeeper is not responding'))
+
+        container.stop('zookeeper')
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(self.harness.model.unit.status,
+                         BlockedStatus('ZooKeeper is not running'))
+
+    @patch('ops.model.Container.push')
+    @patch('charm.ZookeeperK8SCharm._get_my_ingress_address')
+    def test_jvm_sizing(self, mock_my_address, mock_push):
+        mock_my_address.return_value = '10.1.0.42'
+        self._add_peers({})
+        self._attach_storages()
+        # Allocates this unit's server ID:
+        self.harness.charm.on.config_changed.emit()
+        cgroup_files = {
+            '/sys/fs/cgroup/memory.max': '2147483648\n',
+            '/sys/fs/cgroup/cpu.max': '250000 100000\n',
+        }
+        container = self.harness.model.unit.get_container('zookeeper')
+        with patch('ops.model.Container.exists') as mock_exists, patch(
+                'ops.model.Container.pull') as mock_pull:
+            mock_exists.side_effect = lambda path: path in cgroup_files
+            mock_pull.side_effect = lambda path: io.StringIO(
+                cgroup_files[path])
+            self.harness.charm.on.zookeeper_pebble_ready.emit(container)
+        jvm_flags = self.harness.get_container_pebble_plan(
+            'zookeeper').to_dict()['services']['zookeeper']['environment'][
+                'SERVER_JVMFLAGS'].split()
+        self.assertIn('-Xms1024m', jvm_flags)
+        self.assertIn('-Xmx1024m', jvm_flags)
+        self.assertIn('-XX:ParallelGCThreads=3', jvm_flags)
+
+        # Explicit settings take precedence:
+        self.harness.update_config({
+            'heap-size': '3g', 'jvm-flags': '-XX:MaxGCPauseMillis=20'})
+        jvm_flags = self.harness.get_container_pebble_plan(
+            'zookeeper').to_dict()['services']['zookeeper']['environment'][
+                'SERVER_JVMFLAGS'].split()
+        self.assertIn('-Xmx3g', jvm_flags)
+        self.assertEqual(jvm_flags[-1], '-XX:MaxGCPauseMillis=20')
+
 
 class SuperstringOf:
     """Mock argument matcher that will match any superstring of the given
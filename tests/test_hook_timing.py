@@ -0,0 +1,51 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import unittest
+from unittest.mock import patch
+
+import hook_timing
+
+
+class Backend:
+    def relation_get(self, key):
+        return key.upper()
+
+    def fail(self):
+        raise ValueError()
+
+
+class TestHookTimer(unittest.TestCase):
+    @patch.dict('os.environ', {'JUJU_DISPATCH_PATH': 'hooks/config-changed'})
+    def test_instrument(self):
+        timer = hook_timing.HookTimer(hook_timing.get_hook_name())
+        backend = Backend()
+        timer.instrument(backend, hook_timing.JUJU_TOOL)
+
+        with self.assertLogs('hook_timing', 'DEBUG') as logs:
+            self.assertEqual(backend.relation_get('foo'), 'FOO')
+            self.assertEqual(backend.relation_get('bar'), 'BAR')
+            with self.assertRaises(ValueError):
+                backend.fail()
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['hook'], 'config-changed')
+        self.assertEqual(record['kind'], 'juju-tool')
+        self.assertEqual(record['name'], 'relation_get')
+
+        summary = timer.get_summary()
+        self.assertEqual(summary['hook'], 'config-changed')
+        self.assertEqual(sorted((call['name'], call['count'])
+                                for call in summary['calls']),
+                         [('fail', 1), ('relation_get', 2)])
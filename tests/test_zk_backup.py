@@ -0,0 +1,63 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import unittest
+
+import zk_backup
+
+
+class TestBackup(unittest.TestCase):
+    def test_select_files(self):
+        snapshots = ['snapshot.0', 'snapshot.1f', 'snapshot.a']
+        logs = ['log.b', 'log.1', 'log.20', 'log.1e']
+        self.assertEqual(zk_backup.select_files(snapshots, logs),
+                         ('snapshot.1f', ['log.1e', 'log.20']))
+        self.assertEqual(zk_backup.select_files([], logs),
+                         (None, ['log.1', 'log.b', 'log.1e', 'log.20']))
+        self.assertEqual(
+            zk_backup.select_files(snapshots, logs, since_zxid=0x1e),
+            (None, ['log.1e', 'log.20']))
+        # The log holding the transactions following the base was purged:
+        with self.assertRaises(ValueError):
+            zk_backup.select_files(snapshots, ['log.20', 'log.30'],
+                                   since_zxid=0x1e)
+
+    def test_streams_round_trip(self):
+        content = os.urandom(zk_backup.CHUNK_SIZE * 2 + 123)
+        compressed = zk_backup.CompressingStream(io.BytesIO(content))
+        chunks = []
+        while True:
+            chunk = compressed.read(1000)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.assertEqual(compressed.raw_byte_count, len(content))
+
+        decompressed = zk_backup.DecompressingStream(
+            io.BytesIO(b''.join(chunks)))
+        self.assertEqual(decompressed.read(), content)
+        self.assertEqual(decompressed.byte_count, len(content))
+
+    def test_restore_chain(self):
+        manifests = {'1': {'base': None}, '2': {'base': '1'},
+                     '3': {'base': '2'}, '5': {'base': '4'}}
+        self.assertEqual(zk_backup.get_restore_chain(manifests, '3'),
+                         ['1', '2', '3'])
+        with self.assertRaises(ValueError):
+            zk_backup.get_restore_chain(manifests, '5')
+        manifests['1']['base'] = '3'
+        with self.assertRaises(ValueError):
+            zk_backup.get_restore_chain(manifests, '3')
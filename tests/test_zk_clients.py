@@ -0,0 +1,43 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import zk_clients
+
+from tests.fake_kazoo import FakeKazooClient
+
+
+class TestClients(unittest.TestCase):
+    def test_set_quota(self):
+        zk = FakeKazooClient({'zookeeper': {}, 'clients': {'foo': {}}})
+        limits_path = '/zookeeper/quota/clients/foo/zookeeper_limits'
+        stats_path = '/zookeeper/quota/clients/foo/zookeeper_stats'
+
+        zk_clients.set_quota(zk, '/clients/foo', znode_count=100)
+        self.assertEqual(zk.nodes[limits_path], b'count=100,bytes=-1')
+        self.assertEqual(zk.nodes[stats_path], b'count=0,bytes=0')
+
+        zk.nodes[stats_path] = b'count=10,bytes=50'
+        zk_clients.set_quota(zk, '/clients/foo', znode_count=100,
+                             byte_count=1000)
+        self.assertEqual(zk.nodes[limits_path], b'count=100,bytes=1000')
+        # Maintained by ZooKeeper:
+        self.assertEqual(zk.nodes[stats_path], b'count=10,bytes=50')
+
+        zk_clients.set_quota(zk, '/clients/foo')
+        self.assertNotIn(limits_path, zk.nodes)
+        self.assertNotIn(stats_path, zk.nodes)
+        # Removing a quota which isn't set is fine:
+        zk_clients.set_quota(zk, '/clients/foo')
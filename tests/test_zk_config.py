@@ -0,0 +1,64 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import yaml
+
+import zk_config
+
+
+def _get_default_config():
+    with open('config.yaml') as config_file:
+        options = yaml.safe_load(config_file)['options']
+    return {name: option.get('default') for name, option in options.items()}
+
+
+class TestValidate(unittest.TestCase):
+    def setUp(self):
+        self.config = _get_default_config()
+
+    def test_defaults_valid(self):
+        self.assertEqual(zk_config.validate(self.config), [])
+
+    def test_ranges(self):
+        self.config['tick-time'] = 0
+        self.config['jute-max-buffer'] = 10
+        self.assertEqual(zk_config.validate(self.config), [
+            'tick-time must be >= 1', 'jute-max-buffer must be >= 1024'])
+
+    def test_connection_throttle(self):
+        self.config['connection-throttle-fill-count'] = 10
+        self.assertEqual(zk_config.validate(self.config), [])
+        self.config['connection-throttle-tokens'] = 5
+        self.assertEqual(zk_config.validate(self.config), [
+            'connection-throttle-fill-count must be <= '
+            'connection-throttle-tokens'])
+
+    def test_init_limit_against_snapshot_size(self):
+        # 10s at the assumed transfer rate:
+        snapshot_size = 10 * zk_config.SNAPSHOT_TRANSFER_RATE
+        # Default initLimit * tickTime is 10s:
+        self.assertEqual(
+            zk_config.get_warnings(self.config, snapshot_size), [])
+        self.config['tick-time'] = 1000
+        # Only a warning, the config remains valid:
+        self.assertEqual(zk_config.validate(self.config), [])
+        self.assertEqual(
+            zk_config.get_warnings(self.config, snapshot_size), [
+                'init-limit may be too low for 200 MiB snapshots, consider '
+                '>= 10'])
+        self.config['init-limit'] = 10
+        self.assertEqual(
+            zk_config.get_warnings(self.config, snapshot_size), [])
@@ -0,0 +1,104 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import unittest
+from unittest.mock import patch
+
+import zk_dump
+import zk_tree
+
+from tests.fake_kazoo import FakeKazooClient
+
+
+class TestDump(unittest.TestCase):
+    def setUp(self):
+        self.source = FakeKazooClient({
+            'a': {'b': {'c': b'c value'}, 'd': b'd value'},
+            'e': b'\x00\xff',
+            'zookeeper': {'quota': b''},
+        })
+
+    def _dump(self, **kwargs):
+        stream = zk_dump.DumpStream(zk_tree.walk_tree(self.source, **kwargs))
+        dump_file = io.BytesIO()
+        while True:
+            chunk = stream.read(7)
+            if not chunk:
+                break
+            dump_file.write(chunk)
+        dump_file.seek(0)
+        return stream, dump_file
+
+    def test_round_trip(self):
+        stream, dump_file = self._dump()
+        self.assertEqual(stream.node_count, 8)
+        self.assertEqual(stream.byte_count, len(dump_file.getvalue()))
+
+        records = list(zk_dump.read_records(dump_file))
+        self.assertEqual(records[0]['path'], '/')
+        self.assertEqual(
+            {r['path']: r['value'] for r in records}['/e'], b'\x00\xff')
+
+        target = FakeKazooClient()
+        report = zk_dump.load_records(target, records, batch_size=2,
+                                      max_in_flight=2)
+        self.assertEqual(report, zk_dump.LoadReport(
+            created=5, existing=0, ignored=3))
+        self.assertEqual(target.nodes['/a/b/c'], b'c value')
+        self.assertNotIn('/zookeeper/quota', target.nodes)
+
+    def test_load_existing_and_subtree(self):
+        _, dump_file = self._dump(path='/a/b')
+        target = FakeKazooClient({'a': {'d': b'other value'}})
+
+        report = zk_dump.load_records(
+            target, zk_dump.read_records(dump_file))
+
+        self.assertEqual(report, zk_dump.LoadReport(
+            created=2, existing=0, ignored=0))
+        self.assertEqual(target.nodes['/a/b/c'], b'c value')
+
+        dump_file.seek(0)
+        report = zk_dump.load_records(
+            target, zk_dump.read_records(dump_file))
+        self.assertEqual(report, zk_dump.LoadReport(
+            created=0, existing=2, ignored=0))
+
+        # The missing parents of the subtree are created too:
+        dump_file.seek(0)
+        target = FakeKazooClient()
+        report = zk_dump.load_records(
+            target, zk_dump.read_records(dump_file))
+        self.assertEqual(report, zk_dump.LoadReport(
+            created=2, existing=0, ignored=0))
+        self.assertEqual(target.nodes['/a/b/c'], b'c value')
+
+    def test_resume(self):
+        self.source = FakeKazooClient({
+            'a': {str(i): b'value' for i in range(20)}})
+        _, dump_file = self._dump()
+        records = list(zk_dump.read_records(dump_file))
+        target = FakeKazooClient()
+        zk_dump.load_records(target, records[:12], batch_size=5)
+
+        # Only the missing znodes are created again, in batches too:
+        with patch.object(target, 'create', wraps=target.create) as create:
+            report = zk_dump.load_records(target, records, batch_size=5)
+        self.assertEqual(report, zk_dump.LoadReport(
+            created=10, existing=11, ignored=1))
+        self.assertEqual(sorted(target.children['/a']),
+                         sorted(str(i) for i in range(20)))
+        for create_call in create.call_args_list:
+            self.assertNotIn('makepath', create_call[1])
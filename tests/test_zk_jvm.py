@@ -0,0 +1,52 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import zk_jvm
+
+
+class TestJvm(unittest.TestCase):
+    def test_cgroup_v2(self):
+        files = {
+            '/sys/fs/cgroup/memory.max': '4294967296\n',
+            '/sys/fs/cgroup/cpu.max': 'max 100000\n',
+        }
+        self.assertEqual(zk_jvm.get_resources(files.get),
+                         zk_jvm.Resources(memory_limit=4294967296,
+                                          cpu_limit=None))
+
+    def test_cgroup_v1(self):
+        files = {
+            '/sys/fs/cgroup/memory/memory.limit_in_bytes':
+                '9223372036854771712\n',
+            '/sys/fs/cgroup/cpu/cpu.cfs_quota_us': '50000\n',
+            '/sys/fs/cgroup/cpu/cpu.cfs_period_us': '100000\n',
+        }
+        self.assertEqual(zk_jvm.get_resources(files.get),
+                         zk_jvm.Resources(memory_limit=None, cpu_limit=0.5))
+
+    def test_jvm_flags(self):
+        self.assertEqual(zk_jvm.get_jvm_flags(
+            zk_jvm.Resources(memory_limit=None, cpu_limit=None)), [
+                '-XX:+UseG1GC', '-XX:MaxGCPauseMillis=50',
+                '-XX:+ParallelRefProcEnabled'])
+        flags = zk_jvm.get_jvm_flags(
+            zk_jvm.Resources(memory_limit=100 * 1024 ** 3, cpu_limit=0.5))
+        # Capped to keep compressed object pointers:
+        self.assertIn('-Xmx31744m', flags)
+        self.assertIn('-XX:ActiveProcessorCount=1', flags)
+        self.assertIn('-Xmx2g', zk_jvm.get_jvm_flags(
+            zk_jvm.Resources(memory_limit=1024 ** 3, cpu_limit=None),
+            heap_size='2g'))
@@ -0,0 +1,59 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import zk_stats
+import zk_tree
+
+from tests.fake_kazoo import FakeKazooClient
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        self.zk = FakeKazooClient({
+            'small': {'a': b'x', 'b': b''},
+            'big': {'c': {'d': b'x' * 1000, 'e': b'x' * 5}, 'f': b'x' * 100},
+            'leaf': b'x' * 10,
+        })
+
+    def test_size_bucket(self):
+        self.assertEqual([zk_stats.get_size_bucket(size)
+                          for size in (0, 1, 2, 3, 4, 5, 1024, 1025)],
+                         [0, 1, 2, 4, 4, 8, 1024, 2048])
+
+    def test_compute_stats(self):
+        for max_in_flight in (1, 3, 64):
+            total, top, histogram = zk_stats.compute_stats(
+                zk_tree.walk_tree(self.zk, max_in_flight=max_in_flight,
+                                  depth_first=True), top_count=2)
+            self.assertEqual(total, zk_stats.SubtreeStats(
+                '/', 10, 1116, 3, 0))
+            self.assertEqual(top, [
+                zk_stats.SubtreeStats('/big', 5, 1105, 2, 0),
+                zk_stats.SubtreeStats('/leaf', 1, 10, 0, 0),
+            ])
+            self.assertEqual(histogram, {0: 5, 1: 1, 8: 1, 16: 1, 128: 1,
+                                         1024: 1})
+
+    def test_group_depth(self):
+        _, top, _ = zk_stats.compute_stats(
+            zk_tree.walk_tree(self.zk, '/big', depth_first=True),
+            group_depth=2)
+        self.assertEqual([stats.path for stats in top],
+                         ['/big/c/d', '/big/c/e'])
+        _, top, _ = zk_stats.compute_stats(
+            zk_tree.walk_tree(self.zk, '/big', depth_first=True),
+            group_depth=0)
+        self.assertEqual(top, [zk_stats.SubtreeStats('/big', 5, 1105, 2, 0)])
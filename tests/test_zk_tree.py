@@ -0,0 +1,71 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import zk_tree
+
+from kazoo.exceptions import NoNodeError
+
+from tests.fake_kazoo import FakeKazooClient
+
+
+class TestWalkTree(unittest.TestCase):
+    def setUp(self):
+        self.zk = FakeKazooClient({
+            'a': {'b': {'c': b'c value'}, 'd': b'd value'},
+            'e': b'e value',
+        })
+
+    def test_breadth_first(self):
+        paths = [node.path for node in zk_tree.walk_tree(
+            self.zk, max_in_flight=2)]
+        self.assertEqual(paths, ['/', '/a', '/e', '/a/b', '/a/d', '/a/b/c'])
+
+    def test_depth_first(self):
+        paths = [node.path for node in zk_tree.walk_tree(
+            self.zk, max_in_flight=1, depth_first=True)]
+        self.assertEqual(paths, ['/', '/a', '/a/b', '/a/b/c', '/a/d', '/e'])
+
+    def test_max_depth(self):
+        nodes = list(zk_tree.walk_tree(self.zk, '/a', max_depth=1))
+        self.assertEqual([node.path for node in nodes],
+                         ['/a', '/a/b', '/a/d'])
+        self.assertEqual(nodes[1].children, [])
+        self.assertEqual(nodes[2].value, b'd value')
+
+    def test_deleted_node_skipped(self):
+        original_get_async = self.zk.get_async
+
+        def get_async(path, watch=None):
+            if path == '/a/d':
+                return FailingResult()
+            return original_get_async(path)
+
+        self.zk.get_async = get_async
+        paths = [node.path for node in zk_tree.walk_tree(self.zk)]
+        self.assertNotIn('/a/d', paths)
+        self.assertIn('/a/b/c', paths)
+
+    def test_nodes_to_dict(self):
+        content = zk_tree.nodes_to_dict(zk_tree.walk_tree(self.zk))
+        self.assertEqual(content, {
+            'a': {'b': {'c': b'c value'}, 'd': b'd value'},
+            'e': b'e value',
+        })
+
+
+class FailingResult:
+    def get(self):
+        raise NoNodeError()
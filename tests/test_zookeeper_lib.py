@@ -0,0 +1,156 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import unittest
+from unittest.mock import mock_open, patch
+
+from charms.zookeeper_k8s.v0.zookeeper import (
+    ZookeeperRelationCharmEvents, ZookeeperRequires, get_k8s_zone,
+    get_unit_zone)
+from ops.charm import CharmBase
+from ops.framework import StoredState
+from ops.testing import Harness
+
+METADATA = '''
+name: zookeeper-client
+requires:
+  zookeeper:
+    interface: zookeeper
+'''
+
+
+class ZookeeperClientCharm(CharmBase):
+    on = ZookeeperRelationCharmEvents()
+    _stored = StoredState()
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.zookeeper = ZookeeperRequires(self, self._stored, zone='zone-b')
+        self.framework.observe(self.on.zookeeper_relation_updated,
+                               self._on_zookeeper_relation_updated)
+        self.events = []
+
+    def _on_zookeeper_relation_updated(self, event):
+        self.events.append((event.added_servers, event.removed_servers))
+
+
+class TestZookeeperRequires(unittest.TestCase):
+    def setUp(self):
+        self.harness = Harness(ZookeeperClientCharm, meta=METADATA)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+        self.rel_id = self.harness.add_relation('zookeeper', 'zookeeper-k8s')
+        self.harness.add_relation_unit(self.rel_id, 'zookeeper-k8s/0')
+
+    def test_relation_updated(self):
+        # Nothing shared yet:
+        self.harness.update_relation_data(self.rel_id, 'zookeeper-k8s/0', {
+            'ingress-address': '10.1.0.42'})
+        self.assertEqual(self.harness.charm.events, [])
+        self.assertIsNone(self.harness.charm.zookeeper.connection_string)
+
+        # Non-leader units get the data too:
+        self.harness.update_relation_data(self.rel_id, 'zookeeper-k8s', {
+            'ingress-addresses': '10.1.0.42,10.1.0.43',
+            'client-port': '2181'})
+        self.assertEqual(self.harness.charm.events, [
+            (['10.1.0.42:2181', '10.1.0.43:2181'], [])])
+        self.assertEqual(self.harness.charm.zookeeper.connection_string,
+                         '10.1.0.42:2181,10.1.0.43:2181')
+
+        # Unrelated changes don't emit anything:
+        self.harness.update_relation_data(self.rel_id, 'zookeeper-k8s', {
+            'znode-quota': '0'})
+        self.assertEqual(len(self.harness.charm.events), 1)
+
+        self.harness.update_relation_data(self.rel_id, 'zookeeper-k8s', {
+            'ingress-addresses': '10.1.0.43,10.1.0.44',
+            'chroot': '/clients/zookeeper-client'})
+        self.assertEqual(self.harness.charm.events[-1],
+                         (['10.1.0.44:2181'], ['10.1.0.42:2181']))
+        self.assertEqual(self.harness.charm.zookeeper.connection_string,
+                         '10.1.0.43:2181,10.1.0.44:2181'
+                         '/clients/zookeeper-client')
+
+    def test_same_zone_first(self):
+        self.harness.update_relation_data(self.rel_id, 'zookeeper-k8s', {
+            'ingress-addresses': '10.1.0.42,10.1.0.43,10.1.0.44',
+            'client-port': '2181'})
+        self.assertEqual(len(self.harness.charm.events), 1)
+
+        # Zones changing emit an event too:
+        self.harness.update_relation_data(self.rel_id, 'zookeeper-k8s', {
+            'zone-addresses': json.dumps({'zone-a': ['10.1.0.42'],
+                                          'zone-b': ['10.1.0.44']})})
+        self.assertEqual(self.harness.charm.events[-1], ([], []))
+        self.assertEqual(self.harness.charm.zookeeper.connection_string,
+                         '10.1.0.44:2181,10.1.0.42:2181,10.1.0.43:2181')
+
+    def test_features(self):
+        self.harness.update_relation_data(self.rel_id, 'zookeeper-k8s', {
+            'ingress-addresses': '10.1.0.42',
+            'client-port': '2181'})
+        zookeeper = self.harness.charm.zookeeper
+        # Older providers don't share them:
+        self.assertFalse(zookeeper.local_sessions_enabled)
+        self.assertFalse(zookeeper.read_only_enabled)
+
+        self.harness.update_relation_data(self.rel_id, 'zookeeper-k8s', {
+            'local-sessions': 'true',
+            'local-sessions-upgrading': 'false',
+            'read-only': 'true'})
+        self.assertEqual(len(self.harness.charm.events), 2)
+        self.assertTrue(zookeeper.local_sessions_enabled)
+        self.assertFalse(zookeeper.local_sessions_upgrading_enabled)
+        self.assertTrue(zookeeper.read_only_enabled)
+
+    @patch('charms.zookeeper_k8s.v0.zookeeper.get_k8s_zone')
+    def test_unit_zone_retried(self, mock_k8s_zone):
+        model = self.harness.charm.model
+        stored = self.harness.charm._stored
+        # e.g. before `juju trust`:
+        mock_k8s_zone.return_value = None
+        self.assertIsNone(get_unit_zone(model, stored))
+        mock_k8s_zone.return_value = 'zone-a'
+        self.assertEqual(get_unit_zone(model, stored), 'zone-a')
+        self.assertEqual(get_unit_zone(model, stored), 'zone-a')
+        self.assertEqual(mock_k8s_zone.call_count, 2)
+
+
+class TestGetK8sZone(unittest.TestCase):
+    @patch.dict('os.environ', {'KUBERNETES_SERVICE_HOST': '10.152.183.1'})
+    @patch('builtins.open', mock_open(read_data='token\n'))
+    @patch('ssl.create_default_context')
+    @patch('urllib.request.urlopen')
+    def test_get_k8s_zone(self, mock_urlopen, mock_ssl):
+        def _urlopen(request, **kwargs):
+            self.assertEqual(request.get_header('Authorization'),
+                             'Bearer token')
+            if request.full_url.endswith('/pods/zookeeper-k8s-0'):
+                body = {'spec': {'nodeName': 'node-1'}}
+            else:
+                self.assertTrue(request.full_url.endswith('/nodes/node-1'))
+                body = {'metadata': {'labels': labels}}
+            return io.BytesIO(json.dumps(body).encode())
+        mock_urlopen.side_effect = _urlopen
+
+        labels = {'topology.kubernetes.io/zone': 'zone-a'}
+        self.assertEqual(get_k8s_zone('model', 'zookeeper-k8s-0'), 'zone-a')
+        labels = {}
+        self.assertEqual(get_k8s_zone('model', 'zookeeper-k8s-0'), 'node-1')
+
+        mock_urlopen.side_effect = OSError('Forbidden')
+        self.assertIsNone(get_k8s_zone('model', 'zookeeper-k8s-0'))